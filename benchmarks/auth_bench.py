@@ -0,0 +1,86 @@
+# benchmarks/auth_bench.py
+
+"""
+Microbenchmark de la latencia de admisión de /analyze con la caché de tokens activada y desactivada.
+
+Ejecuta dos veces la prueba de carga (benchmarks/load_test.py) con generaciones muy cortas, de
+modo que la latencia medida la domina la verificación del Firebase ID token, y compara el p99 del
+tiempo hasta las cabeceras de respuesta. --auth-cpu simula el coste de la verificación RS256.
+
+Uso:
+    python -m benchmarks.auth_bench --clients 50 --requests 500 --auth-cpu 0.004 --output auth.json
+"""
+
+import sys
+import json
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional
+
+from benchmarks import load_test
+
+
+def _load_args(args: argparse.Namespace, auth_cache: bool) -> argparse.Namespace:
+    argv = [
+        "--clients", str(args.clients),
+        "--requests", str(args.requests),
+        "--users", str(args.users),
+        "--auth-cpu", str(args.auth_cpu),
+        "--ttft", "0.01",
+        "--output-tokens", "24",
+        "--no-retrieval",
+        "--no-analysis-cache",
+    ]
+    if not auth_cache:
+        argv.append("--no-auth-cache")
+    return load_test.parse_args(argv)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    runs: Dict[str, Any] = {}
+    for label, auth_cache in (("cache_off", False), ("cache_on", True)):
+        report = await load_test.run_load(_load_args(args, auth_cache))
+        runs[label] = {
+            "requests": report["requests"],
+            "admission_seconds": report["admission_seconds"],
+            "event_loop_lag_seconds": report["event_loop_lag_seconds"],
+            "auth": report["service"]["auth"],
+        }
+
+    def speedup(key: str) -> Optional[float]:
+        off = runs["cache_off"]["admission_seconds"][key]
+        on = runs["cache_on"]["admission_seconds"][key]
+        return (off / on) if off and on else None
+
+    # Con caché, el primer token de cada usuario sigue siendo un fallo: el p99 incluye esos fallos.
+    return {
+        "config": {"clients": args.clients, "requests": args.requests, "users": args.users, "auth_cpu": args.auth_cpu},
+        "runs": runs,
+        "admission_p50_speedup": speedup("p50"),
+        "admission_p99_speedup": speedup("p99"),
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Latencia de admisión de /analyze con y sin caché de tokens.")
+    parser.add_argument("--clients", type=int, default=50, help="Clientes SSE concurrentes")
+    parser.add_argument("--requests", type=int, default=500, help="Peticiones totales por ejecución")
+    parser.add_argument("--users", type=int, default=20, help="Usuarios distintos (tokens) entre los que se reparten")
+    parser.add_argument("--auth-cpu", type=float, default=0.004, help="CPU simulada por verificación de token (s)")
+    parser.add_argument("--output", help="Fichero JSON de resultados (por defecto, salida estándar)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    output = json.dumps(asyncio.run(run(args)), indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+# benchmarks/delete_bench.py
+
+"""
+Benchmark del borrado recursivo de Firestore (firestore_client.delete_document_recursive)
+frente al bucle anterior (un delete() por mensaje), sobre el Firestore en memoria de
+benchmarks/fakes.py con latencia por operación.
+
+Escenarios:
+    - conversation: una conversación con --messages mensajes (bucle anterior y borrado por lotes).
+    - prequalifications: --prequalifications precalificaciones con --followups mensajes de
+      seguimiento cada una (subcolecciones anidadas; solo el borrado por lotes).
+
+Uso:
+    python -m benchmarks.delete_bench --messages 5000 --latency 0.01 --output delete.json
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional
+
+from benchmarks.fakes import FakeBackendConfig, FakeFirestore
+
+USER_ID = "user0"
+
+
+async def legacy_delete_conversation(db: FakeFirestore, user_id: str, convo_id: str):
+    """El bucle anterior de delete_conversation: un delete() secuencial por mensaje."""
+    convo_ref = db.collection('users').document(user_id).collection('conversations').document(convo_id)
+    async for msg_doc in convo_ref.collection('messages').stream():
+        await msg_doc.reference.delete()
+    await convo_ref.delete()
+
+
+def populate_conversation(db: FakeFirestore, messages: int) -> str:
+    convo_path = f"users/{USER_ID}/conversations/convo0"
+    db.documents[convo_path] = {"title": "Conversación de prueba"}
+    for i in range(messages):
+        db.documents[f"{convo_path}/messages/m{i:07d}"] = {"role": "user", "content": f"Mensaje {i}"}
+    return convo_path
+
+
+def populate_prequalifications(db: FakeFirestore, prequalifications: int, followups: int) -> str:
+    collection_path = f"users/{USER_ID}/prequalifications"
+    for p in range(prequalifications):
+        path = f"{collection_path}/p{p:05d}"
+        db.documents[path] = {"title": f"Caso {p}", "analysis": "..."}
+        db.documents[f"{path}/followup_state/summary"] = {"summary": "", "summarized_turns": 0}
+        for t in range(followups):
+            db.documents[f"{path}/messages/t{t:05d}"] = {"role": "user", "content": f"Pregunta {t}", "turn": t}
+    return collection_path
+
+
+async def measure(db: FakeFirestore, operation) -> Dict[str, Any]:
+    documents_before = len(db.documents)
+    operations_before = db.operations
+    db.max_in_flight = 0
+    started = time.perf_counter()
+    result = await operation()
+    elapsed = time.perf_counter() - started
+    return {
+        "seconds": elapsed,
+        "documents_removed": documents_before - len(db.documents),
+        "reported_deleted": result,
+        "firestore_operations": db.operations - operations_before,
+        "max_concurrent_operations": db.max_in_flight,
+        "documents_left": len(db.documents),
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    from src.core import clients
+    from src.modules import firestore_client
+
+    config = FakeBackendConfig(firestore_latency_seconds=args.latency, jitter=0.0)
+    results: Dict[str, Any] = {}
+
+    if not args.skip_legacy:
+        db = FakeFirestore(config)
+        populate_conversation(db, args.messages)
+        results["conversation_legacy"] = await measure(
+            db, lambda: legacy_delete_conversation(db, USER_ID, "convo0")
+        )
+
+    db = FakeFirestore(config)
+    clients.set_firestore(db)
+    convo_path = populate_conversation(db, args.messages)
+    results["conversation_batched"] = await measure(
+        db, lambda: firestore_client.delete_document_recursive(db.document(convo_path), max_depth=1)
+    )
+
+    db = FakeFirestore(config)
+    clients.set_firestore(db)
+    collection_path = populate_prequalifications(db, args.prequalifications, args.followups)
+    results["prequalifications_batched"] = await measure(
+        db, lambda: firestore_client.delete_collection(db.collection(collection_path))
+    )
+
+    report: Dict[str, Any] = {
+        "config": {
+            "messages": args.messages,
+            "prequalifications": args.prequalifications,
+            "followups": args.followups,
+            "latency_seconds": args.latency,
+        },
+        "results": results,
+    }
+    if "conversation_legacy" in results:
+        report["conversation_speedup"] = results["conversation_legacy"]["seconds"] / results["conversation_batched"]["seconds"]
+    return report
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Borrado recursivo por lotes frente al bucle anterior.")
+    parser.add_argument("--messages", type=int, default=2000, help="Mensajes de la conversación")
+    parser.add_argument("--prequalifications", type=int, default=200)
+    parser.add_argument("--followups", type=int, default=10, help="Mensajes de seguimiento por precalificación")
+    parser.add_argument("--latency", type=float, default=0.005, help="Latencia simulada por operación de Firestore (s)")
+    parser.add_argument("--skip-legacy", action="store_true", help="No ejecuta el bucle anterior (lento con muchos mensajes)")
+    parser.add_argument("--output", help="Fichero JSON de resultados (por defecto, salida estándar)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    output = json.dumps(asyncio.run(run(args)), indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+# benchmarks/export_bench.py
+
+"""
+Benchmark del renderizado de exportaciones (PDF/DOCX) con un informe sintético de ~16k tokens.
+
+Mide, por formato, el tiempo de renderizado en el pool de procesos (como en producción),
+la memoria pico de los procesos hijos y el retraso del event loop mientras se renderiza.
+Con --inline renderiza además en el propio event loop para comparar el bloqueo.
+
+Uso:
+    python -m benchmarks.export_bench --runs 5 --output export.json
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from benchmarks.load_test import LoopLagMonitor, percentiles, peak_rss_mb
+
+
+def build_report(target_tokens: int, chars_per_token: float = 4.0) -> str:
+    """Informe Markdown con la estructura del precalificador, repetida hasta ~target_tokens."""
+    section = """
+## {n}. Posibles Delitos Penales Identificados
+
+### {n}.1 Privación de libertad
+
+*   **Tipo penal:** Privación de libertad agravada (art. {n}48 del Código Penal).
+*   **Nexo causal:** Los agentes detuvieron a la víctima sin orden judicial el día 12 de marzo, según el relato.
+*   **Base jurídica:** Artículo 7 de la Convención Americana sobre Derechos Humanos (CADH); artículo 9 del PIDCP.
+
+Los hechos descritos permiten inferir, de manera preliminar, que la detención se realizó *sin* control judicial
+y que la víctima permaneció incomunicada durante un periodo prolongado, lo que podría constituir además una
+vulneración del derecho a la integridad personal (artículo 5 de la CADH).
+
+1. Derecho a la libertad personal.
+2. Derecho a las garantías judiciales.
+3. Derecho a la protección judicial.
+
+---
+"""
+    target_chars = int(target_tokens * chars_per_token)
+    parts, size, n = ["# Informe de Precalificación\n"], 0, 1
+    while size < target_chars:
+        block = section.format(n=n)
+        parts.append(block)
+        size += len(block)
+        n += 1
+    return "".join(parts)
+
+
+def children_peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+async def bench_format(pool: ProcessPoolExecutor, export_format: str, title: str, markdown: str,
+                       runs: int, inline: bool) -> Dict[str, Any]:
+    from src.modules.exporter import render_document
+
+    loop = asyncio.get_running_loop()
+    pool_times: List[float] = []
+    size = 0
+    monitor = LoopLagMonitor(interval=0.005)
+    monitor.start()
+    for _ in range(runs):
+        started = time.perf_counter()
+        document = await loop.run_in_executor(pool, render_document, export_format, title, markdown)
+        pool_times.append(time.perf_counter() - started)
+        size = len(document)
+    await monitor.stop()
+    result = {
+        "bytes": size,
+        "pool_render_seconds": percentiles(pool_times),
+        "event_loop_lag_seconds_pool": percentiles(monitor.samples),
+    }
+
+    if inline:
+        inline_times: List[float] = []
+        monitor = LoopLagMonitor(interval=0.005)
+        monitor.start()
+        for _ in range(runs):
+            await asyncio.sleep(0.02)
+            started = time.perf_counter()
+            render_document(export_format, title, markdown)
+            inline_times.append(time.perf_counter() - started)
+        await asyncio.sleep(0.02)
+        await monitor.stop()
+        result["inline_render_seconds"] = percentiles(inline_times)
+        result["event_loop_lag_seconds_inline"] = percentiles(monitor.samples)
+    return result
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    markdown = build_report(args.tokens)
+    title = "Caso de prueba: detención arbitraria"
+    pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        # Primer renderizado aparte: arranque del proceso hijo e importaciones.
+        from src.modules.exporter import render_document
+        started = time.perf_counter()
+        await asyncio.get_running_loop().run_in_executor(pool, render_document, "pdf", title, "# calentamiento")
+        warmup = time.perf_counter() - started
+        formats = {fmt: await bench_format(pool, fmt, title, markdown, args.runs, args.inline) for fmt in args.formats}
+    finally:
+        pool.shutdown(wait=True)
+
+    return {
+        "config": {"tokens": args.tokens, "markdown_chars": len(markdown), "runs": args.runs},
+        "pool_warmup_seconds": warmup,
+        "formats": formats,
+        "peak_rss_mb": {"parent": peak_rss_mb(), "children": children_peak_rss_mb()},
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark del renderizado de exportaciones PDF/DOCX.")
+    parser.add_argument("--tokens", type=int, default=16000, help="Tamaño aproximado del informe en tokens")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--formats", nargs="+", default=["pdf", "docx"], choices=["pdf", "docx"])
+    parser.add_argument("--inline", action="store_true", help="Compara con renderizado dentro del event loop")
+    parser.add_argument("--output", help="Fichero JSON de resultados (por defecto, salida estándar)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    output = json.dumps(asyncio.run(run(args)), indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
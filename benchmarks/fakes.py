@@ -0,0 +1,359 @@
+# benchmarks/fakes.py
+
+"""
+Dobles locales de Gemini, Firestore, Firebase y el RAG para medir /analyze sin salir a la red.
+Cada doble simula latencias configurables (TTFT, ritmo de tokens, jitter, errores).
+"""
+
+import time
+import random
+import asyncio
+from dataclasses import dataclass
+from functools import cmp_to_key
+from typing import Any, Dict, List, Optional
+
+import httpx
+from google.api_core import exceptions as google_exceptions
+
+
+@dataclass
+class FakeBackendConfig:
+    ttft_seconds: float = 0.8
+    tokens_per_second: float = 80.0
+    output_tokens: int = 1200
+    chars_per_token: int = 4
+    chunk_tokens: int = 12
+    jitter: float = 0.2
+    error_rate: float = 0.0
+    # Probabilidad de cortar el stream de Gemini tras cada fragmento ya emitido.
+    mid_stream_error_rate: float = 0.0
+    firestore_latency_seconds: float = 0.015
+    auth_cpu_seconds: float = 0.002
+    subscription_active: bool = True
+    rag_latency_seconds: float = 0.12
+    rag_passages: int = 8
+
+
+def _jittered(value: float, jitter: float) -> float:
+    return max(0.0, value * (1 + random.uniform(-jitter, jitter)))
+
+
+# --- GEMINI ---
+class _FakeUsage:
+    def __init__(self, prompt_tokens: int, output_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.cached_content_token_count = 0
+        self.candidates_token_count = output_tokens
+
+
+class _FakeChunk:
+    def __init__(self, text: str, usage_metadata: Optional[_FakeUsage] = None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class FakeChat:
+    def __init__(self, model: "FakeGenerativeModel"):
+        self.model = model
+        self.config = model.config
+
+    async def send_message_async(self, message: str, stream: bool = True, generation_config: Any = None):
+        config = self.config
+        self.model.requests += 1
+        if random.random() < config.error_rate:
+            raise google_exceptions.ServiceUnavailable("Fallo simulado del backend falso")
+
+        async def stream_chunks():
+            await asyncio.sleep(_jittered(config.ttft_seconds, config.jitter))
+            produced = 0
+            chunk_delay = config.chunk_tokens / max(config.tokens_per_second, 1e-6)
+            while produced < config.output_tokens:
+                tokens = min(config.chunk_tokens, config.output_tokens - produced)
+                produced += tokens
+                yield _FakeChunk("x" * (tokens * config.chars_per_token))
+                if random.random() < config.mid_stream_error_rate:
+                    raise google_exceptions.ServiceUnavailable("Corte simulado a mitad del stream")
+                await asyncio.sleep(_jittered(chunk_delay, config.jitter))
+            yield _FakeChunk("", _FakeUsage(len(message) // 4, produced))
+
+        return stream_chunks()
+
+
+class FakeGenerativeModel:
+    def __init__(self, config: FakeBackendConfig):
+        self.config = config
+        # Llamadas a send_message_async (generaciones pedidas a "Gemini").
+        self.requests = 0
+
+    def start_chat(self, history: List[Any] = None):
+        return FakeChat(self)
+
+
+# --- FIRESTORE ---
+class _FakeSnapshot:
+    def __init__(self, reference: "FakeDocumentReference", data: Optional[Dict[str, Any]]):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocumentReference:
+    def __init__(self, client: "FakeFirestore", path: str):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name: str) -> "FakeQuery":
+        return FakeQuery(self._client, f"{self.path}/{name}")
+
+    async def get(self, field_paths: Any = None) -> _FakeSnapshot:
+        await self._client.delay()
+        return _FakeSnapshot(self, self._client.documents.get(self.path))
+
+    async def set(self, data: Dict[str, Any]):
+        await self._client.delay()
+        self._client.documents[self.path] = dict(data)
+
+    async def update(self, data: Dict[str, Any]):
+        await self._client.delay()
+        self._client.documents.setdefault(self.path, {}).update(data)
+
+    async def delete(self):
+        await self._client.delay()
+        self._client.documents.pop(self.path, None)
+
+    async def collections(self):
+        await self._client.delay()
+        prefix = self.path + "/"
+        names = {p[len(prefix):].split("/", 1)[0] for p in self._client.documents if p.startswith(prefix)}
+        for name in sorted(names):
+            yield self.collection(name)
+
+
+class FakeQuery:
+    """
+    Colección/consulta mínima: filtros de igualdad, 'in' y comparación, order_by (con dirección),
+    cursor start_after (instantánea o valores de los campos ordenados) y límite.
+    Sin order_by los documentos se devuelven por nombre.
+    """
+
+    def __init__(self, client: "FakeFirestore", path: str, filters=None, limit_count: Optional[int] = None,
+                 after: Any = None, orders=None):
+        self._client = client
+        self.path = path
+        self._filters = filters or []
+        self._limit = limit_count
+        self._after = after
+        self._orders = orders or []
+
+    def _copy(self, **changes) -> "FakeQuery":
+        state = {"filters": self._filters, "limit_count": self._limit, "after": self._after,
+                 "orders": self._orders, **changes}
+        return FakeQuery(self._client, self.path, **state)
+
+    def document(self, doc_id: Optional[str] = None) -> FakeDocumentReference:
+        self._client.counter += 1
+        return FakeDocumentReference(self._client, f"{self.path}/{doc_id or f'auto{self._client.counter}'}")
+
+    def where(self, field: str, op: str, value: Any) -> "FakeQuery":
+        return self._copy(filters=self._filters + [(field, op, value)])
+
+    def limit(self, count: int) -> "FakeQuery":
+        return self._copy(limit_count=count)
+
+    def start_after(self, cursor: Any) -> "FakeQuery":
+        return self._copy(after=cursor)
+
+    def order_by(self, field: str, direction: str = "ASCENDING") -> "FakeQuery":
+        return self._copy(orders=self._orders + [(field, direction == "DESCENDING")])
+
+    def select(self, *args, **kwargs) -> "FakeQuery":
+        return self
+
+    async def add(self, data: Dict[str, Any]):
+        await self.document().set(data)
+
+    def _order_values(self, doc_id: str, data: Dict[str, Any]) -> List[Any]:
+        return [doc_id if field == "__name__" else data.get(field) for field, _ in self._orders]
+
+    def _cursor_values(self) -> List[Any]:
+        if isinstance(self._after, _FakeSnapshot):
+            return self._order_values(self._after.id, self._after.to_dict() or {})
+        # Cursor por valores: basta un prefijo de los campos ordenados, en el mismo orden.
+        return [self._after[field] for field, _ in self._orders[:len(self._after)]]
+
+    def _compare(self, left: List[Any], right: List[Any]) -> int:
+        for a, b, (_, descending) in zip(left, right, self._orders):
+            if a != b:
+                result = -1 if a < b else 1
+                return -result if descending else result
+        return 0
+
+    async def stream(self):
+        await self._client.delay()
+        prefix = self.path + "/"
+        candidates = []
+        for path in sorted(self._client.documents):
+            if not path.startswith(prefix) or "/" in path[len(prefix):]:
+                continue
+            data = self._client.documents[path]
+            # Como en Firestore, order_by excluye los documentos sin ese campo.
+            if any(field != "__name__" and field not in data for field, _ in self._orders):
+                continue
+            if all(_matches(data.get(field), op, value) for field, op, value in self._filters):
+                candidates.append((path, data))
+        if self._orders:
+            candidates.sort(key=cmp_to_key(lambda x, y: self._compare(
+                self._order_values(x[0].rsplit("/", 1)[-1], x[1]), self._order_values(y[0].rsplit("/", 1)[-1], y[1])
+            )))
+
+        if self._after is not None and self._orders:
+            cursor = self._cursor_values()
+            candidates = [(path, data) for path, data in candidates
+                          if self._compare(self._order_values(path.rsplit("/", 1)[-1], data), cursor) > 0]
+        elif self._after is not None:
+            candidates = [(path, data) for path, data in candidates if path > self._after.reference.path]
+
+        for path, data in candidates[:self._limit]:
+            yield _FakeSnapshot(FakeDocumentReference(self._client, path), data)
+
+    async def get(self):
+        return [doc async for doc in self.stream()]
+
+
+_COMPARISONS = {
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+
+
+def _matches(actual: Any, op: str, value: Any) -> bool:
+    if op == "in":
+        return actual in value
+    if op in _COMPARISONS:
+        return actual is not None and _COMPARISONS[op](actual, value)
+    return actual == value
+
+
+class FakeBatch:
+    def __init__(self, client: "FakeFirestore"):
+        self._client = client
+        self._ops = []
+
+    def set(self, reference: FakeDocumentReference, data: Dict[str, Any]):
+        self._ops.append((reference.path, dict(data)))
+
+    def delete(self, reference: FakeDocumentReference):
+        self._ops.append((reference.path, None))
+
+    async def commit(self):
+        await self._client.delay()
+        for path, data in self._ops:
+            if data is None:
+                self._client.documents.pop(path, None)
+            else:
+                self._client.documents[path] = data
+
+
+class FakeFirestore:
+    """Sustituto en memoria de firestore.AsyncClient con latencia configurable."""
+
+    def __init__(self, config: FakeBackendConfig):
+        self.config = config
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.counter = 0
+        self.operations = 0
+        # RPCs simultáneas (actual y máximo observado).
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def delay(self):
+        self.operations += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(_jittered(self.config.firestore_latency_seconds, self.config.jitter))
+        finally:
+            self.in_flight -= 1
+
+    def collection(self, path: str) -> FakeQuery:
+        return FakeQuery(self, path)
+
+    def document(self, path: str) -> FakeDocumentReference:
+        return FakeDocumentReference(self, path)
+
+    def batch(self) -> FakeBatch:
+        return FakeBatch(self)
+
+    def add_subscription(self, user_id: str, status: str = "active"):
+        self.documents[f"customers/{user_id}/subscriptions/sub_{user_id}"] = {"status": status}
+
+
+# --- FIREBASE AUTH ---
+class FakeKeyStore:
+    async def get_keys(self) -> Dict[str, Any]:
+        return {"fake": None}
+
+
+def make_fake_decode(config: FakeBackendConfig):
+    """Simula el coste de CPU de la verificación RS256 y acepta tokens 'fake-<uid>'."""
+    from firebase_admin import auth
+
+    def fake_decode(token: str, keys: Dict[str, Any]) -> Dict[str, Any]:
+        deadline = time.perf_counter() + config.auth_cpu_seconds
+        while time.perf_counter() < deadline:
+            pass
+        if not token.startswith("fake-"):
+            raise auth.InvalidIdTokenError("Token falso no reconocido.")
+        uid = token[len("fake-"):]
+        return {"uid": uid, "sub": uid, "email": f"{uid}@example.org", "exp": time.time() + 3600}
+
+    return fake_decode
+
+
+# --- RAG ---
+def make_fake_rag_transport(config: FakeBackendConfig) -> httpx.MockTransport:
+    """Servidor RAG simulado (en proceso) que responde a POST RAG_API_URL con pasajes puntuados."""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(_jittered(config.rag_latency_seconds, config.jitter))
+        if random.random() < config.error_rate:
+            return httpx.Response(503, json={"detail": "Fallo simulado del RAG falso"})
+        results = [
+            {"text": f"Artículo {i + 1}. Texto normativo de referencia simulado. " * 6,
+             "source": f"Código Penal (simulado), art. {i + 1}",
+             "score": round(1.0 - i / max(config.rag_passages, 1), 3)}
+            for i in range(config.rag_passages)
+        ]
+        return httpx.Response(200, json={"results": results})
+
+    return httpx.MockTransport(handler)
+
+
+def install_fakes(config: FakeBackendConfig, user_ids: List[str]) -> FakeFirestore:
+    """Sustituye Gemini, el cliente de Firestore compartido, el cliente HTTP (RAG) y la verificación de tokens por los dobles."""
+    from src.core import clients, token_verifier
+    from src.modules import gemini_client
+
+    fake_model = FakeGenerativeModel(config)
+    gemini_client.model = fake_model
+    gemini_client.model_factory = lambda **kwargs: fake_model
+    gemini_client._model_init_attempted = True
+
+    fake_db = FakeFirestore(config)
+    if config.subscription_active:
+        for user_id in user_ids:
+            fake_db.add_subscription(user_id)
+    clients.set_firestore(fake_db)
+
+    clients.set_http_client(httpx.AsyncClient(transport=make_fake_rag_transport(config)))
+
+    token_verifier._key_store = FakeKeyStore()
+    token_verifier._decode_with_keys = make_fake_decode(config)
+    return fake_db
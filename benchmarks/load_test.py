@@ -0,0 +1,332 @@
+# benchmarks/load_test.py
+
+"""
+Prueba de carga de /analyze con dobles locales de Gemini, Firestore y Firebase.
+
+Levanta la app real de FastAPI en un servidor uvicorn dentro del mismo proceso
+(en un puerto local libre) y lanza N clientes SSE concurrentes con httpx. No se
+usa httpx.ASGITransport porque acumula el cuerpo completo antes de devolverlo y
+falsearía el tiempo hasta el primer byte.
+
+Uso:
+    python -m benchmarks.load_test --clients 50 --requests 200 --output resultados.json
+    python -m benchmarks.load_test --no-auth-cache --baseline resultados.json
+
+admission_seconds es el tiempo hasta recibir las cabeceras de respuesta
+(verificación del token, suscripción y control de capacidad); para comparar la
+caché de tokens activada y desactivada, véase benchmarks/auth_bench.py.
+
+Con --baseline se comparan las métricas clave con una ejecución anterior y el
+proceso termina con código 1 si alguna empeora más que --regression-threshold.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import resource
+import platform
+from dataclasses import asdict
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from benchmarks.fakes import FakeBackendConfig, install_fakes
+
+# Métricas que se comparan con la ejecución de referencia (True = más alto es mejor).
+_REGRESSION_KEYS = {
+    ("throughput", "requests_per_second"): True,
+    ("admission_seconds", "p99"): False,
+    ("ttfb_seconds", "p50"): False,
+    ("ttfb_seconds", "p99"): False,
+    ("first_text_seconds", "p99"): False,
+    ("total_seconds", "p50"): False,
+    ("total_seconds", "p99"): False,
+    ("event_loop_lag_seconds", "p99"): False,
+}
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"count": 0, "p50": None, "p90": None, "p99": None, "max": None, "mean": None}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p99": pick(0.99),
+        "max": ordered[-1],
+        "mean": sum(ordered) / len(ordered),
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss está en KiB en Linux y en bytes en macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class LoopLagMonitor:
+    """Mide cuánto se retrasa un sleep periódico: retraso = bloqueo del event loop."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run_one(client: httpx.AsyncClient, user_id: str, index: int, unique_facts: bool,
+                  error_messages: frozenset = frozenset()) -> Dict[str, Any]:
+    facts = "Relato de prueba para la prueba de carga. " * 20
+    if unique_facts:
+        facts += f"Caso {index}."
+    payload = {"title": f"Caso {index}", "facts": facts, "country_code": "SV"}
+    headers = {"Authorization": f"Bearer fake-{user_id}"}
+
+    result: Dict[str, Any] = {"ok": False, "status": None, "admission": None, "ttfb": None, "first_text": None,
+                              "total": None, "events": 0, "bytes": 0, "error": None}
+    started = time.perf_counter()
+    try:
+        async with client.stream("POST", "/analyze", json=payload, headers=headers) as response:
+            # Cabeceras recibidas: token verificado, suscripción comprobada y turno de admisión concedido.
+            result["admission"] = time.perf_counter() - started
+            result["status"] = response.status_code
+            done = False
+            async for line in response.aiter_lines():
+                if result["ttfb"] is None:
+                    result["ttfb"] = time.perf_counter() - started
+                result["bytes"] += len(line) + 1
+                if not line.startswith("data:"):
+                    continue
+                result["events"] += 1
+                event = json.loads(line[5:])
+                if "text" in event:
+                    if event["text"] in error_messages:
+                        # Los fallos de Gemini llegan como texto del stream.
+                        result["error"] = event["text"]
+                    elif result["first_text"] is None:
+                        result["first_text"] = time.perf_counter() - started
+                elif "error" in event:
+                    result["error"] = event["error"]
+                elif event.get("event") == "done":
+                    done = True
+            result["ok"] = response.status_code == 200 and done and result["error"] is None
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["total"] = time.perf_counter() - started
+    return result
+
+
+async def run_load(args: argparse.Namespace) -> Dict[str, Any]:
+    import uvicorn
+    from src.config import settings
+
+    settings.AUTH_TOKEN_CACHE_ENABLED = not args.no_auth_cache
+    settings.ANALYSIS_CACHE_ENABLED = not args.no_analysis_cache
+    settings.ANALYSIS_CACHE_FIRESTORE_ENABLED = False
+    settings.SPECULATIVE_STREAMING_ENABLED = args.speculative
+    settings.STARTUP_WARMUP = False
+    settings.RETRIEVAL_ENABLED = not args.no_retrieval
+
+    fake_config = FakeBackendConfig(
+        ttft_seconds=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        output_tokens=args.output_tokens,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        firestore_latency_seconds=args.firestore_latency,
+        auth_cpu_seconds=args.auth_cpu,
+        rag_latency_seconds=args.rag_latency,
+    )
+    user_ids = [f"user{i}" for i in range(args.users)]
+
+    from src.main import app
+    from src.core import token_verifier
+    from src.modules import gemini_client, firestore_client, retrieval
+    fake_db = install_fakes(fake_config, user_ids)
+    error_messages = frozenset(gemini_client.ERROR_MESSAGES)
+
+    # Sin lifespan: initialize_clients() crearía los clientes reales de Google.
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, lifespan="off",
+                                           log_level="warning", access_log=False))
+    server_task = asyncio.get_running_loop().create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    # Como en el lifespan: la cola de escrituras se abre aquí y se vacía al terminar.
+    await firestore_client.write_queue.start()
+
+    monitor = LoopLagMonitor()
+    monitor.start()
+    queue: "asyncio.Queue[int]" = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(i)
+    results: List[Dict[str, Any]] = []
+
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=timeout) as client:
+        async def worker():
+            while True:
+                try:
+                    index = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                results.append(await run_one(client, user_ids[index % len(user_ids)], index,
+                                             not args.repeat_facts, error_messages))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.clients)))
+        elapsed = time.perf_counter() - started
+
+    await monitor.stop()
+    await firestore_client.write_queue.drain(settings.WRITE_QUEUE_SHUTDOWN_DEADLINE_SECONDS)
+    server.should_exit = True
+    await server_task
+
+    ok = [r for r in results if r["ok"]]
+    status_counts: Dict[str, int] = {}
+    for r in results:
+        key = str(r["status"])
+        status_counts[key] = status_counts.get(key, 0) + 1
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {
+            "clients": args.clients,
+            "requests": args.requests,
+            "users": args.users,
+            "auth_cache": settings.AUTH_TOKEN_CACHE_ENABLED,
+            "analysis_cache": settings.ANALYSIS_CACHE_ENABLED,
+            "repeat_facts": args.repeat_facts,
+            "speculative": args.speculative,
+            "retrieval": settings.RETRIEVAL_ENABLED,
+            "fakes": asdict(fake_config),
+        },
+        "throughput": {
+            "elapsed_seconds": elapsed,
+            "requests_per_second": len(ok) / elapsed if elapsed else 0.0,
+            "events_per_second": sum(r["events"] for r in ok) / elapsed if elapsed else 0.0,
+            "bytes_per_second": sum(r["bytes"] for r in ok) / elapsed if elapsed else 0.0,
+        },
+        "requests": {
+            "ok": len(ok),
+            "failed": len(results) - len(ok),
+            "status_codes": status_counts,
+            "sample_errors": sorted({r["error"] for r in results if r["error"]})[:5],
+        },
+        "admission_seconds": percentiles([r["admission"] for r in ok if r["admission"] is not None]),
+        "ttfb_seconds": percentiles([r["ttfb"] for r in ok if r["ttfb"] is not None]),
+        "first_text_seconds": percentiles([r["first_text"] for r in ok if r["first_text"] is not None]),
+        "total_seconds": percentiles([r["total"] for r in ok]),
+        "event_loop_lag_seconds": percentiles(monitor.samples),
+        "peak_rss_mb": peak_rss_mb(),
+        "service": {
+            "auth": token_verifier.get_stats(),
+            "gemini": gemini_client.get_stats(),
+            "retrieval": retrieval.get_stats(),
+            "write_queue": firestore_client.write_queue.get_stats(),
+            "firestore_operations": fake_db.operations,
+        },
+    }
+
+
+def compare_with_baseline(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Devuelve las métricas que empeoran más que `threshold` (fracción) respecto a la referencia."""
+    regressions = []
+    for (section, key), higher_is_better in _REGRESSION_KEYS.items():
+        new = (current.get(section) or {}).get(key)
+        old = (baseline.get(section) or {}).get(key)
+        if not new or not old:
+            continue
+        change = (new - old) / old
+        if (higher_is_better and change < -threshold) or (not higher_is_better and change > threshold):
+            regressions.append(f"{section}.{key}: {old:.4f} -> {new:.4f} ({change:+.1%})")
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Prueba de carga de /analyze con backends simulados.")
+    parser.add_argument("--clients", type=int, default=20, help="Clientes SSE concurrentes")
+    parser.add_argument("--requests", type=int, default=100, help="Peticiones totales")
+    parser.add_argument("--users", type=int, default=10, help="Usuarios distintos (tokens) entre los que se reparten")
+    parser.add_argument("--ttft", type=float, default=0.8, help="Tiempo hasta el primer token simulado (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--output-tokens", type=int, default=1200)
+    parser.add_argument("--jitter", type=float, default=0.2, help="Variación relativa de las latencias simuladas")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de llamadas a Gemini que fallan")
+    parser.add_argument("--firestore-latency", type=float, default=0.015)
+    parser.add_argument("--auth-cpu", type=float, default=0.002, help="CPU simulada por verificación de token (s)")
+    parser.add_argument("--rag-latency", type=float, default=0.12, help="Latencia simulada del RAG (s)")
+    parser.add_argument("--no-retrieval", action="store_true", help="Desactiva la recuperación de bases jurídicas")
+    parser.add_argument("--no-auth-cache", action="store_true", help="Desactiva la caché de tokens verificados")
+    parser.add_argument("--no-analysis-cache", action="store_true", help="Desactiva la caché de análisis")
+    parser.add_argument("--repeat-facts", action="store_true", help="Todas las peticiones con los mismos hechos")
+    parser.add_argument("--speculative", action="store_true", help="Activa SPECULATIVE_STREAMING_ENABLED")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--output", help="Fichero JSON de resultados (por defecto, salida estándar)")
+    parser.add_argument("--baseline", help="JSON de una ejecución anterior para detectar regresiones")
+    parser.add_argument("--regression-threshold", type=float, default=0.10)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run_load(args))
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_with_baseline(report, json.load(f), args.regression_threshold)
+        report["regressions"] = regressions
+        exit_code = 1 if regressions else 0
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    for line in report.get("regressions", []):
+        print(f"REGRESIÓN {line}", file=sys.stderr)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+# benchmarks/sse_bench.py
+
+"""
+Benchmark del codificador SSE (src/core/sse.py) con fragmentos de texto como los de Gemini.
+
+Codifica la misma secuencia de fragmentos en tres modos y mide frames y bytes por segundo,
+CPU por fragmento y frames por stream (cada frame es un envío ASGI, es decir, una escritura
+en el socket):
+    - legacy:      json.dumps + f-string por fragmento y transcripción con +=, como antes de SSEWriter.
+    - no_coalesce: SSEWriter con un frame por fragmento.
+    - coalesce:    SSEWriter con la agrupación configurada (SSE_COALESCE_MIN_CHARS).
+
+Uso:
+    python -m benchmarks.sse_bench --streams 200 --output-tokens 16000 --output sse.json
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+from typing import Any, Callable, Dict, List, Optional
+
+from src.config import settings
+from src.core import sse
+
+
+def make_chunks(output_tokens: int, chars_per_token: int, max_chunk_tokens: int, seed: int) -> List[str]:
+    """Fragmentos de tamaño variable (1..max_chunk_tokens tokens) con texto en español."""
+    rng = random.Random(seed)
+    alphabet = "abcdefghijklmnñopqrstuvwxyzáéíóú     ,.\n"
+    chunks, produced = [], 0
+    while produced < output_tokens:
+        tokens = min(rng.randint(1, max_chunk_tokens), output_tokens - produced)
+        produced += tokens
+        chunks.append("".join(rng.choice(alphabet) for _ in range(tokens * chars_per_token)))
+    return chunks
+
+
+def encode_legacy(chunks: List[str]) -> Dict[str, int]:
+    full_response_text = ""
+    frames = sent = 0
+    for chunk in chunks:
+        full_response_text += chunk
+        frame = f"data: {json.dumps({'text': chunk})}\n\n".encode("utf-8")
+        frames += 1
+        sent += len(frame)
+    return {"frames": frames, "bytes": sent, "transcript_chars": len(full_response_text)}
+
+
+def _encode_with_writer(chunks: List[str], coalesce_min_chars: int) -> Dict[str, int]:
+    # Sin límite de tiempo: la agrupación depende solo del tamaño y el resultado es reproducible.
+    writer = sse.SSEWriter(coalesce_min_chars=coalesce_min_chars, coalesce_max_delay=float("inf"))
+    for chunk in chunks:
+        writer.text(chunk)
+    writer.flush()
+    return {"frames": writer.frames_sent, "bytes": writer.bytes_sent, "transcript_chars": len(writer.transcript())}
+
+
+def encode_no_coalesce(chunks: List[str]) -> Dict[str, int]:
+    return _encode_with_writer(chunks, coalesce_min_chars=0)
+
+
+def encode_coalesce(chunks: List[str]) -> Dict[str, int]:
+    return _encode_with_writer(chunks, coalesce_min_chars=settings.SSE_COALESCE_MIN_CHARS)
+
+
+MODES: Dict[str, Callable[[List[str]], Dict[str, int]]] = {
+    "legacy": encode_legacy,
+    "no_coalesce": encode_no_coalesce,
+    "coalesce": encode_coalesce,
+}
+
+
+def bench_mode(encode: Callable[[List[str]], Dict[str, int]], chunks: List[str], streams: int) -> Dict[str, Any]:
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    totals = {"frames": 0, "bytes": 0}
+    for _ in range(streams):
+        result = encode(chunks)
+        totals["frames"] += result["frames"]
+        totals["bytes"] += result["bytes"]
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    return {
+        "frames_per_stream": totals["frames"] / streams,
+        "bytes_per_stream": totals["bytes"] / streams,
+        "frames_per_second": totals["frames"] / elapsed if elapsed else 0.0,
+        "bytes_per_second": totals["bytes"] / elapsed if elapsed else 0.0,
+        "cpu_seconds": cpu,
+        "cpu_microseconds_per_chunk": cpu * 1e6 / (streams * len(chunks)),
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    chunks = make_chunks(args.output_tokens, args.chars_per_token, args.max_chunk_tokens, args.seed)
+    results = {name: bench_mode(MODES[name], chunks, args.streams) for name in args.modes}
+    report: Dict[str, Any] = {
+        "config": {
+            "streams": args.streams,
+            "output_tokens": args.output_tokens,
+            "chunks_per_stream": len(chunks),
+            "coalesce_min_chars": settings.SSE_COALESCE_MIN_CHARS,
+            "encoder": "orjson" if hasattr(sse, "orjson") else "json",
+        },
+        "modes": results,
+    }
+    if "coalesce" in results and "no_coalesce" in results:
+        report["frames_reduction"] = 1 - results["coalesce"]["frames_per_stream"] / results["no_coalesce"]["frames_per_stream"]
+    return report
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark del codificador SSE con y sin agrupación.")
+    parser.add_argument("--streams", type=int, default=200, help="Streams completos que se codifican por modo")
+    parser.add_argument("--output-tokens", type=int, default=16000, help="Tokens generados por stream")
+    parser.add_argument("--chars-per-token", type=int, default=4)
+    parser.add_argument("--max-chunk-tokens", type=int, default=8, help="Tamaño máximo de cada fragmento (tokens)")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Fichero JSON de resultados (por defecto, salida estándar)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    output = json.dumps(run(args), indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# benchmarks/startup_bench.py
+
+"""
+Tiempo de arranque en frío: desde que se lanza el proceso hasta que /status responde.
+
+Lanza la app real en un proceso nuevo (uvicorn con el lifespan activo, de modo que se
+ejecutan initialize_clients() y el calentamiento) con los dobles de benchmarks/fakes.py,
+sondea /status hasta obtener respuesta y la detiene con SIGTERM para que también se
+ejecute el apagado. El desglose por fases es el que devuelve /status (startup_seconds).
+
+Uso:
+    python -m benchmarks.startup_bench --runs 5 --output startup.json
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import subprocess
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from benchmarks.fakes import FakeBackendConfig, install_fakes
+
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(port: int, warmup: bool):
+    """Proceso hijo: instala los dobles antes de que el lifespan inicialice los clientes."""
+    os.environ["STARTUP_WARMUP"] = "true" if warmup else "false"
+    os.environ["RETRIEVAL_ENABLED"] = "false"
+    import uvicorn
+    from src.main import app
+
+    install_fakes(FakeBackendConfig(jitter=0.0), ["user0"])
+    # log_level info: uvicorn anuncia en stderr el fin del arranque y del apagado del lifespan.
+    uvicorn.run(app, host="127.0.0.1", port=port, lifespan="on", log_level="info", access_log=False)
+
+
+def measure_once(warmup: bool = True, timeout: float = 60.0) -> Dict[str, Any]:
+    """Arranca un proceso, mide el tiempo hasta el primer /status correcto y lo detiene."""
+    port = _free_port()
+    argv = [sys.executable, "-m", "benchmarks.startup_bench", "--serve", "--port", str(port)]
+    if not warmup:
+        argv.append("--no-warmup")
+
+    started = time.perf_counter()
+    process = subprocess.Popen(argv, cwd=_REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        status: Optional[Dict[str, Any]] = None
+        with httpx.Client(timeout=1.0) as client:
+            while time.perf_counter() - started < timeout:
+                if process.poll() is not None:
+                    raise RuntimeError(f"El servidor terminó antes de responder: {process.stderr.read().decode()}")
+                try:
+                    response = client.get(f"http://127.0.0.1:{port}/status")
+                    if response.status_code == 200:
+                        status = response.json()
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.02)
+        elapsed = time.perf_counter() - started
+        if status is None:
+            raise TimeoutError(f"/status no respondió en {timeout} s")
+    finally:
+        if process.poll() is None:
+            process.send_signal(signal.SIGTERM)
+        try:
+            exit_code = process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            exit_code = process.wait()
+        stderr = process.stderr.read().decode()
+        process.stderr.close()
+
+    return {
+        "process_to_status_seconds": elapsed,
+        "status": status,
+        "startup_seconds": status.get("startup_seconds", {}),
+        # uvicorn vuelve a lanzar la señal capturada tras el apagado: -SIGTERM es una salida normal.
+        "exit_code": exit_code,
+        "shutdown_complete": "Application shutdown complete" in stderr,
+        "stderr": stderr,
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    runs = [measure_once(warmup=not args.no_warmup) for _ in range(args.runs)]
+    elapsed = sorted(r["process_to_status_seconds"] for r in runs)
+    return {
+        "config": {"runs": args.runs, "warmup": not args.no_warmup},
+        "process_to_status_seconds": {"min": elapsed[0], "p50": elapsed[len(elapsed) // 2], "max": elapsed[-1]},
+        "runs": [{k: v for k, v in r.items() if k not in ("status", "stderr")} for r in runs],
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Tiempo desde el arranque del proceso hasta /status.")
+    parser.add_argument("--runs", type=int, default=3, help="Arranques en frío que se miden")
+    parser.add_argument("--no-warmup", action="store_true", help="Arranca con STARTUP_WARMUP desactivado")
+    parser.add_argument("--output", help="Fichero JSON de resultados (por defecto, salida estándar)")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.serve:
+        serve(args.port, warmup=not args.no_warmup)
+        return 0
+    output = json.dumps(run(args), indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,29 @@
 # src/config.py
 
+import time
+
+# Marca temprana para el perfil de arranque: este es el primer módulo del servicio que se importa.
+PROCESS_IMPORT_STARTED_AT = time.perf_counter()
+
 import logging
 import json
 from typing import List, Union, Optional
-import google.cloud.logging
 from pydantic import field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
-# --- Configuración de Logging para Google Cloud ---
-try:
-    client = google.cloud.logging.Client()
-    client.setup_logging()
-except Exception:
-    pass 
-
 log = logging.getLogger("pida-backend")
 log.setLevel(logging.INFO)
 
+# --- Configuración de Logging para Google Cloud ---
+def setup_cloud_logging():
+    """Conecta el logging estándar con Cloud Logging. Se llama desde el lifespan, no al importar."""
+    try:
+        import google.cloud.logging
+        client = google.cloud.logging.Client()
+        client.setup_logging()
+    except Exception:
+        pass 
+
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', extra='ignore')
 
@@ -25,11 +32,6 @@ class Settings(BaseSettings):
     GOOGLE_CLOUD_LOCATION: str = "us-central1"
     GEMINI_MODEL: str = "gemini-2.5-pro"
     
-    # Vertex Search (Con valores por defecto para evitar crashes)
-    VERTEX_SEARCH_PROJECT_ID: str = "pida-ai-v20"
-    VERTEX_SEARCH_LOCATION: str = "global"
-    VERTEX_SEARCH_DATA_STORE_ID: str = "almacen-web-pida_1765039607916"
-
     # PSE (Búsqueda antigua) - Las mantenemos opcionales o con string vacío para que no rompan el inicio
     # Si Cloud Run las tiene configuradas, las usará. Si no, usará "".
     PSE_API_KEY: str = ""
@@ -43,11 +45,166 @@ class Settings(BaseSettings):
     TEMPERATURE: float = 0.7
     TOP_P: float = 0.95
 
+    # Modo de envío del prompt de sistema: "system_instruction" (modelo reutilizable con
+    # system_instruction) o "inline" (se antepone el prompt al mensaje del usuario).
+    GEMINI_PROMPT_MODE: str = "system_instruction"
+    # Registra el prompt de sistema como CachedContent de Vertex (si el backend lo admite).
+    GEMINI_CONTEXT_CACHE_ENABLED: bool = False
+    GEMINI_CONTEXT_CACHE_TTL_SECONDS: int = 3600
+    # Margen con el que se renueva el TTL del CachedContent antes de que expire.
+    GEMINI_CONTEXT_CACHE_REFRESH_MARGIN_SECONDS: int = 300
+    # Backoff exponencial para reintentar la creación del CachedContent tras un fallo transitorio.
+    GEMINI_CONTEXT_CACHE_RETRY_BASE_SECONDS: float = 30.0
+    GEMINI_CONTEXT_CACHE_RETRY_MAX_SECONDS: float = 600.0
+
     # --- CONTROL DE ACCESO ---
     ALLOWED_ORIGINS: Union[str, List[str]] = '["https://pida.iiresodh.org", "https://pida-ai.com", "https://pida-ai-v20.web.app", "http://localhost", "http://localhost:8080"]'
     ADMIN_DOMAINS: Union[str, List[str]] = '["iiresodh.org", "urquilla.com"]'
     ADMIN_EMAILS: Union[str, List[str]] = '[]'
 
+    # --- AUTENTICACIÓN (Caché de tokens de Firebase) ---
+    # Si está vacío se usa GOOGLE_CLOUD_PROJECT como proyecto de Firebase.
+    FIREBASE_PROJECT_ID: str = ""
+    AUTH_TOKEN_CACHE_ENABLED: bool = True
+    AUTH_TOKEN_CACHE_MAX_SIZE: int = 10000
+    FIREBASE_CERTS_URL: str = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+
+    # --- MÉTRICAS (/metrics) ---
+    # Token que el scraper de Prometheus envía como 'Authorization: Bearer <token>'.
+    # Vacío = endpoint desactivado (404): el servicio es público en Cloud Run.
+    METRICS_TOKEN: str = ""
+
+    # --- CACHÉ DE SUSCRIPCIONES ---
+    SUBSCRIPTION_CACHE_ENABLED: bool = True
+    SUBSCRIPTION_CACHE_MAX_SIZE: int = 5000
+    SUBSCRIPTION_CACHE_POSITIVE_TTL_SECONDS: int = 300
+    SUBSCRIPTION_CACHE_NEGATIVE_TTL_SECONDS: int = 30
+    # Escucha cambios en Firestore (on_snapshot) para invalidar al instante, p. ej. al cancelar.
+    SUBSCRIPTION_WATCH_ENABLED: bool = False
+
+    # --- CACHÉ DE ANÁLISIS (precalificaciones idénticas) ---
+    ANALYSIS_CACHE_ENABLED: bool = True
+    ANALYSIS_CACHE_MAX_SIZE: int = 500
+    ANALYSIS_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    ANALYSIS_CACHE_FIRESTORE_ENABLED: bool = True
+    ANALYSIS_CACHE_COLLECTION: str = "analysis_cache"
+    # Tamaño (en caracteres) de cada evento 'text' al reproducir un análisis cacheado.
+    ANALYSIS_CACHE_REPLAY_CHUNK_SIZE: int = 256
+
+    # --- STREAMING SSE ---
+    # Los fragmentos de texto se agrupan hasta alcanzar este tamaño o este retardo máximo.
+    SSE_COALESCE_MIN_CHARS: int = 64
+    SSE_COALESCE_MAX_DELAY_SECONDS: float = 0.05
+    # Intervalo de comentarios ': ping' mientras el modelo razona sin emitir texto.
+    SSE_HEARTBEAT_INTERVAL_SECONDS: float = 15.0
+    # Qué hacer con el análisis parcial si el cliente se desconecta:
+    # "drop" lo descarta, "persist_truncated" lo guarda marcado como truncado.
+    DISCONNECT_POLICY: str = "drop"
+
+    # --- STREAMS REANUDABLES (Last-Event-ID) ---
+    # Segundos que la generación sigue viva sin clientes conectados, esperando una reconexión.
+    # Compromiso: durante ese tiempo una pestaña cerrada sigue consumiendo tokens de salida;
+    # 0 cancela en cuanto se va el último cliente (sin reanudación a mitad de generación).
+    STREAM_RESUME_GRACE_SECONDS: float = 10.0
+    # Tiempo que se conserva el buffer de un stream terminado para poder reanudarlo.
+    STREAM_BUFFER_TTL_SECONDS: int = 600
+    STREAM_BUFFER_MAX_BYTES_PER_STREAM: int = 2 * 1024 * 1024
+    STREAM_REGISTRY_MAX_BYTES: int = 64 * 1024 * 1024
+
+    # --- CONTROL DE ADMISIÓN (llamadas a Gemini por instancia) ---
+    GEMINI_MAX_IN_FLIGHT: int = 8
+    GEMINI_MAX_QUEUE: int = 64
+    # Cada cuánto se emite un evento 'status' con la posición en cola.
+    ADMISSION_STATUS_INTERVAL_SECONDS: float = 2.0
+    # Reintentos ante errores recuperables de Vertex (429, 503...) antes del primer token.
+    GEMINI_MAX_RETRIES: int = 3
+    GEMINI_RETRY_BASE_SECONDS: float = 1.0
+    GEMINI_RETRY_MAX_SECONDS: float = 20.0
+
+    # --- ESCRITURAS DIFERIDAS EN FIRESTORE (write-behind) ---
+    WRITE_QUEUE_BATCH_SIZE: int = 50
+    WRITE_QUEUE_FLUSH_INTERVAL_SECONDS: float = 1.0
+    WRITE_QUEUE_MAX_SIZE: int = 5000
+    WRITE_QUEUE_MAX_RETRIES: int = 5
+    WRITE_QUEUE_SHUTDOWN_DEADLINE_SECONDS: float = 8.0
+    # Fichero local (append-only) donde se vuelcan las escrituras pendientes al apagar;
+    # se reproduce en el siguiente arranque. Vacío = desactivado.
+    WRITE_QUEUE_SPILL_PATH: str = ""
+
+    # --- BORRADO MASIVO EN FIRESTORE ---
+    DELETE_PAGE_SIZE: int = 400
+    DELETE_MAX_CONCURRENCY: int = 8
+    # Tamaño de página por defecto para listados de conversaciones y mensajes.
+    LIST_PAGE_SIZE: int = 50
+
+    # --- ARRANQUE ---
+    # Calienta canales gRPC, certificados de Firebase y el modelo antes de servir tráfico.
+    STARTUP_WARMUP: bool = True
+
+    # --- STREAMING ESPECULATIVO ---
+    # Arranca la generación mientras se verifica la suscripción; los tokens se retienen
+    # hasta que la autorización se confirma y la generación se cancela si falla.
+    SPECULATIVE_STREAMING_ENABLED: bool = False
+
+    # --- CLIENTE HTTP COMPARTIDO (pool con keep-alive) ---
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    HTTP_TIMEOUT_SECONDS: float = 10.0
+    HTTP_CONNECT_TIMEOUT_SECONDS: float = 3.0
+
+    # --- RECUPERACIÓN DE BASES JURÍDICAS (RAG) ---
+    # Se consulta RAG_API_URL en paralelo con la verificación de suscripción y solo
+    # los top-k pasajes que caben en el presupuesto de tokens se añaden al prompt.
+    # Desactivado por defecto hasta confirmar el contrato de RAG_API_URL: además, la
+    # generación espera la respuesta (hasta RETRIEVAL_TIMEOUT_SECONDS), lo que suma al TTFT.
+    RETRIEVAL_ENABLED: bool = False
+    RETRIEVAL_TIMEOUT_SECONDS: float = 4.0
+    RETRIEVAL_TOP_K: int = 5
+    RETRIEVAL_TOKEN_BUDGET: int = 2000
+    # Caracteres del relato que se usan como consulta.
+    RETRIEVAL_QUERY_MAX_CHARS: int = 1500
+    RETRIEVAL_CACHE_MAX_SIZE: int = 1000
+    RETRIEVAL_CACHE_TTL_SECONDS: int = 3600
+
+    # --- RELATOS EXTENSOS (map-reduce) ---
+    # Por encima de este umbral los hechos se dividen en segmentos solapados, se extraen
+    # en paralelo y la precalificación final se hace sobre el resumen combinado.
+    LONG_INPUT_ENABLED: bool = True
+    LONG_INPUT_THRESHOLD_TOKENS: int = 12000
+    LONG_INPUT_SEGMENT_TOKENS: int = 4000
+    LONG_INPUT_OVERLAP_TOKENS: int = 200
+    LONG_INPUT_MAX_CONCURRENCY: int = 4
+    # Estimación rápida de tokens; cerca del umbral se cuentan con la API de Vertex.
+    LONG_INPUT_CHARS_PER_TOKEN: float = 4.0
+    SEGMENT_DIGEST_CACHE_MAX_SIZE: int = 2000
+    SEGMENT_DIGEST_CACHE_COLLECTION: str = "segment_digest_cache"
+
+    # --- LOTES DE PRECALIFICACIONES (POST /analyze/batch) ---
+    BATCH_MAX_ITEMS: int = 50
+    # Análisis simultáneos por lote (además del límite global del control de admisión).
+    BATCH_MAX_CONCURRENCY: int = 4
+    # Tiempo que se conservan los resultados de un lote terminado para recogerlos con su job_id.
+    BATCH_JOB_TTL_SECONDS: int = 3600
+    BATCH_MAX_JOBS: int = 200
+    # Memoria máxima para resultados de lotes; por encima se desalojan los lotes terminados más antiguos.
+    BATCH_REGISTRY_MAX_BYTES: int = 64 * 1024 * 1024
+
+    # --- EXPORTACIÓN PDF/DOCX ---
+    # Procesos dedicados al renderizado (CPU) para no bloquear los streams SSE.
+    EXPORT_MAX_WORKERS: int = 2
+    EXPORT_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    EXPORT_CHUNK_SIZE: int = 64 * 1024
+
+    # --- PREGUNTAS DE SEGUIMIENTO SOBRE UNA PRECALIFICACIÓN ---
+    # Presupuesto de tokens del historial reciente; los turnos más antiguos se sustituyen
+    # por un resumen acumulado.
+    FOLLOWUP_HISTORY_TOKEN_BUDGET: int = 4000
+    # Caracteres del relato original que se incluyen como contexto (el informe va completo).
+    FOLLOWUP_FACTS_MAX_CHARS: int = 6000
+    FOLLOWUP_SESSION_CACHE_MAX_SIZE: int = 500
+    FOLLOWUP_SESSION_TTL_SECONDS: int = 1800
+
     # --- VALIDADORES ---
     @field_validator('ALLOWED_ORIGINS', 'ADMIN_DOMAINS', 'ADMIN_EMAILS', mode='before')
     @classmethod
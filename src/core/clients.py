@@ -0,0 +1,162 @@
+# src/core/clients.py
+
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Optional
+
+import httpx
+from google.cloud import firestore
+from src.config import settings, log, setup_cloud_logging, PROCESS_IMPORT_STARTED_AT
+
+# --- REGISTRO DE CLIENTES COMPARTIDOS ---
+# Un único AsyncClient de Firestore (un solo canal gRPC) para todo el servicio.
+_firestore_client: Optional[firestore.AsyncClient] = None
+_firebase_initialized = False
+# Un único pool HTTP (keep-alive) para las llamadas salientes: RAG, certificados de Firebase...
+_http_client: Optional[httpx.AsyncClient] = None
+# Pool de procesos para trabajo de CPU pesado (renderizado de exportaciones) fuera del event loop.
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+# Desglose de tiempos de arranque (segundos), visible en logs y en get_startup_profile().
+_startup_profile: Dict[str, Any] = {}
+
+
+def get_firestore() -> firestore.AsyncClient:
+    """Devuelve el cliente de Firestore compartido, creándolo la primera vez que se pide."""
+    global _firestore_client
+    if _firestore_client is None:
+        _firestore_client = firestore.AsyncClient(project=settings.GOOGLE_CLOUD_PROJECT)
+    return _firestore_client
+
+
+def set_firestore(client: Any):
+    """Sustituye el cliente compartido (p. ej. por un falso en benchmarks)."""
+    global _firestore_client
+    _firestore_client = client
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Devuelve el cliente HTTP compartido (pool de conexiones con keep-alive y timeouts)."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            timeout=httpx.Timeout(settings.HTTP_TIMEOUT_SECONDS, connect=settings.HTTP_CONNECT_TIMEOUT_SECONDS),
+        )
+    return _http_client
+
+
+def set_http_client(client: Optional[httpx.AsyncClient]):
+    """Sustituye el cliente HTTP compartido (p. ej. por uno con MockTransport en benchmarks)."""
+    global _http_client
+    _http_client = client
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Devuelve el pool de procesos compartido, creándolo la primera vez que se pide."""
+    global _process_pool
+    if _process_pool is None:
+        # 'spawn': no heredamos por fork los hilos de gRPC ni el event loop del proceso principal.
+        _process_pool = ProcessPoolExecutor(
+            max_workers=settings.EXPORT_MAX_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+
+def discard_process_pool(pool: ProcessPoolExecutor):
+    """
+    Descarta un pool roto (un worker murió, p. ej. por OOM) para que get_process_pool cree otro.
+    Solo actúa si sigue siendo el pool compartido: varias peticiones pueden detectar la misma rotura.
+    """
+    global _process_pool
+    if _process_pool is pool:
+        _process_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def close_clients():
+    """Cierra el pool HTTP y el pool de procesos en el apagado."""
+    global _http_client, _process_pool
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+def ensure_firebase_app():
+    """Inicializa firebase_admin una sola vez (idempotente)."""
+    global _firebase_initialized
+    if _firebase_initialized:
+        return
+    import firebase_admin
+    from firebase_admin import credentials
+    try:
+        firebase_admin.initialize_app(credentials.ApplicationDefault())
+    except ValueError:
+        # Ya estaba inicializada.
+        pass
+    _firebase_initialized = True
+
+
+async def _timed(name: str, func, *args):
+    started = time.perf_counter()
+    try:
+        result = func(*args)
+        if asyncio.iscoroutine(result):
+            await result
+    except Exception as e:
+        log.warning(f"Arranque: fallo en '{name}': {e}")
+    finally:
+        _startup_profile[name] = round(time.perf_counter() - started, 4)
+
+
+async def _in_thread(func, *args):
+    await asyncio.to_thread(func, *args)
+
+
+async def _warm_up_firestore():
+    # Una lectura mínima abre el canal gRPC antes de la primera petición real.
+    await get_firestore().collection("customers").limit(1).get()
+
+
+async def initialize_clients():
+    """
+    Inicializa en paralelo los clientes de Google (logging, Vertex, Firebase, Firestore)
+    y, si STARTUP_WARMUP está activo, calienta canales y certificados antes de que la
+    instancia empiece a servir peticiones.
+    """
+    from src.modules import gemini_client
+    from src.core import token_verifier
+
+    _startup_profile["imports"] = round(time.perf_counter() - PROCESS_IMPORT_STARTED_AT, 4)
+    started = time.perf_counter()
+
+    await asyncio.gather(
+        _timed("cloud_logging", _in_thread, setup_cloud_logging),
+        _timed("vertex_ai", _in_thread, gemini_client.init_model),
+        _timed("firebase_admin", _in_thread, ensure_firebase_app),
+        _timed("firestore", get_firestore),
+    )
+
+    if settings.STARTUP_WARMUP:
+        await asyncio.gather(
+            _timed("warmup_firestore", _warm_up_firestore),
+            _timed("warmup_firebase_certs", token_verifier.warm_up),
+            _timed("warmup_vertex_model", gemini_client.warm_up),
+        )
+
+    _startup_profile["initialize_total"] = round(time.perf_counter() - started, 4)
+    _startup_profile["process_to_ready"] = round(time.perf_counter() - PROCESS_IMPORT_STARTED_AT, 4)
+    log.info(f"Perfil de arranque (s): {_startup_profile}")
+
+
+def get_startup_profile() -> Dict[str, Any]:
+    return dict(_startup_profile)
@@ -0,0 +1,220 @@
+# src/core/metrics.py
+
+import time
+import functools
+from bisect import bisect_left
+from typing import Dict, Any, Callable, Iterable, List, Optional, Sequence, Tuple
+
+# Cubetas por defecto (segundos) pensadas para latencias de red y de generación.
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class Histogram:
+    """
+    Histograma acumulativo de cubetas fijas. Cada worker de uvicorn tiene su propio
+    event loop de un solo hilo, así que basta con contadores simples sin locks.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative, running = {}, 0
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            cumulative[str(bound)] = running
+        cumulative["+Inf"] = self.count
+        return {"buckets": cumulative, "sum": self.sum, "count": self.count}
+
+
+class StageTimer:
+    """
+    Marca los hitos de una petición (segundos desde su llegada) y los registra en
+    un histograma por etapa. Cada etapa se mide solo la primera vez.
+    """
+
+    def __init__(self, histograms: Dict[str, Histogram], started_at: float):
+        self.histograms = histograms
+        self.started_at = started_at
+        self.marks: Dict[str, float] = {}
+
+    def mark(self, stage: str):
+        if stage in self.marks:
+            return
+        elapsed = time.perf_counter() - self.started_at
+        self.marks[stage] = elapsed
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.observe(elapsed)
+
+
+class Counter:
+    """Contador monótono."""
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Gauge:
+    """Valor instantáneo que puede subir y bajar."""
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+
+_KINDS = {"counter": Counter, "gauge": Gauge, "histogram": Histogram}
+
+
+class MetricFamily:
+    """Métrica con nombre, ayuda y (opcionalmente) etiquetas; cada combinación de etiquetas es un hijo."""
+
+    def __init__(self, name: str, help_text: str, kind: str, label_names: Tuple[str, ...] = (), **kwargs):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.label_names = label_names
+        self._kwargs = kwargs
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def labels(self, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = _KINDS[self.kind](**self._kwargs)
+        return child
+
+    # Atajos para métricas sin etiquetas.
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self) -> Iterable[Tuple[Dict[str, str], Any]]:
+        for key, child in self._children.items():
+            yield dict(zip(self.label_names, key)), child
+
+
+# Un colector devuelve familias calculadas al vuelo: (nombre, tipo, ayuda, [(etiquetas, valor o Histogram)]).
+CollectedFamily = Tuple[str, str, str, List[Tuple[Dict[str, str], Any]]]
+
+
+class MetricsRegistry:
+    """
+    Registro de métricas del proceso. Registrar es una suma en memoria: sin locks ni
+    E/S, apto para dejarlo activo en producción. Cada worker expone sus propios valores.
+    """
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._families: Dict[str, MetricFamily] = {}
+        self._collectors: List[Callable[[], Iterable[CollectedFamily]]] = []
+
+    def _family(self, name: str, help_text: str, kind: str, label_names: Sequence[str], **kwargs) -> MetricFamily:
+        full_name = self.prefix + name
+        family = self._families.get(full_name)
+        if family is None:
+            family = self._families[full_name] = MetricFamily(full_name, help_text, kind, tuple(label_names), **kwargs)
+        return family
+
+    def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> MetricFamily:
+        return self._family(name, help_text, "counter", label_names)
+
+    def gauge(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> MetricFamily:
+        return self._family(name, help_text, "gauge", label_names)
+
+    def histogram(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> MetricFamily:
+        return self._family(name, help_text, "histogram", label_names, buckets=buckets)
+
+    def add_collector(self, collector: Callable[[], Iterable[CollectedFamily]]):
+        """Registra una función que publica estadísticas ya existentes en otros módulos."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Formato de texto de exposición de Prometheus (versión 0.0.4)."""
+        lines: List[str] = []
+        for family in self._families.values():
+            _render_family(lines, family.name, family.kind, family.help_text, family.samples())
+        for collector in self._collectors:
+            try:
+                for name, kind, help_text, samples in collector():
+                    _render_family(lines, self.prefix + name, kind, help_text, samples)
+            except Exception as e:
+                lines.append(f"# colector con error: {type(e).__name__}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Dict[str, str], extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels.items())
+    if extra:
+        items.append(extra)
+    if not items:
+        return ""
+    escaped = (f'{k}="{_escape_label_value(str(v))}"' for k, v in items)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _render_family(lines: List[str], name: str, kind: str, help_text: str, samples: Iterable[Tuple[Dict[str, str], Any]]):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        if isinstance(value, Histogram):
+            snapshot = value.snapshot()
+            for bound, count in snapshot["buckets"].items():
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', bound))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {snapshot['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {snapshot['count']}")
+        else:
+            number = value.value if isinstance(value, (Counter, Gauge)) else value
+            lines.append(f"{name}{_format_labels(labels)} {float(number)}")
+
+
+registry = MetricsRegistry(prefix="precalifier_")
+
+
+def timed(family: MetricFamily, **labels: str):
+    """Decorador para corrutinas: registra su duración (también si lanzan excepción)."""
+    def decorator(func):
+        histogram = family.labels(**labels)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
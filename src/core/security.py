@@ -1,23 +1,23 @@
 # src/core/security.py
 
+import hmac
 import json
-import firebase_admin
-from firebase_admin import credentials, auth
+from firebase_admin import auth
 from fastapi import Request, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from src.config import settings, log
+from src.core.token_verifier import verify_id_token_async
+from src.core.metrics import registry, timed
 
-# --- Inicialización de Firebase Admin ---
-try:
-    cred = credentials.ApplicationDefault()
-    firebase_admin.initialize_app(cred)
-except ValueError:
-    pass
+AUTH_SECONDS = registry.histogram("auth_verification_seconds", "Duración de la verificación del Firebase ID token.")
+
+# La inicialización de Firebase Admin se hace en el lifespan (src/core/clients.py).
 
 # Esquema para documentación
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 # --- EL PORTERO (SÓLO AUTENTICACIÓN) ---
+@timed(AUTH_SECONDS)
 async def get_current_user(request: Request):
     """
     Dependencia para verificar el token de Firebase ID.
@@ -34,8 +34,8 @@ async def get_current_user(request: Request):
     token = auth_header.split("Bearer ")[1]
     
     try:
-        # 1. Verificar firma y validez del token
-        decoded_token = auth.verify_id_token(token)
+        # 1. Verificar firma y validez del token (fuera del event loop y con caché)
+        decoded_token = await verify_id_token_async(token)
         
         # 2. Retornamos el token decodificado
         return decoded_token
@@ -56,3 +56,21 @@ async def get_current_user(request: Request):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error interno de seguridad.",
         )
+
+# --- ACCESO A /metrics (token de servicio, no de usuario) ---
+def verify_metrics_token(request: Request):
+    """
+    Dependencia para /metrics: exige el token compartido METRICS_TOKEN.
+    Sin token configurado el endpoint no existe (404), para no exponer métricas internas.
+    """
+    expected = settings.METRICS_TOKEN
+    if not expected:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    auth_header = request.headers.get("Authorization") or ""
+    token = auth_header[len("Bearer "):] if auth_header.startswith("Bearer ") else ""
+    if not hmac.compare_digest(token.encode(), expected.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token de métricas ausente o inválido.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
@@ -0,0 +1,151 @@
+# src/core/sse.py
+
+import json
+import time
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, TypeVar, Union
+
+from src.config import settings
+
+# orjson es bastante más rápido que json.dumps; si no está instalado usamos la stdlib.
+try:
+    import orjson
+
+    def _dumps(data: Any) -> bytes:
+        return orjson.dumps(data)
+except ImportError:  # pragma: no cover - depende del entorno
+    def _dumps(data: Any) -> bytes:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+T = TypeVar("T")
+
+HEARTBEAT_FRAME = b": ping\n\n"
+
+
+def encode_event(data: Dict[str, Any]) -> bytes:
+    """Codifica un evento SSE 'data: {...}' listo para enviar."""
+    return b"data: " + _dumps(data) + b"\n\n"
+
+
+class SSEWriter:
+    """
+    Escritor SSE reutilizable para los streams de análisis.
+    - Acumula la transcripción en una lista (sin concatenaciones cuadráticas).
+    - Agrupa fragmentos pequeños de texto en un solo frame al superar un tamaño o un tiempo.
+    - Lleva la cuenta de bytes y frames enviados.
+    """
+
+    def __init__(self, coalesce_min_chars: Optional[int] = None, coalesce_max_delay: Optional[float] = None):
+        self.coalesce_min_chars = settings.SSE_COALESCE_MIN_CHARS if coalesce_min_chars is None else coalesce_min_chars
+        self.coalesce_max_delay = settings.SSE_COALESCE_MAX_DELAY_SECONDS if coalesce_max_delay is None else coalesce_max_delay
+        self._parts: List[str] = []
+        self._pending: List[str] = []
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+        self.bytes_sent = 0
+        self.frames_sent = 0
+
+    def _count(self, frame: bytes) -> bytes:
+        self.bytes_sent += len(frame)
+        self.frames_sent += 1
+        return frame
+
+    def event(self, data: Dict[str, Any]) -> bytes:
+        return self._count(encode_event(data))
+
+    def heartbeat(self) -> bytes:
+        """Comentario SSE que mantiene viva la conexión durante pausas largas del modelo."""
+        return self._count(HEARTBEAT_FRAME)
+
+    def text(self, chunk: str) -> Optional[bytes]:
+        """
+        Registra un fragmento de texto. Devuelve un frame si toca enviar, o None si
+        el fragmento queda en espera para agruparse con los siguientes.
+        """
+        self._parts.append(chunk)
+        self._pending.append(chunk)
+        self._pending_chars += len(chunk)
+        if (self._pending_chars >= self.coalesce_min_chars
+                or time.monotonic() - self._last_flush >= self.coalesce_max_delay):
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[bytes]:
+        """Envía el texto pendiente (si lo hay) como un único evento 'text'."""
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return None
+        text = self._pending[0] if len(self._pending) == 1 else "".join(self._pending)
+        self._pending.clear()
+        self._pending_chars = 0
+        return self.event({"text": text})
+
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
+    def idle_timeout(self, heartbeat_interval: float) -> float:
+        """Tiempo máximo de espera del siguiente fragmento antes de vaciar o enviar heartbeat."""
+        return self.coalesce_max_delay if self._pending else heartbeat_interval
+
+    def transcript(self) -> str:
+        return "".join(self._parts)
+
+
+async def iter_with_heartbeat(
+    source: AsyncIterator[T], interval: Union[float, Callable[[], float]],
+    wake: Optional[asyncio.Future] = None,
+) -> AsyncIterator[Optional[T]]:
+    """
+    Reenvía los elementos de 'source' y emite None cada vez que pasan 'interval'
+    segundos sin recibir nada, para que el llamador pueda enviar un heartbeat o
+    vaciar el texto agrupado. 'interval' puede ser un callable que se evalúa en
+    cada espera. El __anext__ pendiente no se cancela entre heartbeats.
+    Si se pasa 'wake', también se emite None en cuanto ese futuro termina (una sola
+    vez), p. ej. para reaccionar a la verificación de la suscripción sin esperar al
+    siguiente fragmento ni al heartbeat.
+    """
+    iterator = source.__aiter__()
+    next_item: Optional[asyncio.Task] = None
+    try:
+        while True:
+            if next_item is None:
+                next_item = asyncio.ensure_future(iterator.__anext__())
+            timeout = interval() if callable(interval) else interval
+            waiting = {next_item} if wake is None else {next_item, wake}
+            done, _ = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if wake is not None and wake.done():
+                wake = None
+            if next_item not in done:
+                yield None
+                continue
+            try:
+                item = next_item.result()
+            except StopAsyncIteration:
+                next_item = None
+                return
+            next_item = None
+            yield item
+    finally:
+        # Sin awaits aquí: si el stream se cancela (desconexión del cliente) el ámbito de
+        # cancelación volvería a interrumpirlos. Cancelar la tarea basta para que la fuente
+        # reciba CancelledError y ejecute su limpieza; si estaba en reposo, se cierra aparte.
+        if next_item is not None and not next_item.done():
+            next_item.cancel()
+        else:
+            close_in_background(iterator)
+
+
+def close_in_background(iterator: Any):
+    """
+    Programa el cierre (aclose) de un generador asíncrono sin esperarlo. Útil en
+    bloques de limpieza que pueden ejecutarse dentro de un ámbito ya cancelado.
+    """
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is None:
+        return
+    try:
+        asyncio.get_running_loop().create_task(aclose())
+    except RuntimeError:
+        # Sin event loop activo (finalización por GC): el generador se cerrará solo.
+        pass
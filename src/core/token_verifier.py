@@ -0,0 +1,212 @@
+# src/core/token_verifier.py
+
+import re
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+import jwt
+from cryptography.x509 import load_pem_x509_certificate
+from firebase_admin import auth
+
+from src.config import settings, log
+from src.core.clients import get_http_client
+
+# Margen antes de la expiración de los certificados para refrescarlos en segundo plano.
+_CERTS_REFRESH_MARGIN_SECONDS = 60
+# Tiempo de vida por defecto si Google no envía Cache-Control.
+_CERTS_DEFAULT_MAX_AGE_SECONDS = 3600
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+def _firebase_project_id() -> str:
+    return settings.FIREBASE_PROJECT_ID or settings.GOOGLE_CLOUD_PROJECT
+
+
+# --- ALMACÉN DE CLAVES PÚBLICAS ---
+class _PublicKeyStore:
+    """
+    Mantiene en memoria las claves públicas de securetoken@system.gserviceaccount.com.
+    Se refrescan según el Cache-Control de la respuesta de Google, en segundo plano,
+    para que ninguna petición tenga que esperar la descarga de certificados.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self._keys: Dict[str, Any] = {}
+        self._expires_at: float = 0.0
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _is_fresh(self) -> bool:
+        return bool(self._keys) and time.time() < self._expires_at
+
+    async def _fetch(self):
+        response = await get_http_client().get(self.url)
+        response.raise_for_status()
+
+        # El parseo de los certificados x509 es CPU; lo sacamos del event loop.
+        keys = await asyncio.to_thread(
+            lambda certs: {kid: load_pem_x509_certificate(pem.encode()).public_key() for kid, pem in certs.items()},
+            response.json(),
+        )
+        match = _MAX_AGE_RE.search(response.headers.get("cache-control", ""))
+        max_age = int(match.group(1)) if match else _CERTS_DEFAULT_MAX_AGE_SECONDS
+
+        self._keys = keys
+        self._expires_at = time.time() + max_age
+        log.info(f"Claves públicas de Firebase actualizadas ({len(keys)} claves, max-age={max_age}s).")
+
+    async def get_keys(self) -> Dict[str, Any]:
+        if not self._is_fresh():
+            async with self._lock:
+                if not self._is_fresh():
+                    await self._fetch()
+        self._schedule_refresh()
+        return self._keys
+
+    def _schedule_refresh(self):
+        if self._refresh_task and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        while True:
+            delay = max(self._expires_at - time.time() - _CERTS_REFRESH_MARGIN_SECONDS, 1.0)
+            await asyncio.sleep(delay)
+            try:
+                async with self._lock:
+                    await self._fetch()
+            except Exception as e:
+                # Conservamos las claves actuales y reintentamos pronto.
+                log.warning(f"No se pudieron refrescar las claves públicas de Firebase: {e}")
+                self._expires_at = time.time() + _CERTS_REFRESH_MARGIN_SECONDS + 30
+
+
+# --- CACHÉ DE TOKENS YA VERIFICADOS ---
+class _DecodedTokenCache:
+    """LRU acotada de tokens decodificados, indexada por hash del token y caducada en su 'exp'."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        decoded = self._entries.get(key)
+        if decoded is None:
+            self.misses += 1
+            return None
+        if decoded.get("exp", 0) <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return decoded
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put(self, key: str, decoded: Dict[str, Any]):
+        self._entries[key] = decoded
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+_key_store = _PublicKeyStore(settings.FIREBASE_CERTS_URL)
+_token_cache = _DecodedTokenCache(settings.AUTH_TOKEN_CACHE_MAX_SIZE)
+
+
+def _decode_with_keys(token: str, keys: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Replica las comprobaciones de firebase_admin.auth.verify_id_token (firma RS256,
+    aud, iss, sub, exp, iat, auth_time) usando las claves en memoria.
+    Traduce los errores a las excepciones de firebase_admin para que los llamadores no cambien.
+    """
+    project_id = _firebase_project_id()
+    try:
+        header = jwt.get_unverified_header(token)
+        kid = header.get("kid")
+        if header.get("alg") != "RS256" or kid not in keys:
+            raise auth.InvalidIdTokenError("El token tiene un algoritmo o 'kid' no reconocido.")
+
+        decoded = jwt.decode(
+            token,
+            key=keys[kid],
+            algorithms=["RS256"],
+            audience=project_id,
+            issuer=f"https://securetoken.google.com/{project_id}",
+            options={"require": ["exp", "iat", "sub"]},
+        )
+    except jwt.ExpiredSignatureError as e:
+        raise auth.ExpiredIdTokenError("El token ha expirado.", e)
+    except jwt.InvalidTokenError as e:
+        raise auth.InvalidIdTokenError(f"Token inválido: {e}", cause=e)
+
+    sub = decoded.get("sub")
+    if not isinstance(sub, str) or not sub or len(sub) > 128:
+        raise auth.InvalidIdTokenError("El claim 'sub' del token es inválido.")
+    if decoded.get("auth_time", 0) > time.time():
+        raise auth.InvalidIdTokenError("El claim 'auth_time' está en el futuro.")
+
+    decoded["uid"] = sub
+    return decoded
+
+
+def _verify_with_sdk(token: str) -> Dict[str, Any]:
+    from src.core.clients import ensure_firebase_app
+    ensure_firebase_app()
+    return auth.verify_id_token(token)
+
+
+async def warm_up():
+    """Descarga las claves públicas durante el arranque."""
+    await _key_store.get_keys()
+
+
+async def verify_id_token_async(token: str) -> Dict[str, Any]:
+    """
+    Verifica un Firebase ID token sin bloquear el event loop.
+    Primero consulta la caché de tokens ya verificados; si no está, verifica la firma
+    en un hilo con las claves públicas en memoria.
+    """
+    cache_enabled = settings.AUTH_TOKEN_CACHE_ENABLED
+    key = _DecodedTokenCache.key_for(token)
+
+    if cache_enabled:
+        cached = _token_cache.get(key)
+        if cached is not None:
+            return cached
+
+    try:
+        keys = await _key_store.get_keys()
+    except Exception as e:
+        # Si no podemos descargar las claves, delegamos en el SDK (también fuera del loop).
+        log.warning(f"Claves públicas no disponibles, usando firebase_admin directamente: {e}")
+        decoded = await asyncio.to_thread(_verify_with_sdk, token)
+    else:
+        decoded = await asyncio.to_thread(_decode_with_keys, token, keys)
+
+    if cache_enabled:
+        _token_cache.put(key, decoded)
+    return decoded
+
+
+def get_stats() -> Dict[str, Any]:
+    """Contadores de la caché de tokens para monitorización."""
+    total = _token_cache.hits + _token_cache.misses
+    return {
+        "hits": _token_cache.hits,
+        "misses": _token_cache.misses,
+        "hit_ratio": (_token_cache.hits / total) if total else 0.0,
+        "size": len(_token_cache),
+    }
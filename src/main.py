@@ -1,28 +1,66 @@
 # src/main.py
 
-import json
 import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
-from fastapi import FastAPI, Request, Depends, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, Request, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict, Any
-from google.cloud import firestore
+from typing import Dict, Any, List
 
 from src.config import settings, log
-from src.core.security import get_current_user
-from src.core.prompts import PRECALIFIER_SYSTEM_PROMPT
-from src.models.schemas import AnalysisRequest
-from src.modules import gemini_client, firestore_client
+from src.core.security import get_current_user, verify_metrics_token
+from src.core.clients import initialize_clients, close_clients, get_firestore, get_startup_profile
+from src.core.metrics import Histogram, StageTimer, registry, timed
+from src.core import token_verifier
+from src.core.sse import SSEWriter, iter_with_heartbeat, close_in_background
+from src.core.prompts import PRECALIFIER_SYSTEM_PROMPT, FOLLOWUP_SYSTEM_PROMPT
+from src.models.schemas import AnalysisRequest, BatchAnalysisRequest, FollowupRequest
+from src.modules import gemini_client, firestore_client, long_input, retrieval, exporter, followups
+from src.modules.subscription_cache import get_subscription_status, subscription_cache
+from src.modules.admission import admission_controller, QueueFullError
+from src.modules.stream_registry import stream_registry, StreamGoneError
+from src.modules.analysis_cache import analysis_cache, build_cache_key, iter_replay_chunks
+from src.modules.batch_jobs import BatchJob, batch_job_registry
 
-# Cliente Firestore para verificación de suscripción
-db = firestore.AsyncClient(project=settings.GOOGLE_CLOUD_PROJECT)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Arranque: clientes de Google en paralelo (y calentamiento opcional) antes de servir tráfico.
+    await initialize_clients()
+    # Reproducimos escrituras volcadas y arrancamos la cola diferida.
+    await firestore_client.write_queue.start()
+    yield
+    # Apagado (SIGTERM de Cloud Run): primero se cancelan los lotes en curso, para que no
+    # encolen escrituras durante el vaciado; los elementos ya terminados sí se guardan.
+    await batch_job_registry.cancel_all()
+    # Vaciamos la cola dentro del plazo.
+    await firestore_client.write_queue.drain(settings.WRITE_QUEUE_SHUTDOWN_DEADLINE_SECONDS)
+    # Cancela las escuchas on_snapshot de suscripciones para que sus hilos no queden vivos.
+    subscription_cache.close()
+    await close_clients()
 
 app = FastAPI(
     title="PIDA Pre-Calificador API",
-    description="Microservicio para análisis preliminar de violaciones de DDHH."
+    description="Microservicio para análisis preliminar de violaciones de DDHH.",
+    lifespan=lifespan
 )
 
+# --- MARCA DE LLEGADA DE CADA PETICIÓN ---
+class RequestTimingMiddleware:
+    """Middleware ASGI puro (no envuelve el stream) que anota la llegada en request.state.received_at."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            scope.setdefault("state", {})["received_at"] = time.perf_counter()
+        await self.app(scope, receive, send)
+
+app.add_middleware(RequestTimingMiddleware)
+
 # --- CONFIGURACIÓN CORS ---
 origins = settings.ALLOWED_ORIGINS
 app.add_middleware(
@@ -32,9 +70,70 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Stream-Id", "X-Job-Id"],
 )
 
+# --- MÉTRICAS ---
+SUBSCRIPTION_SECONDS = registry.histogram("subscription_lookup_seconds", "Duración de la verificación de suscripción (VIP o Firestore).")
+ACTIVE_STREAMS = registry.gauge("active_streams", "Streams de análisis generándose en este worker.")
+
+def collect_service_metrics():
+    """Publica en /metrics las estadísticas que ya mantienen los demás módulos."""
+    token_stats = token_verifier.get_stats()
+    subscription_stats = subscription_cache.get_stats()
+    cache_stats = analysis_cache.get_stats()
+    stream_registry_stats = stream_registry.get_stats()
+    write_queue = firestore_client.write_queue
+    yield ("auth_token_cache_total", "counter", "Consultas a la caché de tokens verificados.",
+           [({"result": "hit"}, token_stats["hits"]), ({"result": "miss"}, token_stats["misses"])])
+    yield ("subscription_cache_total", "counter", "Consultas a la caché de suscripciones.",
+           [({"result": "hit"}, subscription_stats["hits"]), ({"result": "miss"}, subscription_stats["misses"])])
+    yield ("analysis_cache_total", "counter", "Consultas a la caché de análisis.",
+           [({"result": "memory_hit"}, cache_stats["memory_hits"]),
+            ({"result": "firestore_hit"}, cache_stats["firestore_hits"]),
+            ({"result": "miss"}, cache_stats["misses"])])
+    yield ("admission_in_flight", "gauge", "Generaciones de Gemini en curso.", [({}, admission_controller.in_flight)])
+    yield ("admission_queued", "gauge", "Peticiones esperando turno de generación.", [({}, admission_controller.queued)])
+    yield ("admission_rejected_total", "counter", "Peticiones rechazadas con 429 por cola llena.", [({}, admission_controller.rejected)])
+    yield ("admission_wait_seconds", "histogram", "Espera en la cola de admisión.", [({}, admission_controller.wait_time)])
+    yield ("admission_queue_depth", "histogram", "Profundidad de la cola al encolar.", [({}, admission_controller.queue_depth)])
+    yield ("gemini_retries_total", "counter", "Reintentos ante errores recuperables de Vertex.", [({}, gemini_client.get_stats()["retries"])])
+    yield ("firestore_write_queue_pending", "gauge", "Escrituras pendientes en la cola diferida.", [({}, len(write_queue))])
+    yield ("firestore_writes_total", "counter", "Escrituras de la cola diferida por resultado.",
+           [({"result": "written"}, write_queue.written), ({"result": "dropped"}, write_queue.dropped),
+            ({"result": "spilled"}, write_queue.spilled)])
+    yield ("firestore_write_lag_seconds", "histogram", "Tiempo entre encolar y confirmar una escritura.", [({}, write_queue.lag)])
+    yield ("firestore_batch_commit_seconds", "histogram", "Latencia de los batched writes.", [({}, write_queue.commit_latency)])
+    yield ("stream_buffer_bytes", "gauge", "Bytes en buffers de streams reanudables.", [({}, stream_registry_stats["buffered_bytes"])])
+    yield ("stream_resumes_total", "counter", "Reanudaciones con Last-Event-ID.", [({}, stream_registry_stats["resumes"])])
+    yield ("stream_cancellations_total", "counter", "Streams cancelados por desconexión del cliente.", [({}, stream_stats["cancelled_streams"])])
+    yield ("batch_jobs_active", "gauge", "Lotes de precalificaciones en curso.", [({}, batch_job_registry.get_stats()["active"])])
+    yield ("export_cache_total", "counter", "Consultas a la caché de documentos exportados.",
+           [({"result": "hit"}, exporter.artifact_cache.hits), ({"result": "miss"}, exporter.artifact_cache.misses)])
+    yield ("export_cache_bytes", "gauge", "Bytes en la caché de documentos exportados.", [({}, exporter.artifact_cache.size_bytes)])
+    yield ("followup_sessions", "gauge", "Sesiones de seguimiento en caché.", [({}, len(followups.session_cache))])
+    yield ("pipeline_stage_seconds", "histogram", "Segundos desde la llegada de la petición hasta cada etapa.",
+           [({"stage": stage}, histogram) for stage, histogram in pipeline_stage_seconds.items()])
+
+registry.add_collector(collect_service_metrics)
+
 # --- VERIFICACIÓN DE SUSCRIPCIÓN ---
+# Listas blancas VIP precompiladas como conjuntos para búsquedas O(1).
+VIP_DOMAINS = frozenset(settings.ADMIN_DOMAINS)
+VIP_EMAILS = frozenset(settings.ADMIN_EMAILS)
+
+def is_vip_user(user_email: str) -> bool:
+    email_domain = user_email.rpartition("@")[2] if "@" in user_email else ""
+    return email_domain in VIP_DOMAINS or user_email in VIP_EMAILS
+
+async def fetch_subscription_status(user_id: str) -> bool:
+    """Consulta en Firestore (Stripe) si el usuario tiene una suscripción activa o en prueba."""
+    subscriptions_ref = get_firestore().collection("customers").document(user_id).collection("subscriptions")
+    query = subscriptions_ref.where("status", "in", ["active", "trialing"]).limit(1)
+    results = [doc async for doc in query.stream()]
+    return bool(results)
+
+@timed(SUBSCRIPTION_SECONDS)
 async def verify_active_subscription(current_user: Dict[str, Any]):
     """
     Verifica si el usuario es VIP o tiene una suscripción activa en Stripe.
@@ -43,21 +142,15 @@ async def verify_active_subscription(current_user: Dict[str, Any]):
     user_email = current_user.get("email", "").strip().lower()
     
     # 1. Comprobar si es VIP (Listas blancas en settings)
-    allowed_domains = settings.ADMIN_DOMAINS
-    allowed_emails = settings.ADMIN_EMAILS
-    email_domain = user_email.split("@")[-1] if "@" in user_email else ""
-
-    if (email_domain in allowed_domains) or (user_email in allowed_emails):
+    if is_vip_user(user_email):
         log.info(f"Acceso VIP concedido en Precalificador: {user_email}")
         return
 
-    # 2. Comprobar suscripción en Firestore (Stripe)
+    # 2. Comprobar suscripción en Firestore (Stripe), con caché por instancia
     try:
-        subscriptions_ref = db.collection("customers").document(user_id).collection("subscriptions")
-        query = subscriptions_ref.where("status", "in", ["active", "trialing"]).limit(1)
-        results = [doc async for doc in query.stream()]
+        is_active = await get_subscription_status(user_id, fetch_subscription_status)
         
-        if not results:
+        if not is_active:
             raise HTTPException(status_code=403, detail="No tienes una suscripción activa.")
     except HTTPException as he:
         raise he
@@ -65,61 +158,462 @@ async def verify_active_subscription(current_user: Dict[str, Any]):
         log.error(f"Error verificando suscripción en Precalificador: {e}")
         raise HTTPException(status_code=500, detail="Error interno verificando suscripción.")
 
-# --- GENERADOR STREAMING PARA ANÁLISIS ---
-async def stream_analysis_generator(request_data: AnalysisRequest, user: Dict[str, Any]):
+# --- DESCONEXIÓN DEL CLIENTE ---
+stream_stats = {"cancelled_streams": 0, "persisted_truncated": 0}
+
+def handle_client_disconnect(request_data: AnalysisRequest, user: Dict[str, Any], partial_text: str):
     """
-    Genera el análisis jurídico en streaming usando Gemini y guarda el resultado al finalizar.
+    Aplica DISCONNECT_POLICY al análisis parcial de un stream abandonado.
+    Es síncrona a propósito: puede ejecutarse dentro de un ámbito ya cancelado.
     """
-    def create_sse_event(data: dict) -> str:
-        return f"data: {json.dumps(data)}\n\n"
+    stream_stats["cancelled_streams"] += 1
+    log.info(f"Cliente desconectado durante el análisis del usuario {user['uid']} ({len(partial_text)} caracteres generados).")
+    if settings.DISCONNECT_POLICY == "persist_truncated" and partial_text:
+        stream_stats["persisted_truncated"] += 1
+        try:
+            firestore_client.enqueue_prequalification(
+                user_id=user['uid'],
+                title=request_data.title,
+                facts=request_data.facts,
+                analysis_result=partial_text,
+                country_code=request_data.country_code,
+                truncated=True
+            )
+        except Exception as e:
+            log.warning(f"No se pudo guardar el análisis truncado del usuario {user['uid']}: {e}")
 
-    try:
-        yield create_sse_event({"event": "status", "message": "Analizando relato de hechos..."})
-        await asyncio.sleep(0.5) 
+# --- AUTORIZACIÓN ESPECULATIVA ---
+def authorization_failure(authorization: asyncio.Task) -> Dict[str, Any] | None:
+    """Traduce el resultado de una verificación de suscripción terminada a un evento de error (o None si pasó)."""
+    if authorization.cancelled():
+        return {'error': 'Error interno verificando suscripción.', 'status_code': 500}
+    error = authorization.exception()
+    if error is None:
+        return None
+    if isinstance(error, HTTPException):
+        return {'error': error.detail, 'status_code': error.status_code}
+    log.error(f"Error verificando suscripción en modo especulativo: {error}")
+    return {'error': 'Error interno verificando suscripción.', 'status_code': 500}
 
-        geo_context = f"Contexto Geográfico: {request_data.country_code}" if request_data.country_code else "Contexto Geográfico: Universal"
-        
-        final_prompt = f"""
+# --- GENERADOR STREAMING PARA ANÁLISIS ---
+pipeline_stage_seconds: Dict[str, Histogram] = {}
+
+FACTS_HEADING = "RELATO DE HECHOS PROPORCIONADO POR EL USUARIO:"
+
+def build_analysis_prompt(
+    country_code: str | None,
+    facts_text: str,
+    facts_heading: str = FACTS_HEADING,
+    passages: List[retrieval.Passage] | None = None
+) -> str:
+    """Prompt de precalificación: contexto geográfico, hechos (o su resumen) y bases jurídicas recuperadas."""
+    geo_context = f"Contexto Geográfico: {country_code}" if country_code else "Contexto Geográfico: Universal"
+    legal_references = ""
+    if passages:
+        legal_references = f"""
+        BASES JURÍDICAS DE REFERENCIA (recuperadas automáticamente; cítalas solo si son pertinentes):
+        --------------------------------------------------
+        {retrieval.format_passages(passages)}
+        --------------------------------------------------
+        """
+    return f"""
         {geo_context}
         
-        RELATO DE HECHOS PROPORCIONADO POR EL USUARIO:
+        {facts_heading}
         --------------------------------------------------
-        {request_data.facts}
+        {facts_text}
         --------------------------------------------------
-        
+        {legal_references}
         Realiza el análisis de precalificación solicitado.
         """
+
+def long_facts_heading(segment_count: int) -> str:
+    return f"HECHOS RELEVANTES EXTRAÍDOS DEL RELATO ({segment_count} FRAGMENTOS, EN ORDEN):"
+
+async def summarize_long_facts(facts: str, user_id: str) -> tuple[str, str] | None:
+    """
+    Si el relato supera el umbral, devuelve (encabezado, resumen combinado) sin emitir progreso.
+    Cada extracción pide su propio turno de admisión: no llamar con un turno ya retenido.
+    """
+    if not settings.LONG_INPUT_ENABLED:
+        return None
+    is_long, _ = await long_input.needs_map_reduce(facts)
+    if not is_long:
+        return None
+    segments = long_input.split_segments(facts)
+    digests: Dict[int, str] = {}
+    async for segment, digest, _cached in long_input.iter_segment_digests(segments, user_id):
+        digests[segment.index] = digest
+    return long_facts_heading(len(segments)), long_input.merge_digests(digests)
+
+async def stream_analysis_generator(
+    request_data: AnalysisRequest,
+    user: Dict[str, Any],
+    authorization: asyncio.Task | None = None,
+    timer: StageTimer | None = None,
+    retrieval_task: asyncio.Task | None = None
+):
+    """
+    Genera el análisis jurídico en streaming usando Gemini y guarda el resultado al finalizar.
+    Se ejecuta en la tarea del stream_registry, no en la conexión HTTP: si no quedan clientes
+    tras el periodo de gracia, el registro cancela la tarea y se corta la generación en Vertex.
+    Si se recibe 'authorization' (modo especulativo), la generación arranca mientras se
+    verifica la suscripción: los tokens se retienen hasta que la tarea termina bien y,
+    si falla, se cancela la llamada a Gemini y se emite un evento de error.
+    'retrieval_task' es la consulta al RAG lanzada junto con la verificación de suscripción;
+    sus pasajes se añaden al prompt como bases jurídicas de referencia.
+    """
+    writer = SSEWriter()
+    timer = timer or StageTimer(pipeline_stage_seconds, time.perf_counter())
+    ACTIVE_STREAMS.inc()
+    heartbeat_interval = settings.SSE_HEARTBEAT_INTERVAL_SECONDS
+    completed = False
+    chunks = None
+    authorized = authorization is None
+    held: List[bytes] = []
+
+    try:
+        yield writer.event({"event": "status", "message": "Analizando relato de hechos..."})
+
+        facts_heading = FACTS_HEADING
+        facts_text = request_data.facts
         
-        full_response_text = ""
-        
-        async for chunk in gemini_client.generate_streaming_response(
-            system_prompt=PRECALIFIER_SYSTEM_PROMPT,
-            prompt=final_prompt,
-            history=[] 
-        ):
-            yield create_sse_event({'text': chunk})
-            full_response_text += chunk
+        use_cache = settings.ANALYSIS_CACHE_ENABLED and not request_data.bypass_cache
+        cache_key = build_cache_key(request_data.facts, request_data.country_code) if use_cache else None
+
+        cached_analysis = None
+        if use_cache and not request_data.refresh_cache:
+            cached_analysis = await analysis_cache.get(cache_key)
+        timer.mark("cache_lookup")
+
+        if cached_analysis is not None:
+            if not authorized:
+                await asyncio.wait({authorization})
+                failure = authorization_failure(authorization)
+                if failure:
+                    yield writer.event(failure)
+                    return
+                authorized = True
+                timer.mark("subscription")
+            # Reproducimos el análisis cacheado con el mismo protocolo de eventos 'text'.
+            log.info(f"Análisis servido desde caché ({cache_key[:12]}) para usuario {user['uid']}")
+            for chunk in iter_replay_chunks(cached_analysis):
+                yield writer.event({'text': chunk})
+                timer.mark("first_token_sent")
+            full_response_text = cached_analysis
+        else:
+            # Relatos extensos: extracción por segmentos en paralelo y precalificación sobre el resumen.
+            # Va antes del turno de la generación final porque cada extracción pide el suyo:
+            # retener uno mientras se esperan los de los segmentos podría bloquear la cola.
+            is_long, token_count = (await long_input.needs_map_reduce(request_data.facts)) if settings.LONG_INPUT_ENABLED else (False, 0)
+            if is_long:
+                # Las extracciones son varias llamadas a Gemini: no se lanzan de forma especulativa.
+                if not authorized:
+                    await asyncio.wait({authorization})
+                    failure = authorization_failure(authorization)
+                    if failure:
+                        yield writer.event(failure)
+                        return
+                    authorized = True
+                    timer.mark("subscription")
+                segments = long_input.split_segments(request_data.facts)
+                yield writer.event({
+                    "event": "status",
+                    "message": f"Relato extenso (~{token_count} tokens): procesando {len(segments)} fragmentos...",
+                    "segments": len(segments)
+                })
+                digests: Dict[int, str] = {}
+                chunks = iter_with_heartbeat(
+                    long_input.iter_segment_digests(segments, user['uid']), lambda: writer.idle_timeout(heartbeat_interval)
+                )
+                try:
+                    async for item in chunks:
+                        if item is None:
+                            yield writer.heartbeat()
+                            continue
+                        segment, digest, cached = item
+                        digests[segment.index] = digest
+                        yield writer.event({
+                            "event": "segment",
+                            "index": segment.index,
+                            "total": len(segments),
+                            "completed": len(digests),
+                            "cached": cached
+                        })
+                except QueueFullError as e:
+                    yield writer.event({'error': 'El servicio está saturado, inténtalo de nuevo en unos segundos.', 'retry_after': e.retry_after})
+                    return
+                timer.mark("map_reduce")
+                facts_heading = long_facts_heading(len(segments))
+                facts_text = long_input.merge_digests(digests)
+
+            # El prompt se completa antes de pedir turno: un RAG lento no debe ocupar un hueco de Gemini.
+            passages = None
+            retrieval_degraded = False
+            if retrieval_task is not None:
+                passages, retrieval_degraded = await retrieval.wait_for_passages(retrieval_task)
+                timer.mark("retrieval")
+            final_prompt = build_analysis_prompt(request_data.country_code, facts_text, facts_heading, passages)
+
+            # Turno en el control de admisión: limita las generaciones simultáneas por instancia.
+            try:
+                ticket = admission_controller.enqueue(user['uid'])
+            except QueueFullError as e:
+                yield writer.event({'error': 'El servicio está saturado, inténtalo de nuevo en unos segundos.', 'retry_after': e.retry_after})
+                return
+
+            try:
+                async for position in ticket.wait(settings.ADMISSION_STATUS_INTERVAL_SECONDS):
+                    yield writer.event({"event": "status", "message": f"En cola de análisis (posición {position})...", "queue_position": position})
+                timer.mark("admission")
+
+                yield writer.event({"event": "status", "message": "Generando análisis jurídico..."})
+
+                generation_failed = False
+                stream = gemini_client.generate_streaming_response(
+                    system_prompt=PRECALIFIER_SYSTEM_PROMPT,
+                    prompt=final_prompt,
+                    history=[] 
+                )
+                # La verificación despierta el bucle al terminar: los tokens retenidos se liberan, o el 403
+                # se envía y la generación se cancela, sin esperar al siguiente fragmento ni al heartbeat.
+                chunks = iter_with_heartbeat(
+                    stream, lambda: writer.idle_timeout(heartbeat_interval),
+                    wake=None if authorized else authorization
+                )
+                async for chunk in chunks:
+                    if not authorized and authorization.done():
+                        failure = authorization_failure(authorization)
+                        if failure:
+                            # Autorización denegada: cortamos la generación en Vertex.
+                            await chunks.aclose()
+                            yield writer.event(failure)
+                            return
+                        authorized = True
+                        timer.mark("subscription")
+                        for frame in held:
+                            yield frame
+                            timer.mark("first_token_sent")
+                        held.clear()
+
+                    if chunk is None:
+                        # Sin texto nuevo: vaciamos lo agrupado o enviamos heartbeat.
+                        if not writer.has_pending:
+                            yield writer.heartbeat()
+                        elif authorized:
+                            yield writer.flush()
+                        else:
+                            held.append(writer.flush())
+                        continue
+                    timer.mark("upstream_first_token")
+                    frame = writer.text(chunk)
+                    if frame:
+                        if authorized:
+                            yield frame
+                            timer.mark("first_token_sent")
+                        else:
+                            held.append(frame)
+                    if chunk in gemini_client.ERROR_MESSAGES:
+                        generation_failed = True
+            finally:
+                ticket.release()
+
+            frame = writer.flush()
+            if frame:
+                held.append(frame)
+            if not authorized:
+                # La generación terminó antes que la verificación: esperamos su resultado.
+                await asyncio.wait({authorization})
+                failure = authorization_failure(authorization)
+                if failure:
+                    yield writer.event(failure)
+                    return
+                authorized = True
+                timer.mark("subscription")
+            for frame in held:
+                yield frame
+                timer.mark("first_token_sent")
+            held.clear()
+            full_response_text = writer.transcript()
+
+            # Un análisis sin bases jurídicas por un fallo del RAG no se cachea (la clave no las incluye).
+            if use_cache and full_response_text and not generation_failed and not retrieval_degraded:
+                await analysis_cache.put(cache_key, full_response_text, request_data.country_code)
 
         if full_response_text:
-            asyncio.create_task(firestore_client.save_prequalification(
+            await firestore_client.save_prequalification(
                 user_id=user['uid'],
                 title=request_data.title,
                 facts=request_data.facts,
                 analysis_result=full_response_text,
                 country_code=request_data.country_code
-            ))
+            )
         
-        yield create_sse_event({'event': 'done'})
+        completed = True
+        timer.mark("done")
+        log.info(f"Etapas del análisis (s desde la petición): { {k: round(v, 3) for k, v in timer.marks.items()} }")
+        yield writer.event({'event': 'done'})
 
+    except (asyncio.CancelledError, GeneratorExit):
+        # El stream_registry cancela la tarea cuando el stream queda abandonado; al propagarse
+        # la cancelación, iter_with_heartbeat cancela la petición pendiente a Gemini.
+        if chunks is not None:
+            close_in_background(chunks)
+        if not completed and authorized:
+            handle_client_disconnect(request_data, user, writer.transcript())
+        raise
     except Exception as e:
         log.error(f"Error crítico en precalificador: {e}", exc_info=True)
-        yield f"data: {json.dumps({'error': 'Error interno al analizar el caso.'})}\n\n"
+        yield writer.event({'error': 'Error interno al analizar el caso.'})
+    finally:
+        # Cualquier salida temprana (cola llena, error, cancelación) no debe dejar viva
+        # la comprobación de suscripción especulativa ni la recuperación.
+        if authorization is not None and not authorization.done():
+            authorization.cancel()
+        if retrieval_task is not None and not retrieval_task.done():
+            retrieval_task.cancel()
+        ACTIVE_STREAMS.dec()
+
+# --- PREGUNTAS DE SEGUIMIENTO ---
+async def stream_followup_generator(
+    session: followups.FollowupSession,
+    question: str,
+    user: Dict[str, Any],
+    request: Request | None = None
+):
+    """
+    Responde en streaming a una pregunta de seguimiento usando el informe guardado como
+    contexto y el historial acotado de la sesión (sin repetir el informe completo).
+    """
+    writer = SSEWriter()
+    ACTIVE_STREAMS.inc()
+    heartbeat_interval = settings.SSE_HEARTBEAT_INTERVAL_SECONDS
+    chunks = None
+
+    try:
+        async with session.lock:
+            try:
+                ticket = admission_controller.enqueue(user['uid'])
+            except QueueFullError as e:
+                yield writer.event({'error': 'El servicio está saturado, inténtalo de nuevo en unos segundos.', 'retry_after': e.retry_after})
+                return
+
+            try:
+                async for position in ticket.wait(settings.ADMISSION_STATUS_INTERVAL_SECONDS):
+                    yield writer.event({"event": "status", "message": f"En cola (posición {position})...", "queue_position": position})
+
+                generation_failed = False
+                stream = gemini_client.generate_streaming_response(
+                    system_prompt=FOLLOWUP_SYSTEM_PROMPT,
+                    prompt=question,
+                    history=session.history()
+                )
+                chunks = iter_with_heartbeat(stream, lambda: writer.idle_timeout(heartbeat_interval))
+                async for chunk in chunks:
+                    if chunk is None:
+                        if request is not None and await request.is_disconnected():
+                            await chunks.aclose()
+                            return
+                        yield writer.flush() if writer.has_pending else writer.heartbeat()
+                        continue
+                    frame = writer.text(chunk)
+                    if frame:
+                        yield frame
+                    if chunk in gemini_client.ERROR_MESSAGES:
+                        generation_failed = True
+            finally:
+                ticket.release()
+
+            frame = writer.flush()
+            if frame:
+                yield frame
+            answer = writer.transcript()
+            if answer and not generation_failed:
+                session.record_turn(question, answer)
+                session.schedule_compaction()
+
+        yield writer.event({'event': 'done'})
+
+    except (asyncio.CancelledError, GeneratorExit):
+        if chunks is not None:
+            close_in_background(chunks)
+        raise
+    except Exception as e:
+        log.error(f"Error en pregunta de seguimiento de {session.prequalification_id}: {e}", exc_info=True)
+        yield writer.event({'error': 'Error interno al responder la pregunta.'})
+    finally:
+        ACTIVE_STREAMS.dec()
+
+# --- LOTES DE PRECALIFICACIONES ---
+async def run_batch_item(item: AnalysisRequest, user: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Analiza un caso de un lote sin streaming: caché, RAG, turno de admisión y Gemini.
+    El resultado se encola en la cola de escrituras diferidas, que lo agrupa en batched writes.
+    """
+    use_cache = settings.ANALYSIS_CACHE_ENABLED and not item.bypass_cache
+    cache_key = build_cache_key(item.facts, item.country_code) if use_cache else None
+    analysis = None
+    if use_cache and not item.refresh_cache:
+        analysis = await analysis_cache.get(cache_key)
+    from_cache = analysis is not None
+
+    if analysis is None:
+        retrieval_task = None
+        retrieval_degraded = False
+        if settings.RETRIEVAL_ENABLED:
+            retrieval_task = asyncio.create_task(retrieval.retrieve(item.facts, item.country_code))
+        try:
+            # La extracción de relatos extensos pide sus propios turnos y el RAG se espera fuera
+            # del turno: solo se ocupa un hueco de Gemini con el prompt ya listo.
+            facts_heading, facts_text = (await summarize_long_facts(item.facts, user['uid'])) or (FACTS_HEADING, item.facts)
+            passages = None
+            if retrieval_task is not None:
+                passages, retrieval_degraded = await retrieval.wait_for_passages(retrieval_task)
+            prompt = build_analysis_prompt(item.country_code, facts_text, facts_heading, passages)
+            async with admission_controller.enqueue(user['uid']):
+                analysis = await gemini_client.generate_text(PRECALIFIER_SYSTEM_PROMPT, prompt)
+        except QueueFullError as e:
+            return {"status": "error", "error": "El servicio está saturado, inténtalo de nuevo en unos segundos.", "retry_after": e.retry_after}
+        except RuntimeError as e:
+            return {"status": "error", "error": str(e)}
+        finally:
+            if retrieval_task is not None and not retrieval_task.done():
+                retrieval_task.cancel()
+        if use_cache and not retrieval_degraded:
+            await analysis_cache.put(cache_key, analysis, item.country_code)
+
+    document_path = firestore_client.enqueue_prequalification(
+        user_id=user['uid'],
+        title=item.title,
+        facts=item.facts,
+        analysis_result=analysis,
+        country_code=item.country_code
+    )
+    return {"status": "ok", "title": item.title, "analysis": analysis, "cached": from_cache, "document_path": document_path}
+
+async def batch_ndjson(job: BatchJob, start: int = 0, wait: bool = True):
+    """Serializa los resultados del lote como NDJSON (una línea JSON por evento)."""
+    yield json.dumps({"event": "job", "job_id": job.job_id, "total": job.total}, ensure_ascii=False) + "\n"
+    async for line in batch_job_registry.follow(job, start=start, wait=wait):
+        yield json.dumps(line, ensure_ascii=False) + "\n"
 
 # --- ENDPOINTS ---
 
+SSE_HEADERS = { 
+    "Content-Type": "text/event-stream", 
+    "Cache-Control": "no-cache", 
+    "Connection": "keep-alive", 
+    "X-Accel-Buffering": "no" 
+}
+
 @app.get("/status")
 def read_status():
-    return {"status": "ok", "service": "Precalificador v2.0"}
+    return {"status": "ok", "service": "Precalificador v2.0", "startup_seconds": get_startup_profile()}
+
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(verify_metrics_token)])
+def read_metrics():
+    """Métricas del worker en formato de texto de Prometheus (requiere METRICS_TOKEN)."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 @app.post("/analyze", tags=["Analysis"])
 async def analyze_facts(
@@ -130,17 +624,202 @@ async def analyze_facts(
     """
     Endpoint principal. Recibe los hechos y devuelve un stream con el análisis jurídico.
     """
-    # Verificación obligatoria de suscripción o VIP
-    await verify_active_subscription(current_user)
+    received_at = getattr(request.state, "received_at", None) or time.perf_counter()
+    timer = StageTimer(pipeline_stage_seconds, received_at)
+    timer.mark("auth")
+
+    # La recuperación de bases jurídicas (RAG) corre en paralelo con la verificación de suscripción.
+    retrieval_task = None
+    if settings.RETRIEVAL_ENABLED:
+        retrieval_task = asyncio.create_task(retrieval.retrieve(analysis_request.facts, analysis_request.country_code))
+
+    # Verificación obligatoria de suscripción o VIP. En modo especulativo corre en
+    # paralelo con la generación y un rechazo llega como evento de error en el stream.
+    authorization = None
+    if settings.SPECULATIVE_STREAMING_ENABLED:
+        authorization = asyncio.create_task(verify_active_subscription(current_user))
+    else:
+        try:
+            await verify_active_subscription(current_user)
+        except BaseException:
+            if retrieval_task is not None:
+                retrieval_task.cancel()
+            raise
+        timer.mark("subscription")
+
+    # Rechazo rápido si la cola de generación está llena
+    try:
+        admission_controller.check_capacity()
+    except QueueFullError as e:
+        if retrieval_task is not None:
+            retrieval_task.cancel()
+        if authorization is not None:
+            authorization.cancel()
+        raise HTTPException(
+            status_code=429,
+            detail="El servicio está saturado, inténtalo de nuevo en unos segundos.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
 
-    headers = { 
-        "Content-Type": "text/event-stream", 
-        "Cache-Control": "no-cache", 
-        "Connection": "keep-alive", 
-        "X-Accel-Buffering": "no" 
-    }
+    # La generación corre en su propia tarea y escribe en un buffer reanudable;
+    # la conexión HTTP solo se suscribe a ese buffer.
+    stream = stream_registry.create(current_user['uid'])
+    stream_registry.start(stream, stream_analysis_generator(
+        analysis_request, current_user, authorization=authorization, timer=timer, retrieval_task=retrieval_task
+    ))
+
+    headers = {**SSE_HEADERS, "X-Stream-Id": stream.stream_id}
     
     return StreamingResponse(
-        stream_analysis_generator(analysis_request, current_user), 
+        stream_registry.subscribe(stream, request=request), 
+        headers=headers
+    )
+
+@app.get("/analyze/{stream_id}", tags=["Analysis"])
+async def resume_analysis(
+    stream_id: str,
+    request: Request,
+    last_event_id: int | None = None,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Reanuda un análisis en curso (o recién terminado) desde el último evento recibido,
+    sin volver a llamar a Gemini. Usa la cabecera Last-Event-ID o el parámetro last_event_id.
+    """
+    stream = stream_registry.get(stream_id)
+    if stream is None or stream.user_id != current_user['uid']:
+        raise HTTPException(status_code=404, detail="El análisis no existe o ya expiró.")
+
+    if last_event_id is None:
+        try:
+            last_event_id = int(request.headers.get("Last-Event-ID", "0"))
+        except ValueError:
+            last_event_id = 0
+
+    try:
+        # Comprobamos antes de abrir el stream que los eventos pedidos siguen en el buffer.
+        stream.events_after(last_event_id)
+    except StreamGoneError:
+        raise HTTPException(status_code=410, detail="Los eventos solicitados ya no están disponibles.")
+
+    headers = {**SSE_HEADERS, "X-Stream-Id": stream.stream_id}
+
+    return StreamingResponse(
+        stream_registry.subscribe(stream, last_event_id=last_event_id, request=request),
         headers=headers
     )
+
+@app.post("/analyze/batch", tags=["Analysis"])
+async def analyze_batch(
+    batch_request: BatchAnalysisRequest,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Precalifica varios casos en una sola petición. Autoriza una vez, ejecuta los casos con
+    concurrencia limitada y devuelve NDJSON: cada resultado lleva su 'index' y se emite al
+    terminar. El lote sigue aunque el cliente se desconecte; se recoge con GET /analyze/batch/{job_id}.
+    """
+    if len(batch_request.items) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=422, detail=f"Un lote admite como máximo {settings.BATCH_MAX_ITEMS} casos.")
+
+    await verify_active_subscription(current_user)
+
+    job = batch_job_registry.create(current_user['uid'], len(batch_request.items))
+    batch_job_registry.start(
+        job,
+        batch_request.items,
+        lambda index, item: run_batch_item(item, current_user),
+        settings.BATCH_MAX_CONCURRENCY
+    )
+    log.info(f"Lote {job.job_id} con {job.total} casos iniciado para usuario {current_user['uid']}")
+
+    return StreamingResponse(
+        batch_ndjson(job),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Job-Id": job.job_id}
+    )
+
+@app.get("/analyze/batch/{job_id}", tags=["Analysis"])
+async def get_batch_results(
+    job_id: str,
+    start: int = 0,
+    wait: bool = True,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Recoge los resultados de un lote desde la posición 'start' (en orden de finalización).
+    Con wait=true sigue el lote hasta que termina; con wait=false devuelve lo disponible.
+    """
+    job = batch_job_registry.get(job_id)
+    if job is None or job.user_id != current_user['uid']:
+        raise HTTPException(status_code=404, detail="El lote no existe o ya expiró.")
+
+    return StreamingResponse(
+        batch_ndjson(job, start=max(start, 0), wait=wait),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Job-Id": job.job_id}
+    )
+
+@app.get("/prequalifications/{prequalification_id}/export", tags=["Analysis"])
+async def export_prequalification(
+    prequalification_id: str,
+    format: str = Query("pdf", pattern="^(pdf|docx)$", description="Formato del documento: pdf o docx"),
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Exporta una precalificación guardada a PDF o DOCX. El renderizado se hace en un pool de
+    procesos (no bloquea el event loop) y el resultado se cachea por contenido y formato.
+    """
+    prequalification = await firestore_client.get_prequalification(current_user['uid'], prequalification_id)
+    if prequalification is None:
+        raise HTTPException(status_code=404, detail="La precalificación no existe.")
+
+    title = prequalification.get("title") or "Precalificación"
+    try:
+        document = await exporter.export_document(
+            prequalification_id, title, prequalification.get("analysis", ""), format
+        )
+    except Exception as e:
+        log.error(f"Error exportando la precalificación {prequalification_id} a {format}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="No se pudo generar el documento.")
+
+    filename = f"precalificacion-{prequalification_id}.{format}"
+    return StreamingResponse(
+        exporter.iter_chunks(document),
+        media_type=exporter.MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Content-Length": str(len(document)),
+        }
+    )
+
+@app.post("/prequalifications/{prequalification_id}/followup", tags=["Analysis"])
+async def followup_prequalification(
+    prequalification_id: str,
+    followup: FollowupRequest,
+    request: Request,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Pregunta de seguimiento sobre una precalificación guardada. Reutiliza el informe como
+    contexto y un historial acotado (los turnos antiguos se resumen) en lugar de repetir el análisis.
+    """
+    await verify_active_subscription(current_user)
+
+    session = await followups.session_cache.get(current_user['uid'], prequalification_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="La precalificación no existe.")
+
+    try:
+        admission_controller.check_capacity()
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=429,
+            detail="El servicio está saturado, inténtalo de nuevo en unos segundos.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+    return StreamingResponse(
+        stream_followup_generator(session, followup.question, current_user, request=request),
+        headers=SSE_HEADERS
+    )
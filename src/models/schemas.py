@@ -1,10 +1,19 @@
 # src/models/schemas.py
+from typing import List
 from pydantic import BaseModel, Field
 
 class AnalysisRequest(BaseModel):
     title: str = Field(..., description="Un título corto para el caso")
     facts: str = Field(..., description="El relato de los hechos ocurrido")
     country_code: str | None = Field(None, description="Contexto geográfico (ej: 'SV', 'MX')")
+    bypass_cache: bool = Field(False, description="Ignora la caché de análisis y no guarda el resultado en ella")
+    refresh_cache: bool = Field(False, description="Ignora la caché de análisis pero sí guarda el nuevo resultado")
+
+class BatchAnalysisRequest(BaseModel):
+    items: List[AnalysisRequest] = Field(..., min_length=1, description="Casos a precalificar en un mismo lote")
+
+class FollowupRequest(BaseModel):
+    question: str = Field(..., min_length=1, description="Pregunta de seguimiento sobre una precalificación guardada")
 
 # Se puede reutilizar la estructura básica si se quiere guardar el historial, 
 # pero para este servicio es un análisis 'one-shot' (una sola vez).
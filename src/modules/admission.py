@@ -0,0 +1,186 @@
+# src/modules/admission.py
+
+import math
+import time
+import asyncio
+from collections import deque, OrderedDict
+from typing import AsyncIterator, Deque, Dict, Any, Optional
+
+from src.config import settings, log
+from src.core.metrics import Histogram
+
+_QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class QueueFullError(Exception):
+    """La cola de espera está llena; el cliente debe reintentar tras 'retry_after' segundos."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Cola de generación llena, reintentar en {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """Turno de un usuario para abrir una generación en Gemini."""
+
+    def __init__(self, controller: "AdmissionController", user_id: str):
+        self.controller = controller
+        self.user_id = user_id
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self._granted = asyncio.get_running_loop().create_future()
+        self._released = False
+
+    @property
+    def granted(self) -> bool:
+        return self._granted.done()
+
+    async def wait(self, status_interval: float) -> AsyncIterator[int]:
+        """
+        Espera el turno. Mientras tanto emite la posición en cola (1 = siguiente)
+        cada vez que cambia o cada 'status_interval' segundos.
+        """
+        try:
+            last_position = None
+            while not self._granted.done():
+                position = self.controller.position_of(self)
+                if position != last_position:
+                    last_position = position
+                    yield position
+                try:
+                    await asyncio.wait_for(asyncio.shield(self._granted), status_interval)
+                except asyncio.TimeoutError:
+                    last_position = None
+        except BaseException:
+            # Si el cliente se va mientras espera, liberamos el hueco o el turno ya concedido.
+            self.release()
+            raise
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self.controller._release(self)
+
+    async def __aenter__(self):
+        async for _ in self.wait(settings.ADMISSION_STATUS_INTERVAL_SECONDS):
+            pass
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """
+    Limita las generaciones simultáneas por instancia y reparte los huecos libres
+    en round-robin entre usuarios, para que un usuario con muchas peticiones no
+    acapare la cola.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._queues: "OrderedDict[str, Deque[AdmissionTicket]]" = OrderedDict()
+        self._queued = 0
+        self._avg_hold_seconds = 30.0
+        self.rejected = 0
+        self.wait_time = Histogram()
+        self.queue_depth = Histogram(_QUEUE_DEPTH_BUCKETS)
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def retry_after(self) -> int:
+        """Estimación (segundos) de cuándo habrá hueco, según la duración media de las generaciones."""
+        waves = (self._queued + 1) / max(self.max_in_flight, 1)
+        return max(1, min(120, math.ceil(self._avg_hold_seconds * waves)))
+
+    def check_capacity(self):
+        """Rechazo rápido antes de abrir el stream."""
+        if self.in_flight >= self.max_in_flight and self._queued >= self.max_queue:
+            self.rejected += 1
+            log.warning(f"Cola de generación llena ({self._queued} en espera), petición rechazada.")
+            raise QueueFullError(self.retry_after())
+
+    def enqueue(self, user_id: str) -> AdmissionTicket:
+        self.check_capacity()
+        ticket = AdmissionTicket(self, user_id)
+        self.queue_depth.observe(self._queued)
+        if self.in_flight < self.max_in_flight and self._queued == 0:
+            self._grant(ticket)
+        else:
+            self._queues.setdefault(user_id, deque()).append(ticket)
+            self._queued += 1
+        return ticket
+
+    def position_of(self, ticket: AdmissionTicket) -> int:
+        """Posición del ticket simulando el orden round-robin entre usuarios."""
+        if ticket.granted:
+            return 0
+        depth = next((i for i, t in enumerate(self._queues.get(ticket.user_id, ())) if t is ticket), None)
+        if depth is None:
+            return 0
+        # En cada ronda sale un ticket por usuario, en el orden actual de la cola.
+        # El ticket sale en la ronda 'depth'; los usuarios anteriores a él en el orden
+        # también sacan el suyo de esa misma ronda.
+        position = 0
+        before = True
+        for user_id, queue in self._queues.items():
+            if user_id == ticket.user_id:
+                position += depth
+                before = False
+            else:
+                position += min(len(queue), depth + 1 if before else depth)
+        return position + 1
+
+    def _grant(self, ticket: AdmissionTicket):
+        self.in_flight += 1
+        ticket.granted_at = time.monotonic()
+        self.wait_time.observe(ticket.granted_at - ticket.enqueued_at)
+        ticket._granted.set_result(True)
+
+    def _release(self, ticket: AdmissionTicket):
+        if ticket.granted:
+            self.in_flight -= 1
+            held = time.monotonic() - ticket.granted_at
+            self._avg_hold_seconds = 0.8 * self._avg_hold_seconds + 0.2 * held
+        else:
+            queue = self._queues.get(ticket.user_id)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                self._queued -= 1
+                if not queue:
+                    del self._queues[ticket.user_id]
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.in_flight < self.max_in_flight and self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            self._queued -= 1
+            # El usuario pasa al final de la ronda si aún tiene peticiones en cola.
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            self._grant(ticket)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self._queued,
+            "queued_users": len(self._queues),
+            "rejected": self.rejected,
+            "avg_generation_seconds": self._avg_hold_seconds,
+            "wait_time_seconds": self.wait_time.snapshot(),
+            "queue_depth": self.queue_depth.snapshot(),
+        }
+
+
+admission_controller = AdmissionController(
+    max_in_flight=settings.GEMINI_MAX_IN_FLIGHT,
+    max_queue=settings.GEMINI_MAX_QUEUE,
+)
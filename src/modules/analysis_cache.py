@@ -0,0 +1,148 @@
+# src/modules/analysis_cache.py
+
+import re
+import time
+import hashlib
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Any, Optional, Tuple, Iterator
+
+from google.cloud import firestore
+from src.config import settings, log
+from src.core.prompts import PRECALIFIER_SYSTEM_PROMPT
+from src.core.clients import get_firestore
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# La versión del prompt forma parte de la clave: si cambia PRECALIFIER_SYSTEM_PROMPT,
+# todas las entradas anteriores dejan de coincidir (invalidación automática).
+PROMPT_VERSION = hashlib.sha256(PRECALIFIER_SYSTEM_PROMPT.encode()).hexdigest()[:16]
+
+
+def _normalize_facts(facts: str) -> str:
+    text = unicodedata.normalize("NFC", facts)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def build_cache_key(facts: str, country_code: Optional[str]) -> str:
+    """Hash normalizado de (hechos, país, versión del prompt, modelo, configuración de generación)."""
+    parts = [
+        _normalize_facts(facts),
+        (country_code or "").strip().upper(),
+        PROMPT_VERSION,
+        settings.GEMINI_MODEL,
+        f"{settings.MAX_OUTPUT_TOKENS}|{settings.TEMPERATURE}|{settings.TOP_P}",
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+
+def iter_replay_chunks(text: str, chunk_size: Optional[int] = None) -> Iterator[str]:
+    """Trocea un análisis cacheado para reproducirlo como eventos SSE 'text'."""
+    size = max(chunk_size or settings.ANALYSIS_CACHE_REPLAY_CHUNK_SIZE, 1)
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+class AnalysisCache:
+    """
+    Caché de análisis en dos niveles: LRU en memoria (por instancia) y Firestore
+    (compartida entre instancias). Las entradas de Firestore que no coinciden con la
+    versión del prompt de la caché ('prompt_version') o han expirado se ignoran.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float, use_firestore: bool, collection: str,
+                 prompt_version: str = PROMPT_VERSION):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.use_firestore = use_firestore
+        self.collection = collection
+        self.prompt_version = prompt_version
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.memory_hits = 0
+        self.firestore_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get_db(self) -> firestore.AsyncClient:
+        # Cliente compartido del registro: no abrimos otro canal gRPC.
+        return get_firestore()
+
+    def _get_memory(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        analysis, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return analysis
+
+    def _put_memory(self, key: str, analysis: str, ttl: Optional[float] = None):
+        self._entries[key] = (analysis, time.monotonic() + (ttl if ttl is not None else self.ttl_seconds))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        analysis = self._get_memory(key)
+        if analysis is not None:
+            self.memory_hits += 1
+            return analysis
+
+        if self.use_firestore:
+            try:
+                snapshot = await self._get_db().collection(self.collection).document(key).get()
+                if snapshot.exists:
+                    data = snapshot.to_dict()
+                    expires_at = data.get("expires_at")
+                    now = datetime.now(timezone.utc)
+                    if data.get("prompt_version") == self.prompt_version and expires_at and expires_at > now:
+                        analysis = data.get("analysis", "")
+                        self._put_memory(key, analysis, ttl=(expires_at - now).total_seconds())
+                        self.firestore_hits += 1
+                        return analysis
+            except Exception as e:
+                log.warning(f"No se pudo leer la caché de análisis en Firestore: {e}")
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, analysis: str, country_code: Optional[str]):
+        self._put_memory(key, analysis)
+        if not self.use_firestore:
+            return
+        try:
+            await self._get_db().collection(self.collection).document(key).set({
+                "analysis": analysis,
+                "country_code": country_code,
+                "prompt_version": self.prompt_version,
+                "model": settings.GEMINI_MODEL,
+                "created_at": firestore.SERVER_TIMESTAMP,
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds),
+            })
+        except Exception as e:
+            log.warning(f"No se pudo guardar la caché de análisis en Firestore: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        hits = self.memory_hits + self.firestore_hits
+        total = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "firestore_hits": self.firestore_hits,
+            "misses": self.misses,
+            "hit_ratio": (hits / total) if total else 0.0,
+            "size": len(self._entries),
+            "prompt_version": self.prompt_version,
+        }
+
+
+analysis_cache = AnalysisCache(
+    max_size=settings.ANALYSIS_CACHE_MAX_SIZE,
+    ttl_seconds=settings.ANALYSIS_CACHE_TTL_SECONDS,
+    use_firestore=settings.ANALYSIS_CACHE_FIRESTORE_ENABLED,
+    collection=settings.ANALYSIS_CACHE_COLLECTION,
+)
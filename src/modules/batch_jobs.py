@@ -0,0 +1,175 @@
+# src/modules/batch_jobs.py
+
+import json
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from src.config import settings, log
+
+# Ejecuta un elemento del lote y devuelve su resultado (sin el índice).
+ItemRunner = Callable[[int, Any], Awaitable[Dict[str, Any]]]
+
+
+class BatchJob:
+    """
+    Resultados de un lote de precalificaciones, desacoplados de la conexión HTTP:
+    el lote sigue ejecutándose si el cliente se va y se puede recoger con su job_id.
+    """
+
+    def __init__(self, job_id: str, user_id: str, total: int):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.total = total
+        # En orden de finalización, que es el orden en que se emiten.
+        self.results: List[Dict[str, Any]] = []
+        # Tamaño aproximado de los resultados (su línea NDJSON), para el cupo del registro.
+        self.size_bytes = 0
+        self.failed = 0
+        self.finished = False
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def add_result(self, result: Dict[str, Any]):
+        self.results.append(result)
+        self.size_bytes += len(json.dumps(result, ensure_ascii=False).encode("utf-8"))
+        if result.get("status") != "ok":
+            self.failed += 1
+        self._notify()
+
+    def finish(self):
+        self.finished = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait_for_change(self, timeout: float) -> bool:
+        changed = self._changed
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "event": "done" if self.finished else "pending",
+            "job_id": self.job_id,
+            "total": self.total,
+            "completed": len(self.results),
+            "failed": self.failed,
+        }
+
+
+class BatchJobRegistry:
+    """
+    Registro por instancia de los lotes en curso y recientes. Los lotes terminados se
+    descartan tras BATCH_JOB_TTL_SECONDS o antes si se superan BATCH_MAX_JOBS lotes o
+    BATCH_REGISTRY_MAX_BYTES de resultados en total.
+    """
+
+    def __init__(self, ttl_seconds: float, max_jobs: int, max_total_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_jobs = max_jobs
+        self.max_total_bytes = max_total_bytes
+        self._jobs: "OrderedDict[str, BatchJob]" = OrderedDict()
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def _sweep(self):
+        now = time.monotonic()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and now - job.finished_at > self.ttl_seconds:
+                del self._jobs[job_id]
+        # Por encima de los cupos se descartan los lotes terminados más antiguos; los activos nunca.
+        finished = sorted((j for j in self._jobs.values() if j.finished), key=lambda j: j.finished_at)
+        total = sum(job.size_bytes for job in self._jobs.values())
+        for job in finished:
+            if len(self._jobs) <= self.max_jobs and total <= self.max_total_bytes:
+                break
+            total -= job.size_bytes
+            del self._jobs[job.job_id]
+            self.evictions += 1
+
+    def create(self, user_id: str, total: int) -> BatchJob:
+        self._sweep()
+        job = BatchJob(uuid.uuid4().hex, user_id, total)
+        self._jobs[job.job_id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        self._sweep()
+        return self._jobs.get(job_id)
+
+    def start(self, job: BatchJob, items: Sequence[Any], run_item: ItemRunner, max_concurrency: int):
+        job.task = asyncio.create_task(self._run(job, items, run_item, max_concurrency))
+
+    async def _run(self, job: BatchJob, items: Sequence[Any], run_item: ItemRunner, max_concurrency: int):
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def run_one(index: int, item: Any):
+            async with semaphore:
+                try:
+                    result = await run_item(index, item)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # Un fallo en un elemento no afecta al resto del lote.
+                    log.error(f"Lote {job.job_id}: error en el elemento {index}: {e}", exc_info=True)
+                    result = {"status": "error", "error": "Error interno al analizar el caso."}
+            job.add_result({"index": index, **result})
+
+        try:
+            await asyncio.gather(*(run_one(index, item) for index, item in enumerate(items)))
+        except asyncio.CancelledError:
+            log.info(f"Lote {job.job_id} cancelado con {len(job.results)}/{job.total} elementos terminados.")
+        finally:
+            job.finish()
+
+    async def cancel_all(self):
+        """Cancela los lotes en curso y espera a que terminen (apagado de la instancia)."""
+        tasks = [job.task for job in self._jobs.values() if job.task is not None and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            log.info(f"Apagado: {len(tasks)} lotes cancelados.")
+
+    async def follow(self, job: BatchJob, start: int = 0, wait: bool = True) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Entrega los resultados desde la posición 'start' y, si 'wait', sigue los nuevos hasta
+        que el lote termina (con latidos periódicos). Siempre acaba con el resumen del lote.
+        """
+        cursor = start
+        while True:
+            while cursor < len(job.results):
+                yield job.results[cursor]
+                cursor += 1
+            if job.finished or not wait:
+                break
+            if not await job.wait_for_change(settings.SSE_HEARTBEAT_INTERVAL_SECONDS):
+                yield {"event": "heartbeat"}
+        yield job.summary()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "jobs": len(self._jobs),
+            "active": sum(1 for j in self._jobs.values() if not j.finished),
+            "buffered_bytes": sum(j.size_bytes for j in self._jobs.values()),
+            "evictions": self.evictions,
+        }
+
+
+batch_job_registry = BatchJobRegistry(
+    ttl_seconds=settings.BATCH_JOB_TTL_SECONDS,
+    max_jobs=settings.BATCH_MAX_JOBS,
+    max_total_bytes=settings.BATCH_REGISTRY_MAX_BYTES,
+)
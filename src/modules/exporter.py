@@ -0,0 +1,253 @@
+# src/modules/exporter.py
+
+import io
+import re
+import asyncio
+import hashlib
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from src.config import settings, log
+from src.core.clients import get_process_pool, discard_process_pool
+from src.core.metrics import registry
+
+EXPORT_RENDER_SECONDS = registry.histogram("export_render_seconds", "Duración del renderizado de exportaciones.", ("format",))
+
+MEDIA_TYPES = {
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*)$")
+_BULLET_RE = re.compile(r"^\s*[-*+]\s+(.*)$")
+_NUMBERED_RE = re.compile(r"^\s*(\d+)[.)]\s+(.*)$")
+_INLINE_RE = re.compile(r"(\*\*[^*]+\*\*|__[^_]+__|\*[^*]+\*|_[^_]+_)")
+_STRIP_INLINE_RE = re.compile(r"(\*\*|__|(?<!\w)[*_]|[*_](?!\w))")
+
+# Caracteres habituales en la salida de Gemini que no existen en latin-1 (fuentes base de PDF).
+_LATIN1_REPLACEMENTS = str.maketrans({
+    "‘": "'", "’": "'", "“": '"', "”": '"',
+    "–": "-", "—": "-", "•": "-", "…": "...",
+})
+
+
+# --- MARKDOWN -> BLOQUES ---
+def parse_markdown(markdown: str) -> List[Tuple[str, Any, str]]:
+    """
+    Convierte el Markdown del análisis en bloques (tipo, nivel/número, texto). Cubre lo que
+    genera el precalificador: encabezados, listas, párrafos y énfasis en línea.
+    """
+    blocks: List[Tuple[str, Any, str]] = []
+    paragraph: List[str] = []
+
+    def flush_paragraph():
+        if paragraph:
+            blocks.append(("paragraph", None, " ".join(paragraph)))
+            paragraph.clear()
+
+    for raw_line in markdown.splitlines():
+        line = raw_line.rstrip()
+        if not line.strip() or line.strip() in ("---", "***"):
+            flush_paragraph()
+            continue
+        heading = _HEADING_RE.match(line)
+        bullet = _BULLET_RE.match(line)
+        numbered = _NUMBERED_RE.match(line)
+        if heading:
+            flush_paragraph()
+            blocks.append(("heading", len(heading.group(1)), heading.group(2).strip()))
+        elif bullet:
+            flush_paragraph()
+            blocks.append(("bullet", None, bullet.group(1).strip()))
+        elif numbered:
+            flush_paragraph()
+            blocks.append(("numbered", numbered.group(1), numbered.group(2).strip()))
+        else:
+            paragraph.append(line.strip())
+    flush_paragraph()
+    return blocks
+
+
+def _inline_runs(text: str) -> Iterator[Tuple[str, bool, bool]]:
+    """Trocea el texto en (fragmento, negrita, cursiva)."""
+    for part in _INLINE_RE.split(text):
+        if not part:
+            continue
+        if (part.startswith("**") and part.endswith("**")) or (part.startswith("__") and part.endswith("__")):
+            yield part[2:-2], True, False
+        elif len(part) > 2 and part[0] == part[-1] and part[0] in "*_":
+            yield part[1:-1], False, True
+        else:
+            yield part, False, False
+
+
+# --- RENDERIZADO (se ejecuta en el pool de procesos) ---
+def _latin1(text: str) -> str:
+    return text.translate(_LATIN1_REPLACEMENTS).encode("latin-1", "replace").decode("latin-1")
+
+
+def render_pdf(title: str, markdown: str) -> bytes:
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.set_auto_page_break(True, margin=15)
+    pdf.add_page()
+    pdf.set_font("Helvetica", "B", 16)
+    pdf.multi_cell(0, 9, _latin1(title))
+    pdf.ln(4)
+    heading_sizes = {1: 15, 2: 13, 3: 12}
+    for kind, marker, text in parse_markdown(markdown):
+        plain = _latin1(_STRIP_INLINE_RE.sub("", text))
+        if kind == "heading":
+            pdf.ln(2)
+            pdf.set_font("Helvetica", "B", heading_sizes.get(marker, 11))
+            pdf.multi_cell(0, 7, plain)
+            pdf.ln(1)
+        else:
+            prefix = "- " if kind == "bullet" else (f"{marker}. " if kind == "numbered" else "")
+            pdf.set_font("Helvetica", "", 10.5)
+            pdf.multi_cell(0, 5.5, prefix + plain)
+            pdf.ln(1.5)
+    # fpdf2 devuelve bytearray; PyFPDF 1.7 devuelve str en latin-1.
+    output = pdf.output(dest="S")
+    return output.encode("latin-1") if isinstance(output, str) else bytes(output)
+
+
+def render_docx(title: str, markdown: str) -> bytes:
+    from docx import Document
+
+    document = Document()
+    document.add_heading(title, level=0)
+    for kind, marker, text in parse_markdown(markdown):
+        if kind == "heading":
+            document.add_heading(_STRIP_INLINE_RE.sub("", text), level=min(marker, 9))
+            continue
+        style = {"bullet": "List Bullet", "numbered": "List Number"}.get(kind)
+        paragraph = document.add_paragraph(style=style)
+        for fragment, bold, italic in _inline_runs(text):
+            run = paragraph.add_run(fragment)
+            run.bold = bold or None
+            run.italic = italic or None
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+_RENDERERS = {"pdf": render_pdf, "docx": render_docx}
+
+
+def render_document(export_format: str, title: str, markdown: str) -> bytes:
+    """Punto de entrada del proceso hijo (función de módulo para poder serializarla)."""
+    return _RENDERERS[export_format](title, markdown)
+
+
+# --- CACHÉ DE ARTEFACTOS ---
+class ArtifactCache:
+    """
+    LRU de documentos renderizados por (id, hash del contenido, formato), acotada por bytes.
+    Las peticiones simultáneas del mismo artefacto comparten un único renderizado.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries: "OrderedDict[Tuple[str, str, str], bytes]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str, str], asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[bytes]:
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+        return data
+
+    def put(self, key: Tuple[str, str, str], data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        if key in self._entries:
+            self.size_bytes -= len(self._entries.pop(key))
+        self._entries[key] = data
+        self.size_bytes += len(data)
+        while self.size_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size_bytes -= len(evicted)
+            self.evictions += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "size_bytes": self.size_bytes,
+        }
+
+
+artifact_cache = ArtifactCache(settings.EXPORT_CACHE_MAX_BYTES)
+
+
+def content_hash(title: str, markdown: str) -> str:
+    return hashlib.sha256(f"{title}\x1f{markdown}".encode()).hexdigest()[:32]
+
+
+async def _render_in_pool(export_format: str, title: str, markdown: str) -> bytes:
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    try:
+        pool = get_process_pool()
+        try:
+            return await loop.run_in_executor(pool, render_document, export_format, title, markdown)
+        except BrokenProcessPool:
+            # Un worker murió (p. ej. OOM) y el pool ya no acepta trabajos: se sustituye y se reintenta una vez.
+            log.warning(f"Pool de exportación roto, se recrea y se reintenta el renderizado {export_format}.")
+            discard_process_pool(pool)
+            pool = get_process_pool()
+            try:
+                return await loop.run_in_executor(pool, render_document, export_format, title, markdown)
+            except BrokenProcessPool:
+                discard_process_pool(pool)
+                raise
+    finally:
+        EXPORT_RENDER_SECONDS.labels(format=export_format).observe(loop.time() - started)
+
+
+async def export_document(doc_id: str, title: str, markdown: str, export_format: str) -> bytes:
+    """Devuelve el documento renderizado, desde la caché o renderizándolo fuera del event loop."""
+    key = (doc_id, content_hash(title, markdown), export_format)
+    cached = artifact_cache.get(key)
+    if cached is not None:
+        artifact_cache.hits += 1
+        return cached
+
+    inflight = artifact_cache._inflight.get(key)
+    if inflight is not None:
+        artifact_cache.hits += 1
+        return await asyncio.shield(inflight)
+
+    artifact_cache.misses += 1
+    future = asyncio.ensure_future(_render_in_pool(export_format, title, markdown))
+    artifact_cache._inflight[key] = future
+    future.add_done_callback(lambda f: _finish_render(key, f))
+    # shield: si este cliente se desconecta, el renderizado sigue para los demás y para la caché.
+    data = await asyncio.shield(future)
+    log.info(f"Exportación {export_format} de {doc_id} renderizada ({len(data)} bytes).")
+    return data
+
+
+def _finish_render(key: Tuple[str, str, str], future: asyncio.Future):
+    artifact_cache._inflight.pop(key, None)
+    if not future.cancelled() and future.exception() is None:
+        artifact_cache.put(key, future.result())
+
+
+def iter_chunks(data: bytes, chunk_size: Optional[int] = None) -> Iterator[bytes]:
+    size = max(chunk_size or settings.EXPORT_CHUNK_SIZE, 1)
+    view = memoryview(data)
+    for i in range(0, len(data), size):
+        yield bytes(view[i:i + size])
@@ -3,53 +3,153 @@
 from google.cloud import firestore
 from src.config import settings, log
 from src.models.chat_models import ChatMessage
-from typing import List, Dict, Any
+from src.modules.write_queue import WriteBehindQueue
+from src.core.clients import get_firestore
+from src.core.metrics import registry, timed
+from typing import List, Dict, Any, Optional, Callable, AsyncIterator, Set
+import asyncio
+import base64
 import datetime
+import json
 
-# Inicializa el cliente de Firestore de forma asíncrona
-db = firestore.AsyncClient(project=settings.GOOGLE_CLOUD_PROJECT)
+FIRESTORE_SECONDS = registry.histogram(
+    "firestore_operation_seconds", "Duración de las operaciones de firestore_client.", ("op",)
+)
 
-async def get_conversations(user_id: str) -> List[Dict[str, Any]]:
-    """Obtiene la lista de conversaciones (ID, título, fecha) para un usuario, ordenadas por fecha."""
+# El cliente de Firestore (asíncrono) es compartido y se crea de forma perezosa
+# en el registro de clientes, para no abrir canales gRPC al importar.
+def get_db() -> firestore.AsyncClient:
+    return get_firestore()
+
+# Cola de escrituras diferidas (batched writes) compartida por el servicio
+write_queue = WriteBehindQueue(
+    get_db,
+    batch_size=settings.WRITE_QUEUE_BATCH_SIZE,
+    flush_interval=settings.WRITE_QUEUE_FLUSH_INTERVAL_SECONDS,
+    max_size=settings.WRITE_QUEUE_MAX_SIZE,
+    max_retries=settings.WRITE_QUEUE_MAX_RETRIES,
+    spill_path=settings.WRITE_QUEUE_SPILL_PATH,
+)
+
+# --- PAGINACIÓN CON CURSORES ---
+class InvalidPageTokenError(ValueError):
+    """El page_token no es un token de continuación válido (o es de una versión anterior)."""
+
+def encode_page_token(created_at: datetime.datetime, doc_id: str) -> str:
+    """Token de continuación opaco para el cliente: fecha e ID del último documento de la página."""
+    payload = {"v": 2, "t": created_at.isoformat(), "id": doc_id}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+def decode_page_token(token: str) -> Dict[str, Any]:
+    """Devuelve los valores del cursor ({'created_at', '__name__'}) o lanza InvalidPageTokenError."""
     try:
-        conversations_ref = db.collection('users').document(user_id).collection('conversations').order_by("created_at", direction=firestore.Query.DESCENDING)
-        convos = []
-        async for doc in conversations_ref.stream():
-            data = doc.to_dict()
-            convos.append({"id": doc.id, "title": data.get("title", "Sin Título"), "userId": user_id})
-        return convos
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created_at = datetime.datetime.fromisoformat(payload["t"])
+        doc_id = payload["id"]
+    except (ValueError, TypeError, KeyError) as e:
+        raise InvalidPageTokenError(token) from e
+    # El ID se convierte en una referencia hija de la colección: vacío o con '/' no es un documento de ella.
+    if payload.get("v") != 2 or not isinstance(doc_id, str) or not doc_id or "/" in doc_id:
+        raise InvalidPageTokenError(token)
+    return {"created_at": created_at, "__name__": doc_id}
+
+@timed(FIRESTORE_SECONDS, op="list_conversations_page")
+async def list_conversations_page(user_id: str, page_size: Optional[int] = None, page_token: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Devuelve una página de conversaciones (ID y título), ordenadas por fecha descendente,
+    y el token para pedir la siguiente ('next_page_token' es None en la última página).
+    Lanza InvalidPageTokenError si 'page_token' no es válido.
+    """
+    page_size = page_size or settings.LIST_PAGE_SIZE
+    # El cursor viaja en el token: sin lecturas extra y sin depender de que el documento siga existiendo.
+    cursor = decode_page_token(page_token) if page_token else None
+    try:
+        conversations = get_db().collection('users').document(user_id).collection('conversations')
+        # Proyección: solo descargamos el título (y la fecha, necesaria para el cursor).
+        # El ID desempata conversaciones creadas en el mismo instante.
+        query = (
+            conversations
+            .order_by("created_at", direction=firestore.Query.DESCENDING)
+            .order_by("__name__", direction=firestore.Query.DESCENDING)
+            .select(["title", "created_at"])
+            .limit(page_size)
+        )
+        if cursor is not None:
+            query = query.start_after(cursor)
+
+        docs = [doc async for doc in query.stream()]
+        items = [{"id": doc.id, "title": (doc.to_dict() or {}).get("title", "Sin Título"), "userId": user_id} for doc in docs]
+        next_token = None
+        if len(docs) == page_size:
+            last = docs[-1]
+            next_token = encode_page_token((last.to_dict() or {})["created_at"], last.id)
+        return {"items": items, "next_page_token": next_token}
     except Exception as e:
         log.error(f"Error al obtener conversaciones para el usuario {user_id}: {e}")
-        return []
+        return {"items": [], "next_page_token": None}
 
+@timed(FIRESTORE_SECONDS, op="get_conversations")
+async def get_conversations(user_id: str) -> List[Dict[str, Any]]:
+    """Obtiene la lista de conversaciones (ID, título, fecha) para un usuario, ordenadas por fecha."""
+    convos = []
+    page_token = None
+    while True:
+        page = await list_conversations_page(user_id, page_token=page_token)
+        convos.extend(page["items"])
+        page_token = page["next_page_token"]
+        if not page_token:
+            return convos
+
+async def iter_conversation_messages(user_id: str, convo_id: str, page_size: Optional[int] = None) -> AsyncIterator[ChatMessage]:
+    """
+    Recorre los mensajes de una conversación en orden cronológico, página a página,
+    sin cargar la colección entera en memoria.
+    """
+    messages_ref = get_db().collection('users').document(user_id).collection('conversations').document(convo_id).collection('messages')
+    async for message in _iter_messages(messages_ref.order_by('timestamp').select(["role", "content", "timestamp"]), page_size):
+        yield message
+
+async def _iter_messages(query, page_size: Optional[int] = None) -> AsyncIterator[ChatMessage]:
+    """Pagina con cursores una consulta de mensajes ya ordenada."""
+    page_size = page_size or settings.LIST_PAGE_SIZE
+    query = query.limit(page_size)
+    last_snapshot = None
+    while True:
+        page_query = query.start_after(last_snapshot) if last_snapshot is not None else query
+        page = [doc async for doc in page_query.stream()]
+        for msg_doc in page:
+            data = msg_doc.to_dict()
+            # Aseguramos que el contenido sea un string
+            yield ChatMessage(role=data.get('role'), content=str(data.get('content', '')))
+        if len(page) < page_size:
+            return
+        last_snapshot = page[-1]
+
+@timed(FIRESTORE_SECONDS, op="get_conversation_messages")
 async def get_conversation_messages(user_id: str, convo_id: str) -> List[ChatMessage]:
     """Obtiene todos los mensajes de una conversación específica, ordenados por tiempo."""
     try:
-        messages_ref = db.collection('users').document(user_id).collection('conversations').document(convo_id).collection('messages').order_by('timestamp')
-        messages = []
-        async for msg_doc in messages_ref.stream():
-            data = msg_doc.to_dict()
-            # Aseguramos que el contenido sea un string
-            data['content'] = str(data.get('content', ''))
-            messages.append(ChatMessage(**data))
-        return messages
+        return [message async for message in iter_conversation_messages(user_id, convo_id)]
     except Exception as e:
         log.error(f"Error al obtener mensajes para la convo {convo_id} del usuario {user_id}: {e}")
         return []
 
+@timed(FIRESTORE_SECONDS, op="add_message_to_conversation")
 async def add_message_to_conversation(user_id: str, convo_id: str, message: ChatMessage):
     """Añade un nuevo mensaje a una conversación, incluyendo un timestamp del servidor."""
     try:
         message_data = message.model_dump()
         message_data["timestamp"] = firestore.SERVER_TIMESTAMP
-        await db.collection('users').document(user_id).collection('conversations').document(convo_id).collection('messages').add(message_data)
+        await get_db().collection('users').document(user_id).collection('conversations').document(convo_id).collection('messages').add(message_data)
     except Exception as e:
         log.error(f"Error al añadir mensaje a la convo {convo_id} del usuario {user_id}: {e}")
 
+@timed(FIRESTORE_SECONDS, op="create_new_conversation")
 async def create_new_conversation(user_id: str, title: str) -> Dict[str, Any]:
     """Crea una nueva conversación y devuelve su ID y título."""
     try:
-        doc_ref = db.collection('users').document(user_id).collection('conversations').document()
+        doc_ref = get_db().collection('users').document(user_id).collection('conversations').document()
         await doc_ref.set({
             "title": title,
             "created_at": firestore.SERVER_TIMESTAMP
@@ -59,44 +159,223 @@ async def create_new_conversation(user_id: str, title: str) -> Dict[str, Any]:
         log.error(f"Error al crear nueva conversación para el usuario {user_id}: {e}")
         return {}
 
+# --- BORRADO MASIVO (RECURSIVO) ---
+async def delete_collection(
+    collection_ref,
+    max_depth: Optional[int] = None,
+    page_size: Optional[int] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    on_progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    Borra todos los documentos de una colección (y, hasta 'max_depth' niveles, sus
+    subcolecciones) paginando con cursores y usando batched writes concurrentes.
+    'semaphore' acota todas las RPCs (páginas, listados de subcolecciones y commits)
+    en todos los niveles. Es idempotente: si se interrumpe, basta con volver a llamarla.
+    Devuelve el número de documentos borrados.
+    """
+    page_size = min(page_size or settings.DELETE_PAGE_SIZE, 500)
+    semaphore = semaphore or asyncio.Semaphore(settings.DELETE_MAX_CONCURRENCY)
+    deleted = 0
+    commits: Set[asyncio.Task] = set()
+
+    def report(count: int):
+        nonlocal deleted
+        deleted += count
+        if on_progress:
+            on_progress(deleted)
+
+    async def commit_page(refs):
+        async with semaphore:
+            batch = get_db().batch()
+            for ref in refs:
+                batch.delete(ref)
+            await batch.commit()
+        report(len(refs))
+
+    # Solo necesitamos las referencias: proyección vacía para no descargar los datos.
+    query = collection_ref.order_by("__name__").select([]).limit(page_size)
+    last_snapshot = None
+    try:
+        while True:
+            page_query = query.start_after(last_snapshot) if last_snapshot is not None else query
+            async with semaphore:
+                page = [doc async for doc in page_query.stream()]
+            if not page:
+                break
+            last_snapshot = page[-1]
+            refs = [doc.reference for doc in page]
+
+            if max_depth is None or max_depth > 0:
+                child_depth = None if max_depth is None else max_depth - 1
+                nested = await asyncio.gather(*(
+                    _delete_subcollections(ref, child_depth, page_size, semaphore) for ref in refs
+                ))
+                if sum(nested):
+                    report(sum(nested))
+
+            commits.add(asyncio.create_task(commit_page(refs)))
+            # Como mucho DELETE_MAX_CONCURRENCY páginas pendientes: no se sigue paginando sin límite.
+            if len(commits) >= settings.DELETE_MAX_CONCURRENCY:
+                done, commits = await asyncio.wait(commits, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+            if len(page) < page_size:
+                break
+
+        if commits:
+            await asyncio.gather(*commits)
+    finally:
+        for task in commits:
+            task.cancel()
+    return deleted
+
+async def _list_subcollections(doc_ref, semaphore: asyncio.Semaphore) -> list:
+    # El permiso se libera antes de recorrer las subcolecciones: solo cubre la RPC de
+    # listado, así que los niveles anidados no pueden bloquearse esperando permisos.
+    async with semaphore:
+        return [sub_collection async for sub_collection in doc_ref.collections()]
+
+async def _delete_subcollections(doc_ref, max_depth: Optional[int], page_size: int, semaphore: asyncio.Semaphore) -> int:
+    deleted = 0
+    for sub_collection in await _list_subcollections(doc_ref, semaphore):
+        deleted += await delete_collection(sub_collection, max_depth, page_size, semaphore)
+    return deleted
+
+async def delete_document_recursive(
+    doc_ref,
+    max_depth: Optional[int] = None,
+    on_progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    """Borra un documento y todas sus subcolecciones. Reutilizable para cualquier dato de usuario."""
+    semaphore = asyncio.Semaphore(settings.DELETE_MAX_CONCURRENCY)
+    deleted = 0
+    for sub_collection in await _list_subcollections(doc_ref, semaphore):
+        # El progreso se acumula entre subcolecciones.
+        offset = deleted
+        deleted += await delete_collection(
+            sub_collection,
+            max_depth=None if max_depth is None else max_depth - 1,
+            semaphore=semaphore,
+            on_progress=(lambda n, offset=offset: on_progress(offset + n)) if on_progress else None,
+        )
+    await doc_ref.delete()
+    return deleted + 1
+
+@timed(FIRESTORE_SECONDS, op="delete_conversation")
 async def delete_conversation(user_id: str, convo_id: str):
     """Elimina una conversación y todos sus mensajes de forma recursiva."""
     try:
-        convo_ref = db.collection('users').document(user_id).collection('conversations').document(convo_id)
-        # Firestore no tiene un 'delete recursivo' nativo en el SDK de servidor, 
-        # así que eliminamos los mensajes primero.
-        messages_ref = convo_ref.collection('messages')
-        async for msg_doc in messages_ref.stream():
-            await msg_doc.reference.delete()
-        
-        await convo_ref.delete()
-        log.info(f"Conversación {convo_id} del usuario {user_id} eliminada correctamente.")
+        convo_ref = get_db().collection('users').document(user_id).collection('conversations').document(convo_id)
+        # Los mensajes no tienen subcolecciones: max_depth=1 evita listar subcolecciones de cada uno.
+        deleted = await delete_document_recursive(
+            convo_ref,
+            max_depth=1,
+            on_progress=lambda n: log.info(f"Borrando convo {convo_id}: {n} mensajes eliminados...")
+        )
+        log.info(f"Conversación {convo_id} del usuario {user_id} eliminada correctamente ({deleted} documentos).")
     except Exception as e:
         log.error(f"Error al eliminar la conversación {convo_id} del usuario {user_id}: {e}")
 
+@timed(FIRESTORE_SECONDS, op="delete_prequalifications")
+async def delete_prequalifications(user_id: str) -> int:
+    """Elimina todas las precalificaciones guardadas de un usuario."""
+    try:
+        collection_ref = get_db().collection("users").document(user_id).collection("prequalifications")
+        deleted = await delete_collection(collection_ref)
+        log.info(f"{deleted} precalificaciones del usuario {user_id} eliminadas.")
+        return deleted
+    except Exception as e:
+        log.error(f"Error al eliminar las precalificaciones del usuario {user_id}: {e}")
+        return 0
+
+@timed(FIRESTORE_SECONDS, op="update_conversation_title")
 async def update_conversation_title(user_id: str, convo_id: str, new_title: str):
     """Actualiza el título de una conversación específica."""
     try:
-        convo_ref = db.collection('users').document(user_id).collection('conversations').document(convo_id)
+        convo_ref = get_db().collection('users').document(user_id).collection('conversations').document(convo_id)
         await convo_ref.update({"title": new_title})
         log.info(f"Título de la conversación {convo_id} actualizado a '{new_title}'.")
     except Exception as e:
         log.error(f"Error al actualizar el título de la convo {convo_id}: {e}")
 
 # --- NUEVA FUNCIÓN PARA EL PRECALIFICADOR ---
-async def save_prequalification(user_id: str, title: str, facts: str, analysis_result: str, country_code: str | None):
-    """Guarda el resultado del precalificador en una colección dedicada."""
+def enqueue_prequalification(user_id: str, title: str, facts: str, analysis_result: str, country_code: str | None, truncated: bool = False) -> str:
+    """
+    Encola el resultado del precalificador en la cola de escrituras diferidas.
+    Devuelve la ruta del documento, que se fija al encolar.
+    """
+    data = {
+        "title": title,
+        "facts": facts,
+        "analysis": analysis_result,
+        "country_code": country_code,
+        "created_at": firestore.SERVER_TIMESTAMP,
+        "type": "prequalification_v20",
+        "truncated": truncated
+    }
+    # Guardar en subcolección 'prequalifications' del usuario
+    path = write_queue.new_document_path(f"users/{user_id}/prequalifications")
+    write_queue.enqueue(path, data)
+    log.info(f"Precalificación encolada para usuario {user_id}")
+    return path
+
+@timed(FIRESTORE_SECONDS, op="save_prequalification")
+async def save_prequalification(user_id: str, title: str, facts: str, analysis_result: str, country_code: str | None, truncated: bool = False):
+    """Guarda el resultado del precalificador en una colección dedicada (vía la cola de escrituras)."""
     try:
-        data = {
-            "title": title,
-            "facts": facts,
-            "analysis": analysis_result,
-            "country_code": country_code,
-            "created_at": firestore.SERVER_TIMESTAMP,
-            "type": "prequalification_v20"
-        }
-        # Guardar en subcolección 'prequalifications' del usuario
-        await db.collection("users").document(user_id).collection("prequalifications").add(data)
-        log.info(f"Precalificación guardada para usuario {user_id}")
+        enqueue_prequalification(user_id, title, facts, analysis_result, country_code, truncated)
     except Exception as e:
         log.error(f"Error guardando precalificación: {e}")
+
+@timed(FIRESTORE_SECONDS, op="get_prequalification")
+async def get_prequalification(user_id: str, prequalification_id: str) -> Optional[Dict[str, Any]]:
+    """Obtiene una precalificación guardada (incluida una recién encolada que aún no se ha confirmado)."""
+    path = f"users/{user_id}/prequalifications/{prequalification_id}"
+    pending = write_queue.get_pending(path)
+    if pending is not None:
+        return {"id": prequalification_id, **pending}
+    snapshot = await get_db().document(path).get()
+    if not snapshot.exists:
+        return None
+    return {"id": snapshot.id, **snapshot.to_dict()}
+
+# --- PREGUNTAS DE SEGUIMIENTO SOBRE UNA PRECALIFICACIÓN ---
+# Los mensajes van en la subcolección 'messages' de la precalificación y se ordenan por 'turn'
+# (no por timestamp: los dos mensajes de un turno se confirman en el mismo batch).
+def _prequalification_path(user_id: str, prequalification_id: str) -> str:
+    return f"users/{user_id}/prequalifications/{prequalification_id}"
+
+async def iter_followup_messages(user_id: str, prequalification_id: str, from_turn: int = 0) -> AsyncIterator[ChatMessage]:
+    """Mensajes de seguimiento desde el turno 'from_turn' (los anteriores ya están resumidos)."""
+    messages_ref = get_db().document(_prequalification_path(user_id, prequalification_id)).collection("messages")
+    query = messages_ref.where("turn", ">=", from_turn).order_by("turn").select(["role", "content", "turn"])
+    async for message in _iter_messages(query):
+        yield message
+
+@timed(FIRESTORE_SECONDS, op="get_followup_summary")
+async def get_followup_summary(user_id: str, prequalification_id: str) -> Dict[str, Any]:
+    """Resumen acumulado de los turnos antiguos: {"summary", "summarized_turns"}."""
+    path = f"{_prequalification_path(user_id, prequalification_id)}/followup_state/summary"
+    pending = write_queue.get_pending(path)
+    if pending is not None:
+        return pending
+    snapshot = await get_db().document(path).get()
+    return snapshot.to_dict() if snapshot.exists else {"summary": "", "summarized_turns": 0}
+
+def enqueue_followup_messages(user_id: str, prequalification_id: str, first_turn: int, messages: List[ChatMessage]):
+    """Encola los mensajes de un turno en la cola de escrituras diferidas (batched writes)."""
+    collection_path = f"{_prequalification_path(user_id, prequalification_id)}/messages"
+    for offset, message in enumerate(messages):
+        write_queue.enqueue(write_queue.new_document_path(collection_path), {
+            **message.model_dump(),
+            "turn": first_turn + offset,
+            "timestamp": firestore.SERVER_TIMESTAMP,
+        })
+
+def enqueue_followup_summary(user_id: str, prequalification_id: str, summary: str, summarized_turns: int):
+    write_queue.enqueue(f"{_prequalification_path(user_id, prequalification_id)}/followup_state/summary", {
+        "summary": summary,
+        "summarized_turns": summarized_turns,
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    })
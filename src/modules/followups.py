@@ -0,0 +1,178 @@
+# src/modules/followups.py
+
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.config import settings, log
+from src.core.prompts import FOLLOWUP_SUMMARY_PROMPT
+from src.models.chat_models import ChatMessage
+from src.modules import gemini_client, firestore_client
+from src.modules.admission import admission_controller
+from src.modules.long_input import estimate_tokens
+
+_CONTEXT_ACK = "Entendido. Tengo presentes el relato y el informe de precalificación; responderé a las preguntas de seguimiento sobre ellos."
+
+
+class FollowupSession:
+    """
+    Conversación de seguimiento sobre una precalificación. Mantiene el historial reciente ya
+    convertido a Content (se reutiliza entre turnos) y un resumen acumulado de los turnos
+    antiguos, de modo que el historial enviado a Gemini no supere el presupuesto de tokens.
+    """
+
+    def __init__(self, user_id: str, prequalification_id: str, prequalification: Dict[str, Any],
+                 summary: str, summarized_turns: int, messages: List[ChatMessage]):
+        self.user_id = user_id
+        self.prequalification_id = prequalification_id
+        self.title = prequalification.get("title") or ""
+        self.facts = prequalification.get("facts") or ""
+        self.analysis = prequalification.get("analysis") or ""
+        self.summary = summary
+        self.summarized_turns = summarized_turns
+        self.messages = list(messages)
+        self._contents = gemini_client.prepare_history_for_vertex(self.messages)
+        self._context: Optional[List[Any]] = None
+        # Serializa los turnos de una misma conversación (numeración de turnos consistente).
+        self.lock = asyncio.Lock()
+        self.compaction_task: Optional[asyncio.Task] = None
+        self.last_used = time.monotonic()
+
+    @property
+    def next_turn(self) -> int:
+        return self.summarized_turns + len(self.messages)
+
+    def _context_contents(self) -> List[Any]:
+        """Par inicial (usuario/modelo) con el caso, el informe y el resumen; se reconstruye al cambiar el resumen."""
+        if self._context is None:
+            facts = self.facts
+            if len(facts) > settings.FOLLOWUP_FACTS_MAX_CHARS:
+                facts = facts[:settings.FOLLOWUP_FACTS_MAX_CHARS] + " [...]"
+            context = (
+                f"CASO: {self.title}\n\n"
+                f"RELATO DE HECHOS:\n{facts}\n\n"
+                f"INFORME DE PRECALIFICACIÓN YA EMITIDO:\n{self.analysis}"
+            )
+            if self.summary:
+                context += f"\n\nRESUMEN DE LA CONVERSACIÓN DE SEGUIMIENTO ANTERIOR:\n{self.summary}"
+            self._context = gemini_client.prepare_history_for_vertex([
+                ChatMessage(role="user", content=context),
+                ChatMessage(role="model", content=_CONTEXT_ACK),
+            ])
+        return self._context
+
+    def history(self) -> List[Any]:
+        self.last_used = time.monotonic()
+        return self._context_contents() + self._contents
+
+    def history_tokens(self) -> int:
+        return sum(estimate_tokens(message.content) for message in self.messages)
+
+    def record_turn(self, question: str, answer: str):
+        """Añade el turno al historial en memoria y lo encola para escribirlo en Firestore."""
+        turn = [ChatMessage(role="user", content=question), ChatMessage(role="model", content=answer)]
+        firestore_client.enqueue_followup_messages(self.user_id, self.prequalification_id, self.next_turn, turn)
+        self.messages.extend(turn)
+        self._contents.extend(gemini_client.prepare_history_for_vertex(turn))
+        self.last_used = time.monotonic()
+
+    def schedule_compaction(self):
+        if self.history_tokens() <= settings.FOLLOWUP_HISTORY_TOKEN_BUDGET:
+            return
+        if self.compaction_task is None or self.compaction_task.done():
+            self.compaction_task = asyncio.create_task(self._compact())
+
+    async def _compact(self):
+        """Resume la mitad más antigua del historial (en turnos completos) hasta caber en el presupuesto."""
+        budget = settings.FOLLOWUP_HISTORY_TOKEN_BUDGET
+        while self.history_tokens() > budget and len(self.messages) >= 4:
+            count = (len(self.messages) // 2) & ~1
+            older = self.messages[:count]
+            transcript = "\n\n".join(
+                f"{'USUARIO' if m.role == 'user' else 'ASISTENTE'}: {m.content}" for m in older
+            )
+            prompt = (
+                f"RESUMEN PREVIO:\n{self.summary or '(ninguno)'}\n\n"
+                f"TURNOS A INCORPORAR:\n{transcript}\n\n"
+                "Redacta el resumen actualizado."
+            )
+            try:
+                # El resumen es otra llamada a Gemini: pasa por el control de admisión del usuario.
+                # Con la cola llena se abandona y se reintenta al terminar el siguiente turno.
+                async with admission_controller.enqueue(self.user_id):
+                    summary = await gemini_client.generate_text(FOLLOWUP_SUMMARY_PROMPT, prompt)
+            except Exception as e:
+                log.warning(f"No se pudo resumir el seguimiento de {self.prequalification_id}: {e}")
+                return
+            # Solo se han añadido mensajes al final mientras tanto: el prefijo resumido sigue siendo el mismo.
+            del self.messages[:count]
+            del self._contents[:count]
+            self.summary = summary
+            self.summarized_turns += count
+            self._context = None
+            firestore_client.enqueue_followup_summary(
+                self.user_id, self.prequalification_id, self.summary, self.summarized_turns
+            )
+            log.info(f"Seguimiento {self.prequalification_id}: {count} mensajes sustituidos por el resumen.")
+
+
+class FollowupSessionCache:
+    """LRU de sesiones de seguimiento por (usuario, precalificación), con expiración por inactividad."""
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[Tuple[str, str], FollowupSession]" = OrderedDict()
+        self._loading: Dict[Tuple[str, str], asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    async def get(self, user_id: str, prequalification_id: str) -> Optional[FollowupSession]:
+        key = (user_id, prequalification_id)
+        session = self._sessions.get(key)
+        if session is not None and time.monotonic() - session.last_used <= self.ttl_seconds:
+            self._sessions.move_to_end(key)
+            self.hits += 1
+            return session
+
+        self.misses += 1
+        # Las cargas simultáneas de la misma conversación comparten una única lectura.
+        loading = self._loading.get(key)
+        if loading is None:
+            loading = self._loading[key] = asyncio.ensure_future(_load_session(user_id, prequalification_id))
+            loading.add_done_callback(lambda _: self._loading.pop(key, None))
+        session = await asyncio.shield(loading)
+        if session is not None:
+            self._sessions[key] = session
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+        return session
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"sessions": len(self._sessions), "hits": self.hits, "misses": self.misses}
+
+
+async def _load_session(user_id: str, prequalification_id: str) -> Optional[FollowupSession]:
+    prequalification = await firestore_client.get_prequalification(user_id, prequalification_id)
+    if prequalification is None:
+        return None
+    state = await firestore_client.get_followup_summary(user_id, prequalification_id)
+    summarized_turns = int(state.get("summarized_turns") or 0)
+    messages = [
+        message async for message in
+        firestore_client.iter_followup_messages(user_id, prequalification_id, from_turn=summarized_turns)
+    ]
+    return FollowupSession(
+        user_id, prequalification_id, prequalification, state.get("summary") or "", summarized_turns, messages
+    )
+
+
+session_cache = FollowupSessionCache(
+    max_size=settings.FOLLOWUP_SESSION_CACHE_MAX_SIZE,
+    ttl_seconds=settings.FOLLOWUP_SESSION_TTL_SECONDS,
+)
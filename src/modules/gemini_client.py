@@ -2,65 +2,343 @@
 
 import vertexai
 import asyncio 
+import hashlib
+import random
+import time
+import datetime
 from vertexai.generative_models import GenerativeModel, Content, Part, GenerationConfig
-from typing import List, AsyncGenerator
+from google.api_core import exceptions as google_exceptions
+from typing import List, AsyncGenerator, Dict, Any, Iterable, Optional
 from src.config import settings, log
 from src.models.chat_models import ChatMessage
+from src.core.metrics import registry
+
+TTFT_SECONDS = registry.histogram("gemini_time_to_first_token_seconds", "Tiempo hasta el primer token de Gemini.")
+GENERATION_SECONDS = registry.histogram("gemini_generation_seconds", "Duración total de la generación en streaming.")
+CHUNKS_TOTAL = registry.counter("gemini_chunks_total", "Fragmentos de texto recibidos de Gemini.")
+OUTPUT_CHARS_TOTAL = registry.counter("gemini_output_chars_total", "Caracteres generados por Gemini.")
+TOKENS_TOTAL = registry.counter("gemini_tokens_total", "Tokens según usage_metadata.", ("type",))
 
 # --- INICIALIZACIÓN DEL CLIENTE Y MODELO ---
-try:
-    vertexai.init(project=settings.GOOGLE_CLOUD_PROJECT, location=settings.GOOGLE_CLOUD_LOCATION)
+# Se inicializan en el lifespan (src/core/clients.py) o, si no, en la primera petición.
+model = None
+generation_config = None
+_model_init_attempted = False
 
-    generation_config = GenerationConfig(
-        max_output_tokens=settings.MAX_OUTPUT_TOKENS,
-        temperature=settings.TEMPERATURE,
-        top_p=settings.TOP_P,
-    )
+def init_model():
+    """Inicializa Vertex AI y el modelo (idempotente). Si ya hay un modelo asignado (p. ej. falso), se respeta."""
+    global model, generation_config, _model_init_attempted
+    if _model_init_attempted or model is not None:
+        return
+    _model_init_attempted = True
+    try:
+        vertexai.init(project=settings.GOOGLE_CLOUD_PROJECT, location=settings.GOOGLE_CLOUD_LOCATION)
 
-    model = GenerativeModel(settings.GEMINI_MODEL)
-    log.info(f"Cliente de Vertex AI inicializado y modelo '{settings.GEMINI_MODEL}' cargado.")
+        generation_config = GenerationConfig(
+            max_output_tokens=settings.MAX_OUTPUT_TOKENS,
+            temperature=settings.TEMPERATURE,
+            top_p=settings.TOP_P,
+        )
 
-except Exception as e:
-    log.critical(f"No se pudo inicializar Vertex AI o cargar el modelo: {e}", exc_info=True)
-    model = None
+        model = GenerativeModel(settings.GEMINI_MODEL)
+        log.info(f"Cliente de Vertex AI inicializado y modelo '{settings.GEMINI_MODEL}' cargado.")
+
+    except Exception as e:
+        log.critical(f"No se pudo inicializar Vertex AI o cargar el modelo: {e}", exc_info=True)
+        model = None
+
+async def warm_up():
+    """Construye por adelantado el modelo con el prompt de sistema del precalificador."""
+    from src.core.prompts import PRECALIFIER_SYSTEM_PROMPT
+    if model and settings.GEMINI_PROMPT_MODE == "system_instruction":
+        await get_model_for_system_prompt(PRECALIFIER_SYSTEM_PROMPT)
+
+# Mensajes que se emiten como texto cuando la generación falla; no deben cachearse.
+MODEL_UNAVAILABLE_MESSAGE = "Error: El modelo de IA no está configurado correctamente."
+GENERATION_ERROR_MESSAGE = "Hubo un problema al contactar al servicio de IA."
+ERROR_MESSAGES = frozenset({MODEL_UNAVAILABLE_MESSAGE, GENERATION_ERROR_MESSAGE})
+
+# Errores de Vertex que merecen reintento con backoff (cuota, sobrecarga, timeouts).
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+)
 
 # --- FUNCIONES AUXILIARES ---
 
-def prepare_history_for_vertex(history: List[ChatMessage]) -> List[Content]:
+def message_to_content(message: ChatMessage) -> Content:
+    role = 'user' if message.role == 'user' else 'model'
+    return Content(role=role, parts=[Part.from_text(message.content)])
+
+def prepare_history_for_vertex(history: Iterable[ChatMessage]) -> List[Content]:
     """Convierte nuestro historial de Pydantic al formato que espera la API de Gemini."""
-    vertex_history = []
-    for message in history:
-        role = 'user' if message.role == 'user' else 'model'
-        vertex_history.append(Content(role=role, parts=[Part.from_text(message.content)]))
-    return vertex_history
+    return [message_to_content(message) for message in history]
+
+# --- MODELOS CON SYSTEM_INSTRUCTION Y CACHÉ DE CONTEXTO ---
+
+def _default_model_factory(system_instruction: Optional[str] = None, cached_content: Any = None):
+    """Construye un GenerativeModel reutilizable. Se puede sustituir por un modelo falso en pruebas."""
+    if cached_content is not None:
+        from vertexai.preview.generative_models import GenerativeModel as PreviewGenerativeModel
+        return PreviewGenerativeModel.from_cached_content(cached_content=cached_content)
+    return GenerativeModel(
+        settings.GEMINI_MODEL,
+        system_instruction=[system_instruction] if system_instruction else None,
+        generation_config=generation_config,
+    )
+
+model_factory = _default_model_factory
+
+# Modelos construidos una sola vez por versión del prompt de sistema.
+_system_models: Dict[str, Any] = {}
+# Recursos CachedContent por versión del prompt: {"model", "cached_content", "expires_at"}.
+_context_caches: Dict[str, Dict[str, Any]] = {}
+_context_cache_supported = True
+_context_cache_lock = asyncio.Lock()
+_context_cache_refresh_task: Optional[asyncio.Task] = None
+# Tras un fallo transitorio al crear el CachedContent no se reintenta hasta _context_cache_retry_at.
+_context_cache_failures = 0
+_context_cache_retry_at = 0.0
+
+# Errores de CachedContent.create que indican que el prompt (por debajo del mínimo de tokens
+# cacheables) o el modelo no admiten caché de contexto: no tiene sentido reintentar.
+CONTEXT_CACHE_UNSUPPORTED_ERRORS = (
+    google_exceptions.InvalidArgument,
+    google_exceptions.FailedPrecondition,
+    google_exceptions.NotFound,
+    google_exceptions.MethodNotImplemented,
+    ImportError,
+)
+
+_stats = {
+    "requests": 0,
+    "ttft_seconds_total": 0.0,
+    "prompt_tokens_total": 0,
+    "cached_prompt_tokens_total": 0,
+    "output_tokens_total": 0,
+    "retries": 0,
+}
+
+def _prompt_key(system_prompt: str) -> str:
+    return hashlib.sha256(system_prompt.encode()).hexdigest()[:16]
+
+def _get_system_instruction_model(key: str, system_prompt: str):
+    system_model = _system_models.get(key)
+    if system_model is None:
+        system_model = model_factory(system_instruction=system_prompt)
+        _system_models[key] = system_model
+        log.info(f"Modelo con system_instruction construido (prompt {key}).")
+    return system_model
+
+def _create_context_cache(system_prompt: str):
+    from vertexai.preview import caching
+    return caching.CachedContent.create(
+        model_name=settings.GEMINI_MODEL,
+        system_instruction=system_prompt,
+        ttl=datetime.timedelta(seconds=settings.GEMINI_CONTEXT_CACHE_TTL_SECONDS),
+    )
+
+async def _refresh_context_cache(key: str):
+    """Renueva el TTL del CachedContent; si ya no existe, se recreará en la siguiente petición."""
+    entry = _context_caches.get(key)
+    if entry is None:
+        return
+    ttl = datetime.timedelta(seconds=settings.GEMINI_CONTEXT_CACHE_TTL_SECONDS)
+    try:
+        await asyncio.to_thread(entry["cached_content"].update, ttl=ttl)
+        entry["expires_at"] = time.monotonic() + settings.GEMINI_CONTEXT_CACHE_TTL_SECONDS
+        log.info(f"TTL del CachedContent renovado (prompt {key}).")
+    except Exception as e:
+        log.warning(f"No se pudo renovar el CachedContent (prompt {key}): {e}")
+        _context_caches.pop(key, None)
+
+async def _get_context_cached_model(key: str, system_prompt: str):
+    global _context_cache_supported, _context_cache_refresh_task, _context_cache_failures, _context_cache_retry_at
+
+    entry = _context_caches.get(key)
+    now = time.monotonic()
+    if entry is None or entry["expires_at"] <= now:
+        if now < _context_cache_retry_at:
+            return _get_system_instruction_model(key, system_prompt)
+        async with _context_cache_lock:
+            entry = _context_caches.get(key)
+            if entry is None or entry["expires_at"] <= time.monotonic():
+                if time.monotonic() < _context_cache_retry_at:
+                    return _get_system_instruction_model(key, system_prompt)
+                try:
+                    # La creación es una llamada de red síncrona del SDK: fuera del event loop.
+                    cached_content = await asyncio.to_thread(_create_context_cache, system_prompt)
+                except CONTEXT_CACHE_UNSUPPORTED_ERRORS as e:
+                    log.warning(f"Caché de contexto no admitida, se usa system_instruction: {e}")
+                    _context_cache_supported = False
+                    return _get_system_instruction_model(key, system_prompt)
+                except Exception as e:
+                    # Fallo transitorio (red, cuota...): system_instruction mientras dura el backoff.
+                    delay = min(
+                        settings.GEMINI_CONTEXT_CACHE_RETRY_MAX_SECONDS,
+                        settings.GEMINI_CONTEXT_CACHE_RETRY_BASE_SECONDS * 2 ** _context_cache_failures
+                    )
+                    _context_cache_failures += 1
+                    _context_cache_retry_at = time.monotonic() + delay
+                    log.warning(f"No se pudo crear el CachedContent, nuevo intento en {delay:.0f}s: {e}")
+                    return _get_system_instruction_model(key, system_prompt)
+                _context_cache_failures = 0
+                entry = {
+                    "model": model_factory(cached_content=cached_content),
+                    "cached_content": cached_content,
+                    "expires_at": time.monotonic() + settings.GEMINI_CONTEXT_CACHE_TTL_SECONDS,
+                }
+                _context_caches[key] = entry
+                log.info(f"CachedContent creado para el prompt de sistema {key}.")
+    elif entry["expires_at"] - now <= settings.GEMINI_CONTEXT_CACHE_REFRESH_MARGIN_SECONDS:
+        if _context_cache_refresh_task is None or _context_cache_refresh_task.done():
+            _context_cache_refresh_task = asyncio.create_task(_refresh_context_cache(key))
+
+    return entry["model"]
+
+async def get_model_for_system_prompt(system_prompt: str):
+    """Devuelve el modelo (reutilizado) que lleva el prompt de sistema como system_instruction."""
+    key = _prompt_key(system_prompt)
+    if settings.GEMINI_CONTEXT_CACHE_ENABLED and _context_cache_supported:
+        return await _get_context_cached_model(key, system_prompt)
+    return _get_system_instruction_model(key, system_prompt)
+
+def _record_usage(ttft: Optional[float], total_seconds: float, usage_metadata: Any):
+    _stats["requests"] += 1
+    GENERATION_SECONDS.observe(total_seconds)
+    if ttft is not None:
+        _stats["ttft_seconds_total"] += ttft
+        TTFT_SECONDS.observe(ttft)
+    if usage_metadata is not None:
+        prompt_tokens = getattr(usage_metadata, "prompt_token_count", 0) or 0
+        cached_tokens = getattr(usage_metadata, "cached_content_token_count", 0) or 0
+        output_tokens = getattr(usage_metadata, "candidates_token_count", 0) or 0
+        _stats["prompt_tokens_total"] += prompt_tokens
+        _stats["cached_prompt_tokens_total"] += cached_tokens
+        _stats["output_tokens_total"] += output_tokens
+        TOKENS_TOTAL.labels(type="prompt").inc(prompt_tokens)
+        TOKENS_TOTAL.labels(type="cached_prompt").inc(cached_tokens)
+        TOKENS_TOTAL.labels(type="output").inc(output_tokens)
+
+def get_stats() -> Dict[str, Any]:
+    """Métricas agregadas de generación (TTFT y tokens de prompt) para comparar modos."""
+    requests = _stats["requests"]
+    return {
+        **_stats,
+        "prompt_mode": settings.GEMINI_PROMPT_MODE,
+        "context_cache_active": settings.GEMINI_CONTEXT_CACHE_ENABLED and _context_cache_supported,
+        "avg_ttft_seconds": (_stats["ttft_seconds_total"] / requests) if requests else 0.0,
+        "avg_prompt_tokens": (_stats["prompt_tokens_total"] / requests) if requests else 0.0,
+    }
+
+async def count_tokens(text: str) -> Optional[int]:
+    """Cuenta los tokens de un texto con la API de Vertex; devuelve None si no está disponible."""
+    if model is None and not _model_init_attempted:
+        await asyncio.to_thread(init_model)
+    count_tokens_async = getattr(model, "count_tokens_async", None)
+    if count_tokens_async is None:
+        return None
+    try:
+        response = await count_tokens_async(text)
+        return response.total_tokens
+    except Exception as e:
+        log.warning(f"No se pudieron contar los tokens con Vertex: {e}")
+        return None
+
+async def generate_text(system_prompt: str, prompt: str) -> str:
+    """
+    Genera una respuesta completa (sin reenviarla en streaming) con los mismos reintentos
+    y métricas que generate_streaming_response. Lanza RuntimeError si la generación falla.
+    """
+    parts: List[str] = []
+    async for text in generate_streaming_response(system_prompt, prompt, history=[]):
+        parts.append(text)
+    if not parts or parts[-1] in ERROR_MESSAGES:
+        raise RuntimeError(parts[-1] if parts else "Gemini no devolvió texto.")
+    return "".join(parts)
 
 async def generate_streaming_response(system_prompt: str, prompt: str, history: List[Content]) -> AsyncGenerator[str, None]:
     """
     Genera una respuesta del modelo Gemini en modo streaming ASÍNCRONO REAL.
     Usa send_message_async para no bloquear el event loop.
+    En modo "system_instruction" el prompt de sistema viaja en un modelo reutilizado
+    (y opcionalmente en un CachedContent) en lugar de anteponerse al mensaje.
     """
+    if model is None and not _model_init_attempted:
+        await asyncio.to_thread(init_model)
     if not model:
         log.error("El modelo Gemini no está disponible.")
-        yield "Error: El modelo de IA no está configurado correctamente."
+        yield MODEL_UNAVAILABLE_MESSAGE
         return
 
+    response_stream = None
     try:
-        # Iniciamos el chat (la sesión es local, no requiere await)
-        chat = model.start_chat(history=history)
-        full_prompt = f"{system_prompt}\n\n---\n\n{prompt}"
-        
-        # --- SOLUCIÓN: Usar el método async nativo ---
-        response_stream = await chat.send_message_async(
-            full_prompt, 
-            stream=True, 
-            generation_config=generation_config
-        )
+        started_at = time.perf_counter()
+        if settings.GEMINI_PROMPT_MODE == "system_instruction":
+            active_model = await get_model_for_system_prompt(system_prompt)
+            message = prompt
+        else:
+            active_model = model
+            message = f"{system_prompt}\n\n---\n\n{prompt}"
+
+        ttft = None
+        usage_metadata = None
+        attempt = 0
+        while True:
+            try:
+                # Iniciamos el chat (la sesión es local, no requiere await)
+                chat = active_model.start_chat(history=history)
+                
+                # --- SOLUCIÓN: Usar el método async nativo ---
+                response_stream = await chat.send_message_async(
+                    message, 
+                    stream=True, 
+                    generation_config=generation_config
+                )
 
-        # Iteramos sobre el generador asíncrono
-        async for chunk in response_stream:
-            if chunk.text:
-                yield chunk.text
+                # Iteramos sobre el generador asíncrono
+                async for chunk in response_stream:
+                    usage_metadata = getattr(chunk, "usage_metadata", None) or usage_metadata
+                    text = chunk.text
+                    if text:
+                        if ttft is None:
+                            ttft = time.perf_counter() - started_at
+                        CHUNKS_TOTAL.inc()
+                        OUTPUT_CHARS_TOTAL.inc(len(text))
+                        yield text
+                break
+            except RETRYABLE_ERRORS as e:
+                # Solo se reintenta antes del primer token: a mitad de stream no se puede reanudar.
+                if ttft is not None or attempt >= settings.GEMINI_MAX_RETRIES:
+                    raise
+                delay = random.uniform(0, min(settings.GEMINI_RETRY_MAX_SECONDS, settings.GEMINI_RETRY_BASE_SECONDS * 2 ** attempt))
+                attempt += 1
+                _stats["retries"] += 1
+                log.warning(f"Error recuperable de Vertex ({type(e).__name__}), reintento {attempt} en {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+
+        _record_usage(ttft, time.perf_counter() - started_at, usage_metadata)
+        log.info(
+            f"Generación completada (modo={settings.GEMINI_PROMPT_MODE}, "
+            f"ttft={ttft if ttft is None else round(ttft, 3)}s, "
+            f"prompt_tokens={getattr(usage_metadata, 'prompt_token_count', None)}, "
+            f"cached_tokens={getattr(usage_metadata, 'cached_content_token_count', None)})"
+        )
 
+    except (asyncio.CancelledError, GeneratorExit):
+        # El cliente se desconectó: cerramos el stream de Vertex para cortar la generación.
+        log.info("Generación de Gemini cancelada antes de terminar.")
+        raise
     except Exception as e:
         log.error(f"Error al generar la respuesta en streaming desde Gemini: {e}", exc_info=True)
-        yield "Hubo un problema al contactar al servicio de IA."
+        yield GENERATION_ERROR_MESSAGE
+    finally:
+        aclose = getattr(response_stream, "aclose", None)
+        if aclose is not None:
+            try:
+                await aclose()
+            except Exception as e:
+                log.warning(f"No se pudo cerrar el stream de Gemini: {e}")
@@ -0,0 +1,172 @@
+# src/modules/long_input.py
+
+import re
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+
+from src.config import settings
+from src.core.prompts import FACT_EXTRACTION_SYSTEM_PROMPT
+from src.modules import gemini_client
+from src.modules.admission import admission_controller
+from src.modules.analysis_cache import AnalysisCache
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?;:])\s+")
+
+# Uno de cada N párrafos (según su hash) cierra un segmento: los cortes dependen del
+# contenido y no de la posición, así que una edición solo desplaza los segmentos vecinos.
+_ANCHOR_MODULUS = 4
+
+EXTRACTION_PROMPT_VERSION = hashlib.sha256(FACT_EXTRACTION_SYSTEM_PROMPT.encode()).hexdigest()[:16]
+
+
+@dataclass(frozen=True)
+class Segment:
+    index: int
+    overlap: str
+    body: str
+
+    @property
+    def text(self) -> str:
+        return f"{self.overlap}\n[...]\n{self.body}" if self.overlap else self.body
+
+    @property
+    def cache_key(self) -> str:
+        parts = [EXTRACTION_PROMPT_VERSION, settings.GEMINI_MODEL, self.overlap, self.body]
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text) / max(settings.LONG_INPUT_CHARS_PER_TOKEN, 1.0))
+
+
+async def needs_map_reduce(facts: str) -> Tuple[bool, int]:
+    """
+    Decide si el relato supera el umbral. La estimación por caracteres basta lejos del
+    umbral; solo en la franja de ±25 % se pide el recuento exacto a Vertex.
+    """
+    threshold = settings.LONG_INPUT_THRESHOLD_TOKENS
+    tokens = estimate_tokens(facts)
+    if abs(tokens - threshold) <= threshold * 0.25:
+        exact = await gemini_client.count_tokens(facts)
+        if exact is not None:
+            tokens = exact
+    return tokens > threshold, tokens
+
+
+def _split_units(text: str, max_chars: int) -> List[str]:
+    """Párrafos; los que exceden max_chars se parten por frases y, en último caso, por longitud."""
+    units: List[str] = []
+    for paragraph in _PARAGRAPH_RE.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            units.append(paragraph)
+            continue
+        for sentence in _SENTENCE_RE.split(paragraph):
+            for i in range(0, len(sentence), max_chars):
+                units.append(sentence[i:i + max_chars])
+    return units
+
+
+def _is_anchor(unit: str) -> bool:
+    return int(hashlib.sha1(unit.encode()).hexdigest()[:8], 16) % _ANCHOR_MODULUS == 0
+
+
+def _tail(text: str, max_chars: int) -> str:
+    if max_chars <= 0 or not text:
+        return ""
+    tail = text[-max_chars:]
+    # Empezamos en un límite de palabra para no cortar a mitad.
+    space = tail.find(" ")
+    return tail[space + 1:] if 0 <= space < len(tail) - 1 else tail
+
+
+def split_segments(facts: str, segment_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None) -> List[Segment]:
+    """
+    Divide el relato en segmentos de hasta ~segment_tokens, cada uno precedido por la cola
+    del anterior (overlap_tokens) para no perder hechos que crucen un corte.
+    """
+    chars_per_token = max(settings.LONG_INPUT_CHARS_PER_TOKEN, 1.0)
+    max_chars = int((segment_tokens or settings.LONG_INPUT_SEGMENT_TOKENS) * chars_per_token)
+    min_chars = max_chars // 2
+    overlap_chars = int((settings.LONG_INPUT_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens) * chars_per_token)
+
+    bodies: List[str] = []
+    current: List[str] = []
+    size = 0
+    for unit in _split_units(facts, max_chars):
+        if current and size + len(unit) > max_chars:
+            bodies.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(unit)
+        size += len(unit) + 2
+        if size >= min_chars and _is_anchor(unit):
+            bodies.append("\n\n".join(current))
+            current, size = [], 0
+    if current:
+        bodies.append("\n\n".join(current))
+
+    return [
+        Segment(index=i, overlap=_tail(bodies[i - 1], overlap_chars) if i else "", body=body)
+        for i, body in enumerate(bodies)
+    ]
+
+
+async def _digest_segment(segment: Segment, total: int, semaphore: asyncio.Semaphore, user_id: str) -> Tuple[Segment, str, bool]:
+    cached = await segment_digest_cache.get(segment.cache_key)
+    if cached is not None:
+        return segment, cached, True
+
+    prompt = f"""
+        FRAGMENTO {segment.index + 1} DE {total} DEL RELATO DE HECHOS:
+        --------------------------------------------------
+        {segment.text}
+        --------------------------------------------------
+
+        Extrae los hechos relevantes de este fragmento.
+        """
+    # Cada extracción ocupa su propio turno de admisión: GEMINI_MAX_IN_FLIGHT cuenta llamadas a Gemini.
+    async with semaphore, admission_controller.enqueue(user_id):
+        digest = await gemini_client.generate_text(FACT_EXTRACTION_SYSTEM_PROMPT, prompt)
+    await segment_digest_cache.put(segment.cache_key, digest, None)
+    return segment, digest, False
+
+
+async def iter_segment_digests(segments: List[Segment], user_id: str, max_concurrency: Optional[int] = None) -> AsyncGenerator[Tuple[Segment, str, bool], None]:
+    """
+    Extrae los hechos de cada segmento en paralelo (con concurrencia limitada) y los
+    devuelve a medida que terminan como (segmento, resumen, venía_de_caché).
+    Cada llamada a Gemini espera su turno en el control de admisión a nombre de 'user_id';
+    el llamante no debe retener otro turno mientras tanto. Si uno falla (también con
+    QueueFullError) o el consumidor se cancela, se cancelan los demás.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency or settings.LONG_INPUT_MAX_CONCURRENCY))
+    tasks = [asyncio.ensure_future(_digest_segment(segment, len(segments), semaphore, user_id)) for segment in segments]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Sin awaits: este bloque puede ejecutarse durante una cancelación.
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()
+
+
+def merge_digests(digests: Dict[int, str]) -> str:
+    """Une los resúmenes en el orden original del relato."""
+    return "\n\n".join(f"### Fragmento {index + 1}\n{digests[index].strip()}" for index in sorted(digests))
+
+
+segment_digest_cache = AnalysisCache(
+    max_size=settings.SEGMENT_DIGEST_CACHE_MAX_SIZE,
+    ttl_seconds=settings.ANALYSIS_CACHE_TTL_SECONDS,
+    use_firestore=settings.ANALYSIS_CACHE_FIRESTORE_ENABLED,
+    collection=settings.SEGMENT_DIGEST_CACHE_COLLECTION,
+    prompt_version=EXTRACTION_PROMPT_VERSION,
+)
@@ -0,0 +1,189 @@
+# src/modules/retrieval.py
+
+import re
+import time
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from src.config import settings, log
+from src.core.clients import get_http_client
+from src.core.metrics import registry
+
+RETRIEVAL_SECONDS = registry.histogram("retrieval_seconds", "Duración de la consulta al RAG (sin contar aciertos de caché).")
+RETRIEVAL_REQUESTS = registry.counter("retrieval_requests_total", "Consultas de recuperación por resultado.", ("result",))
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+@dataclass(frozen=True)
+class Passage:
+    text: str
+    source: str = ""
+    score: float = 0.0
+
+
+def build_query(facts: str, max_chars: Optional[int] = None) -> str:
+    """Consulta normalizada a partir del relato (recortada a max_chars en un límite de palabra)."""
+    query = _WHITESPACE_RE.sub(" ", facts).strip()
+    limit = max_chars or settings.RETRIEVAL_QUERY_MAX_CHARS
+    if len(query) > limit:
+        query = query[:limit].rsplit(" ", 1)[0]
+    return query
+
+
+# Contrato del servicio RAG (RAG_API_URL):
+#   Petición:  POST {"query": str, "country_code": str | null, "top_k": int}
+#   Respuesta: {"results": [{"text": str, "source": str, "score": float}, ...]}
+# 'source' y 'score' son opcionales. Otra forma de respuesta cuenta como fallo del RAG
+# (recuperación degradada): no se intenta adivinar.
+class InvalidRAGResponseError(ValueError):
+    """La respuesta del RAG no sigue el contrato del módulo."""
+
+
+def _parse_passages(payload: Any) -> List[Passage]:
+    """Convierte {"results": [{"text", "source", "score"}, ...]} en pasajes; otra forma es un error."""
+    results = payload.get("results") if isinstance(payload, dict) else None
+    if not isinstance(results, list):
+        raise InvalidRAGResponseError("La respuesta del RAG no contiene una lista 'results'.")
+    passages = []
+    for item in results:
+        if not isinstance(item, dict) or not isinstance(item.get("text"), str):
+            raise InvalidRAGResponseError("Cada resultado del RAG debe ser un objeto con 'text'.")
+        text = item["text"].strip()
+        if not text:
+            continue
+        try:
+            score = float(item.get("score") or 0.0)
+        except (TypeError, ValueError) as e:
+            raise InvalidRAGResponseError("El 'score' de un resultado del RAG no es numérico.") from e
+        passages.append(Passage(text=text, source=str(item.get("source") or ""), score=score))
+    return passages
+
+
+def select_passages(passages: List[Passage], top_k: Optional[int] = None, token_budget: Optional[int] = None) -> List[Passage]:
+    """Los top-k pasajes por puntuación que caben enteros en el presupuesto de tokens."""
+    top_k = top_k or settings.RETRIEVAL_TOP_K
+    budget_chars = (token_budget or settings.RETRIEVAL_TOKEN_BUDGET) * settings.LONG_INPUT_CHARS_PER_TOKEN
+    selected, used = [], 0
+    for passage in sorted(passages, key=lambda p: p.score, reverse=True):
+        if len(selected) >= top_k:
+            break
+        size = len(passage.text) + len(passage.source)
+        if used + size > budget_chars:
+            continue
+        selected.append(passage)
+        used += size
+    return selected
+
+
+def format_passages(passages: List[Passage]) -> str:
+    return "\n\n".join(
+        f"[{i}] {f'({p.source}) ' if p.source else ''}{p.text}" for i, p in enumerate(passages, start=1)
+    )
+
+
+class RetrievalCache:
+    """LRU con TTL por (país, consulta normalizada). Solo se cachean respuestas correctas."""
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[List[Passage], float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Tuple[str, str]) -> Optional[List[Passage]]:
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: Tuple[str, str], passages: List[Passage]):
+        self._entries[key] = (passages, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+retrieval_cache = RetrievalCache(settings.RETRIEVAL_CACHE_MAX_SIZE, settings.RETRIEVAL_CACHE_TTL_SECONDS)
+_stats = {"errors": 0, "timeouts": 0}
+
+
+async def _query_rag(query: str, country_code: Optional[str]) -> List[Passage]:
+    payload = {"query": query, "country_code": country_code, "top_k": settings.RETRIEVAL_TOP_K * 2}
+    started = time.perf_counter()
+    try:
+        response = await get_http_client().post(settings.RAG_API_URL, json=payload, timeout=settings.RETRIEVAL_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        return _parse_passages(response.json())
+    finally:
+        RETRIEVAL_SECONDS.observe(time.perf_counter() - started)
+
+
+async def retrieve(facts: str, country_code: Optional[str]) -> Optional[List[Passage]]:
+    """
+    Recupera pasajes de bases jurídicas para el relato. Es un paso opcional: ante
+    timeout o error se registra y se devuelve None (recuperación degradada) para no
+    bloquear el análisis; una lista vacía significa que el RAG no encontró nada.
+    """
+    if not settings.RETRIEVAL_ENABLED or not settings.RAG_API_URL:
+        return []
+    query = build_query(facts)
+    key = ((country_code or "").strip().upper(), query)
+    cached = retrieval_cache.get(key)
+    if cached is not None:
+        RETRIEVAL_REQUESTS.labels(result="cache_hit").inc()
+        return cached
+
+    try:
+        passages = await _query_rag(query, country_code)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        timed_out = isinstance(e, httpx.TimeoutException)
+        _stats["timeouts" if timed_out else "errors"] += 1
+        RETRIEVAL_REQUESTS.labels(result="timeout" if timed_out else "error").inc()
+        log.warning(f"Recuperación RAG no disponible ({type(e).__name__}): {e}")
+        return None
+
+    RETRIEVAL_REQUESTS.labels(result="ok").inc()
+    retrieval_cache.put(key, passages)
+    return passages
+
+
+async def wait_for_passages(task: asyncio.Task, timeout: Optional[float] = None) -> Tuple[List[Passage], bool]:
+    """
+    Espera como mucho 'timeout' segundos la recuperación lanzada en 'task' y devuelve
+    (pasajes seleccionados, degradada). Si no llega a tiempo se cancela y cuenta como timeout.
+    """
+    done, _ = await asyncio.wait({task}, timeout=settings.RETRIEVAL_TIMEOUT_SECONDS if timeout is None else timeout)
+    if not done:
+        task.cancel()
+        _stats["timeouts"] += 1
+        RETRIEVAL_REQUESTS.labels(result="timeout").inc()
+        log.warning("Recuperación RAG sin respuesta a tiempo; se analiza sin bases jurídicas.")
+        return [], True
+    retrieved = task.result()
+    return select_passages(retrieved or []), retrieved is None
+
+
+def get_stats() -> Dict[str, Any]:
+    total = retrieval_cache.hits + retrieval_cache.misses
+    return {
+        **_stats,
+        "cache_hits": retrieval_cache.hits,
+        "cache_misses": retrieval_cache.misses,
+        "cache_hit_ratio": (retrieval_cache.hits / total) if total else 0.0,
+        "cache_size": len(retrieval_cache),
+    }
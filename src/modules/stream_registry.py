@@ -0,0 +1,201 @@
+# src/modules/stream_registry.py
+
+import time
+import uuid
+import asyncio
+from collections import deque, OrderedDict
+from typing import AsyncIterator, Deque, Dict, Any, List, Optional, Tuple
+
+from fastapi import Request
+from src.config import settings, log
+from src.core.sse import HEARTBEAT_FRAME, encode_event
+
+
+class StreamGoneError(Exception):
+    """El Last-Event-ID solicitado ya no está en el buffer (fue desalojado)."""
+
+
+class AnalysisStream:
+    """
+    Buffer acotado de eventos SSE de un análisis, desacoplado de la conexión HTTP.
+    Cada evento recibe un 'id:' monótono para poder reanudar con Last-Event-ID.
+    """
+
+    def __init__(self, stream_id: str, user_id: str, max_bytes: int):
+        self.stream_id = stream_id
+        self.user_id = user_id
+        self.max_bytes = max_bytes
+        self.events: Deque[Tuple[int, bytes]] = deque()
+        self.size_bytes = 0
+        self.last_id = 0
+        self.finished = False
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._grace_handle: Optional[asyncio.TimerHandle] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def first_available_id(self) -> int:
+        return self.events[0][0] if self.events else self.last_id + 1
+
+    def append(self, frame: bytes):
+        self.last_id += 1
+        framed = b"id: %d\n" % self.last_id + frame
+        self.events.append((self.last_id, framed))
+        self.size_bytes += len(framed)
+        # Si el buffer supera su cupo se descartan los eventos más antiguos.
+        while self.size_bytes > self.max_bytes and len(self.events) > 1:
+            _, dropped = self.events.popleft()
+            self.size_bytes -= len(dropped)
+        self._notify()
+
+    def finish(self):
+        self.finished = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def events_after(self, last_event_id: int) -> List[Tuple[int, bytes]]:
+        if last_event_id + 1 < self.first_available_id and last_event_id < self.last_id:
+            raise StreamGoneError(self.stream_id)
+        return [event for event in self.events if event[0] > last_event_id]
+
+    async def wait_for_change(self, timeout: float) -> bool:
+        changed = self._changed
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class StreamRegistry:
+    """
+    Registro por instancia de los streams de análisis activos y recientes.
+    Limita la memoria total desalojando primero los streams terminados más antiguos
+    y descarta los buffers terminados tras STREAM_BUFFER_TTL_SECONDS.
+    """
+
+    def __init__(self, max_total_bytes: int, max_bytes_per_stream: int, ttl_seconds: float, grace_seconds: float):
+        self.max_total_bytes = max_total_bytes
+        self.max_bytes_per_stream = max_bytes_per_stream
+        self.ttl_seconds = ttl_seconds
+        self.grace_seconds = grace_seconds
+        self._streams: "OrderedDict[str, AnalysisStream]" = OrderedDict()
+        self.resumes = 0
+        self.evictions = 0
+        self.abandoned = 0
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+    def _sweep(self):
+        now = time.monotonic()
+        for stream_id, stream in list(self._streams.items()):
+            if stream.finished and now - stream.finished_at > self.ttl_seconds:
+                del self._streams[stream_id]
+
+        total = sum(stream.size_bytes for stream in self._streams.values())
+        if total <= self.max_total_bytes:
+            return
+        # Los streams activos no se desalojan: solo los terminados, del más antiguo al más reciente.
+        finished = sorted((s for s in self._streams.values() if s.finished), key=lambda s: s.finished_at)
+        for stream in finished:
+            if total <= self.max_total_bytes:
+                break
+            total -= stream.size_bytes
+            del self._streams[stream.stream_id]
+            self.evictions += 1
+
+    def create(self, user_id: str) -> AnalysisStream:
+        self._sweep()
+        stream_id = uuid.uuid4().hex
+        stream = AnalysisStream(stream_id, user_id, self.max_bytes_per_stream)
+        self._streams[stream_id] = stream
+        stream.append(encode_event({"event": "stream", "stream_id": stream_id}))
+        return stream
+
+    def get(self, stream_id: str) -> Optional[AnalysisStream]:
+        self._sweep()
+        return self._streams.get(stream_id)
+
+    def start(self, stream: AnalysisStream, source: AsyncIterator[bytes]):
+        """Lanza la generación en una tarea propia que escribe en el buffer del stream."""
+        stream.task = asyncio.create_task(self._produce(stream, source))
+
+    async def _produce(self, stream: AnalysisStream, source: AsyncIterator[bytes]):
+        try:
+            async for frame in source:
+                # Los heartbeats los genera cada suscriptor; no se almacenan.
+                if frame.startswith(b":"):
+                    continue
+                stream.append(frame)
+        except asyncio.CancelledError:
+            log.info(f"Stream {stream.stream_id} cancelado sin clientes conectados.")
+        except Exception as e:
+            log.error(f"Error produciendo el stream {stream.stream_id}: {e}", exc_info=True)
+        finally:
+            stream.finish()
+
+    async def subscribe(
+        self, stream: AnalysisStream, last_event_id: int = 0, request: Optional[Request] = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Entrega los eventos con id > last_event_id y sigue los nuevos hasta que el stream
+        termina. Si no quedan suscriptores, la generación se cancela tras un periodo de gracia.
+        """
+        if last_event_id:
+            self.resumes += 1
+        stream.subscribers += 1
+        if stream._grace_handle is not None:
+            stream._grace_handle.cancel()
+            stream._grace_handle = None
+        try:
+            cursor = last_event_id
+            while True:
+                for event_id, frame in stream.events_after(cursor):
+                    yield frame
+                    cursor = event_id
+                if stream.finished and cursor >= stream.last_id:
+                    return
+                if cursor < stream.last_id:
+                    continue
+                if not await stream.wait_for_change(settings.SSE_HEARTBEAT_INTERVAL_SECONDS):
+                    if request is not None and await request.is_disconnected():
+                        return
+                    yield HEARTBEAT_FRAME
+        finally:
+            # Sin awaits: puede ejecutarse dentro de un ámbito ya cancelado por la desconexión.
+            stream.subscribers -= 1
+            if stream.subscribers == 0 and not stream.finished:
+                stream._grace_handle = asyncio.get_running_loop().call_later(
+                    self.grace_seconds, self._cancel_if_abandoned, stream
+                )
+
+    def _cancel_if_abandoned(self, stream: AnalysisStream):
+        stream._grace_handle = None
+        if stream.subscribers == 0 and not stream.finished and stream.task is not None:
+            self.abandoned += 1
+            stream.task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "streams": len(self._streams),
+            "active": sum(1 for s in self._streams.values() if not s.finished),
+            "buffered_bytes": sum(s.size_bytes for s in self._streams.values()),
+            "resumes": self.resumes,
+            "evictions": self.evictions,
+            "abandoned": self.abandoned,
+        }
+
+
+stream_registry = StreamRegistry(
+    max_total_bytes=settings.STREAM_REGISTRY_MAX_BYTES,
+    max_bytes_per_stream=settings.STREAM_BUFFER_MAX_BYTES_PER_STREAM,
+    ttl_seconds=settings.STREAM_BUFFER_TTL_SECONDS,
+    grace_seconds=settings.STREAM_RESUME_GRACE_SECONDS,
+)
@@ -0,0 +1,154 @@
+# src/modules/subscription_cache.py
+
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, Callable, Awaitable
+
+from google.cloud import firestore
+from src.config import settings, log
+
+
+class SubscriptionCache:
+    """
+    Caché por instancia del estado de suscripción de cada usuario.
+    Usa TTLs distintos para resultados positivos y negativos, tamaño acotado con
+    desalojo LRU y, opcionalmente, invalidación push mediante on_snapshot de Firestore.
+    Las escuchas siguen su propio LRU con el mismo tamaño máximo: sobreviven a la
+    expiración y a la invalidación de la entrada (que se vuelve a rellenar sin
+    re-suscribirse) y se cancelan cuando el usuario sale del LRU.
+    """
+
+    def __init__(self, max_size: int, positive_ttl: float, negative_ttl: float, watch_enabled: bool = False):
+        self.max_size = max_size
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.watch_enabled = watch_enabled
+        self._entries: "OrderedDict[str, Tuple[bool, float]]" = OrderedDict()
+        self._watches: "OrderedDict[str, Any]" = OrderedDict()
+        self._sync_db: Optional[firestore.Client] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, user_id: str) -> Optional[bool]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        is_active, expires_at = entry
+        if expires_at <= time.monotonic():
+            # Solo caduca la entrada: la escucha se conserva y put() la reutiliza.
+            del self._entries[user_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        if user_id in self._watches:
+            self._watches.move_to_end(user_id)
+        self.hits += 1
+        return is_active
+
+    def put(self, user_id: str, is_active: bool):
+        ttl = self.positive_ttl if is_active else self.negative_ttl
+        self._entries[user_id] = (is_active, time.monotonic() + ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            oldest, _ = next(iter(self._entries.items()))
+            self._evict(oldest)
+        if self.watch_enabled:
+            self._ensure_watch(user_id)
+
+    def invalidate(self, user_id: str):
+        if self._entries.pop(user_id, None) is not None:
+            self.invalidations += 1
+
+    def _evict(self, user_id: str):
+        self._entries.pop(user_id, None)
+        watch = self._watches.pop(user_id, None)
+        if watch is not None:
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                log.warning(f"No se pudo cancelar la escucha de suscripción de {user_id}: {e}")
+
+    # --- INVALIDACIÓN PUSH (on_snapshot) ---
+    def _ensure_watch(self, user_id: str):
+        """
+        Registra un listener sobre customers/{uid}/subscriptions. El SDK solo ofrece
+        on_snapshot en el cliente síncrono y ejecuta el callback en un hilo propio,
+        así que la invalidación se reenvía al event loop con call_soon_threadsafe.
+        """
+        if user_id in self._watches:
+            self._watches.move_to_end(user_id)
+            return
+        try:
+            if self._loop is None:
+                self._loop = asyncio.get_running_loop()
+            if self._sync_db is None:
+                self._sync_db = firestore.Client(project=settings.GOOGLE_CLOUD_PROJECT)
+
+            first_snapshot = True
+
+            def on_change(_docs, _changes, _read_time):
+                nonlocal first_snapshot
+                # El primer snapshot es el estado inicial, no un cambio.
+                if first_snapshot:
+                    first_snapshot = False
+                    return
+                self._loop.call_soon_threadsafe(self.invalidate, user_id)
+
+            ref = self._sync_db.collection("customers").document(user_id).collection("subscriptions")
+            self._watches[user_id] = ref.on_snapshot(on_change)
+        except Exception as e:
+            log.warning(f"No se pudo registrar la escucha de suscripción para {user_id}: {e}")
+        while len(self._watches) > self.max_size:
+            oldest = next(iter(self._watches))
+            self._evict(oldest)
+
+    def close(self):
+        """Cancela las escuchas on_snapshot (y sus hilos) y cierra el cliente síncrono."""
+        for user_id in list(self._watches):
+            self._evict(user_id)
+        if self._sync_db is not None:
+            try:
+                self._sync_db.close()
+            except Exception as e:
+                log.warning(f"No se pudo cerrar el cliente de escuchas de suscripción: {e}")
+            self._sync_db = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+            "invalidations": self.invalidations,
+            "size": len(self._entries),
+            "watches": len(self._watches),
+        }
+
+
+subscription_cache = SubscriptionCache(
+    max_size=settings.SUBSCRIPTION_CACHE_MAX_SIZE,
+    positive_ttl=settings.SUBSCRIPTION_CACHE_POSITIVE_TTL_SECONDS,
+    negative_ttl=settings.SUBSCRIPTION_CACHE_NEGATIVE_TTL_SECONDS,
+    watch_enabled=settings.SUBSCRIPTION_WATCH_ENABLED,
+)
+
+
+async def get_subscription_status(user_id: str, fetch: Callable[[str], Awaitable[bool]]) -> bool:
+    """Devuelve si el usuario tiene suscripción activa, consultando Firestore solo si no está en caché."""
+    if not settings.SUBSCRIPTION_CACHE_ENABLED:
+        return await fetch(user_id)
+
+    cached = subscription_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    is_active = await fetch(user_id)
+    subscription_cache.put(user_id, is_active)
+    return is_active
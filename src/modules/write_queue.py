@@ -0,0 +1,240 @@
+# src/modules/write_queue.py
+
+import os
+import json
+import time
+import random
+import asyncio
+from collections import deque
+from typing import Callable, Deque, Dict, Any, List, Optional
+
+from google.cloud import firestore
+from src.config import log
+from src.core.metrics import Histogram
+
+# Firestore admite hasta 500 operaciones por batch.
+_FIRESTORE_MAX_BATCH = 500
+# Marcador para poder serializar SERVER_TIMESTAMP en el fichero de volcado.
+_SERVER_TIMESTAMP_MARKER = "__SERVER_TIMESTAMP__"
+
+
+class PendingWrite:
+    """Escritura pendiente: la ruta del documento se fija al encolar para que los reintentos sean idempotentes."""
+
+    __slots__ = ("path", "data", "enqueued_at", "attempts")
+
+    def __init__(self, path: str, data: Dict[str, Any], enqueued_at: Optional[float] = None):
+        self.path = path
+        self.data = data
+        self.enqueued_at = enqueued_at or time.time()
+        self.attempts = 0
+
+    def to_json(self) -> str:
+        data = {k: (_SERVER_TIMESTAMP_MARKER if v is firestore.SERVER_TIMESTAMP else v) for k, v in self.data.items()}
+        return json.dumps({"path": self.path, "data": data, "enqueued_at": self.enqueued_at}, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, line: str) -> "PendingWrite":
+        raw = json.loads(line)
+        data = {k: (firestore.SERVER_TIMESTAMP if v == _SERVER_TIMESTAMP_MARKER else v) for k, v in raw["data"].items()}
+        return cls(raw["path"], data, raw.get("enqueued_at"))
+
+
+class WriteBehindQueue:
+    """
+    Cola de escrituras diferidas para Firestore. Agrupa los documentos en batched
+    writes por tamaño o por tiempo, reintenta con backoff, se vacía en el apagado
+    (con plazo) y, opcionalmente, vuelca lo pendiente a un fichero local que se
+    reproduce en el siguiente arranque.
+    """
+
+    def __init__(self, get_db: Callable[[], firestore.AsyncClient], batch_size: int, flush_interval: float,
+                 max_size: int, max_retries: int, spill_path: str = ""):
+        self._get_db = get_db
+        self.batch_size = min(batch_size, _FIRESTORE_MAX_BATCH)
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.max_retries = max_retries
+        self.spill_path = spill_path
+        self._pending: Deque[PendingWrite] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.lag = Histogram()
+        self.commit_latency = Histogram()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    @property
+    def db(self) -> firestore.AsyncClient:
+        return self._get_db()
+
+    def new_document_path(self, collection_path: str) -> str:
+        """Genera el ID del documento en el cliente (como .add()) para fijar la ruta al encolar."""
+        return self.db.collection(collection_path).document().path
+
+    def enqueue(self, path: str, data: Dict[str, Any]):
+        if self._closing:
+            # Tras drain() ya no hay vaciado: la escritura se vuelca o se descarta, nunca se queda en memoria.
+            write = PendingWrite(path, data)
+            if self.spill_path:
+                self._spill([write])
+            else:
+                self.dropped += 1
+                log.error(f"Escritura recibida durante el apagado, se descarta {path}")
+            return
+        if len(self._pending) >= self.max_size:
+            # Cola llena: descartamos la escritura más antigua para no crecer sin límite.
+            dropped = self._pending.popleft()
+            self.dropped += 1
+            log.error(f"Cola de escrituras llena, se descarta {dropped.path}")
+        self._pending.append(PendingWrite(path, data))
+        self._ensure_started()
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def get_pending(self, path: str) -> Optional[Dict[str, Any]]:
+        """Datos de una escritura aún no confirmada (lectura de lo recién escrito)."""
+        for write in reversed(self._pending):
+            if write.path == path:
+                return write.data
+        return None
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def start(self):
+        """Reproduce el volcado del arranque anterior (si existe) y arranca el vaciado periódico."""
+        self._closing = False
+        for write in self._load_spill():
+            self._pending.append(write)
+        self._ensure_started()
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                while self._pending and not self._closing:
+                    await self._flush_batch()
+            except Exception as e:
+                # Un error inesperado no debe parar el vaciado: lo pendiente se reintenta en el siguiente ciclo.
+                log.error(f"Error inesperado vaciando la cola de escrituras: {e}")
+
+    async def _flush_batch(self) -> bool:
+        writes: List[PendingWrite] = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+        started = time.perf_counter()
+        try:
+            # El lote se construye dentro del try: si falla (cliente no disponible, datos no
+            # serializables...) las escrituras ya sacadas de la cola se reintentan o se contabilizan.
+            batch = self.db.batch()
+            for write in writes:
+                batch.set(self.db.document(write.path), write.data)
+            await batch.commit()
+        except asyncio.CancelledError:
+            # Cancelado a mitad (p. ej. plazo de apagado): devolvemos el lote a la cola.
+            # Repetirlo es seguro porque cada escritura es un set() sobre una ruta fija.
+            self._pending.extendleft(reversed(writes))
+            raise
+        except Exception as e:
+            retry = []
+            for write in writes:
+                write.attempts += 1
+                if write.attempts > self.max_retries:
+                    self._give_up(write, e)
+                else:
+                    retry.append(write)
+            # Volvemos a poner las escrituras al frente, respetando su orden.
+            self._pending.extendleft(reversed(retry))
+            attempt = max((w.attempts for w in retry), default=1)
+            delay = random.uniform(0, min(30.0, 0.5 * 2 ** attempt))
+            log.warning(f"Fallo al confirmar batch de {len(writes)} escrituras (reintento en {delay:.1f}s): {e}")
+            await asyncio.sleep(delay)
+            return False
+
+        now = time.time()
+        self.commit_latency.observe(time.perf_counter() - started)
+        for write in writes:
+            self.lag.observe(now - write.enqueued_at)
+        self.written += len(writes)
+        return True
+
+    def _give_up(self, write: PendingWrite, error: Exception):
+        if self.spill_path:
+            self._spill([write])
+        else:
+            self.dropped += 1
+            log.error(f"Escritura descartada tras {write.attempts} intentos ({write.path}): {error}")
+
+    async def drain(self, deadline: float):
+        """Vacía la cola antes del apagado; lo que no se confirme a tiempo se vuelca o se descarta."""
+        self._closing = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+        give_up_at = time.monotonic() + deadline
+        while self._pending and time.monotonic() < give_up_at:
+            try:
+                await asyncio.wait_for(self._flush_batch(), max(give_up_at - time.monotonic(), 0.01))
+            except asyncio.TimeoutError:
+                break
+
+        if self._pending:
+            remaining = list(self._pending)
+            self._pending.clear()
+            if self.spill_path:
+                self._spill(remaining)
+            else:
+                self.dropped += len(remaining)
+                log.error(f"Apagado: se descartan {len(remaining)} escrituras pendientes.")
+        log.info(f"Cola de escrituras vaciada ({self.written} escritas, {self.dropped} descartadas, {self.spilled} volcadas).")
+
+    def _spill(self, writes: List[PendingWrite]):
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for write in writes:
+                    f.write(write.to_json() + "\n")
+            self.spilled += len(writes)
+            log.warning(f"{len(writes)} escrituras volcadas a {self.spill_path}")
+        except OSError as e:
+            self.dropped += len(writes)
+            log.error(f"No se pudieron volcar {len(writes)} escrituras a {self.spill_path}: {e}")
+
+    def _load_spill(self) -> List[PendingWrite]:
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return []
+        writes = []
+        try:
+            with open(self.spill_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        writes.append(PendingWrite.from_json(line))
+            os.remove(self.spill_path)
+            log.info(f"Reproduciendo {len(writes)} escrituras volcadas en el arranque anterior.")
+        except (OSError, ValueError, KeyError) as e:
+            log.error(f"No se pudo leer el volcado de escrituras {self.spill_path}: {e}")
+        return writes
+
+    def get_stats(self) -> Dict[str, Any]:
+        oldest = self._pending[0].enqueued_at if self._pending else None
+        return {
+            "pending": len(self._pending),
+            "oldest_pending_age_seconds": (time.time() - oldest) if oldest else 0.0,
+            "written": self.written,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "lag_seconds": self.lag.snapshot(),
+            "commit_latency_seconds": self.commit_latency.snapshot(),
+        }
@@ -0,0 +1,88 @@
+# tests/conftest.py
+
+"""
+Fixtures compartidas: la app real servida por uvicorn dentro del proceso, con los dobles de
+benchmarks/fakes.py en lugar de Gemini, Firestore, Firebase y el RAG.
+
+Todos los tests usan el mismo event loop (scope de sesión) porque varios módulos crean
+primitivas de asyncio a nivel de módulo (cola de escrituras, registro de streams...).
+"""
+
+import socket
+import asyncio
+
+import httpx
+import pytest
+
+from benchmarks.fakes import FakeBackendConfig, install_fakes
+
+USER_IDS = ["user0", "user1"]
+
+
+def auth_headers(user_id: str) -> dict:
+    return {"Authorization": f"Bearer fake-{user_id}"}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def session_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def fake_config() -> FakeBackendConfig:
+    # Generación corta y determinista: 20 fragmentos de 40 caracteres, uno cada 25 ms.
+    return FakeBackendConfig(
+        ttft_seconds=0.05, tokens_per_second=400.0, output_tokens=200, chunk_tokens=10,
+        jitter=0.0, firestore_latency_seconds=0.001, auth_cpu_seconds=0.0, rag_latency_seconds=0.0,
+    )
+
+
+@pytest.fixture(scope="session")
+def app_server(session_loop, fake_config):
+    """URL base de la app sirviendo en un puerto local (sin lifespan: los clientes son los dobles)."""
+    import uvicorn
+    from src.config import settings
+
+    settings.ANALYSIS_CACHE_ENABLED = False
+    settings.RETRIEVAL_ENABLED = False
+    settings.STARTUP_WARMUP = False
+
+    from src.main import app
+    install_fakes(fake_config, USER_IDS)
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, lifespan="off",
+                                           log_level="warning", access_log=False))
+    server_task = session_loop.create_task(server.serve())
+
+    async def wait_started():
+        while not server.started:
+            await asyncio.sleep(0.01)
+
+    session_loop.run_until_complete(wait_started())
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
+    session_loop.run_until_complete(server_task)
+
+
+@pytest.fixture
+def run(session_loop, app_server):
+    """Ejecuta una corrutina en el loop de la sesión, con el servidor atendiendo peticiones."""
+    def runner(coro):
+        return session_loop.run_until_complete(coro)
+    return runner
+
+
+@pytest.fixture
+def client_factory(app_server):
+    def factory() -> httpx.AsyncClient:
+        return httpx.AsyncClient(base_url=app_server, timeout=httpx.Timeout(10.0))
+    return factory
@@ -0,0 +1,51 @@
+# tests/test_batch_jobs.py
+
+"""Registro de lotes: cupo de memoria de los resultados y cancelación en el apagado."""
+
+import asyncio
+
+from src.modules.batch_jobs import BatchJobRegistry
+
+
+def _finished_job(registry: BatchJobRegistry, analysis: str):
+    job = registry.create("user0", 1)
+    job.add_result({"index": 0, "status": "ok", "analysis": analysis})
+    job.finish()
+    return job
+
+
+def test_finished_jobs_are_evicted_oldest_first_over_the_byte_budget(run):
+    registry = BatchJobRegistry(ttl_seconds=3600, max_jobs=100, max_total_bytes=2500)
+    first = _finished_job(registry, "a" * 1000)
+    second = _finished_job(registry, "b" * 1000)
+    active = registry.create("user0", 2)
+    active.add_result({"index": 0, "status": "ok", "analysis": "c" * 1000})
+    third = _finished_job(registry, "d" * 1000)
+
+    assert registry.get(first.job_id) is None
+    assert registry.get(second.job_id) is None
+    # Los lotes en curso nunca se desalojan, aunque sigan por encima del cupo.
+    assert registry.get(active.job_id) is active
+    assert registry.get(third.job_id) is third
+    assert registry.get_stats()["evictions"] == 2
+
+
+def test_cancel_all_stops_running_jobs(run):
+    registry = BatchJobRegistry(ttl_seconds=3600, max_jobs=100, max_total_bytes=1024 * 1024)
+
+    async def run_item(index, item):
+        if index:
+            await asyncio.sleep(3600)
+        return {"status": "ok"}
+
+    async def scenario():
+        job = registry.create("user0", 3)
+        registry.start(job, [None] * 3, run_item, max_concurrency=3)
+        await asyncio.sleep(0.01)
+        await registry.cancel_all()
+        return job
+
+    job = run(scenario())
+
+    assert job.finished and job.task.done()
+    assert [result["index"] for result in job.results] == [0]
@@ -0,0 +1,23 @@
+# tests/test_delete.py
+
+"""Borrado recursivo: cuenta los documentos anidados y acota las RPCs simultáneas."""
+
+from benchmarks.delete_bench import USER_ID, populate_prequalifications
+from benchmarks.fakes import FakeBackendConfig, FakeFirestore
+from src.config import settings
+from src.modules import firestore_client
+
+
+def test_nested_delete_is_complete_and_bounded(run, monkeypatch):
+    db = FakeFirestore(FakeBackendConfig(firestore_latency_seconds=0.001, jitter=0.0))
+    monkeypatch.setattr(firestore_client, "get_db", lambda: db)
+    monkeypatch.setattr(settings, "DELETE_MAX_CONCURRENCY", 4)
+    populate_prequalifications(db, prequalifications=60, followups=5)
+    documents = len(db.documents)
+
+    deleted = run(firestore_client.delete_prequalifications(USER_ID))
+
+    assert deleted == documents
+    assert db.documents == {}
+    # Páginas, listados de subcolecciones y commits comparten el mismo límite en todos los niveles.
+    assert db.max_in_flight <= 4
@@ -0,0 +1,106 @@
+# tests/test_exporter.py
+
+"""Exportación: Markdown a DOCX y recuperación del pool de procesos cuando un worker muere."""
+
+import io
+import uuid
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from src.core import clients
+from src.modules import exporter
+
+MARKDOWN = """# Hechos
+
+Relato con **negrita** y *cursiva*.
+
+- Primer punto
+- Segundo punto
+
+1. Paso uno
+"""
+
+
+def test_markdown_to_docx():
+    docx = pytest.importorskip("docx")
+
+    data = exporter.render_docx("Precalificación", MARKDOWN)
+
+    document = docx.Document(io.BytesIO(data))
+    texts = [(paragraph.style.name, paragraph.text) for paragraph in document.paragraphs]
+    assert texts[0] == ("Title", "Precalificación")
+    assert ("Heading 1", "Hechos") in texts
+    assert ("List Bullet", "Segundo punto") in texts
+    assert ("List Number", "Paso uno") in texts
+    paragraph = next(p for p in document.paragraphs if p.text == "Relato con negrita y cursiva.")
+    assert [run.text for run in paragraph.runs if run.bold] == ["negrita"]
+    assert [run.text for run in paragraph.runs if run.italic] == ["cursiva"]
+
+
+class _InlineExecutor(Executor):
+    """Ejecutor en el propio proceso; 'broken' simula un pool con un worker muerto por OOM."""
+
+    def __init__(self, broken: bool = False):
+        self.broken = broken
+        self.submitted = 0
+        self.shut_down = False
+
+    def submit(self, fn, *args, **kwargs):
+        self.submitted += 1
+        if self.broken:
+            raise BrokenProcessPool("Un proceso hijo terminó de forma abrupta.")
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.shut_down = True
+
+
+@pytest.fixture
+def pools(monkeypatch):
+    created = []
+
+    def new_pool(**kwargs):
+        created.append(_InlineExecutor())
+        return created[-1]
+
+    broken = _InlineExecutor(broken=True)
+    monkeypatch.setattr(clients, "_process_pool", broken)
+    monkeypatch.setattr(clients, "ProcessPoolExecutor", new_pool)
+    monkeypatch.setitem(exporter._RENDERERS, "docx", lambda title, markdown: f"{title}: {markdown}".encode())
+    return broken, created
+
+
+def test_broken_pool_is_replaced_and_render_retried(run, pools):
+    broken, created = pools
+
+    data = run(exporter.export_document(f"doc-{uuid.uuid4().hex}", "Caso", "Texto", "docx"))
+
+    assert data == b"Caso: Texto"
+    assert broken.submitted == 1 and broken.shut_down
+    assert len(created) == 1 and created[0].submitted == 1
+    assert clients.get_process_pool() is created[0]
+
+    # Las siguientes exportaciones usan el pool nuevo, sin volver a crearlo.
+    run(exporter.export_document(f"doc-{uuid.uuid4().hex}", "Otro", "Texto", "docx"))
+    assert len(created) == 1 and created[0].submitted == 2
+
+
+def test_pool_broken_again_is_discarded_and_error_raised(run, pools, monkeypatch):
+    broken, created = pools
+
+    def new_broken_pool(**kwargs):
+        created.append(_InlineExecutor(broken=True))
+        return created[-1]
+
+    monkeypatch.setattr(clients, "ProcessPoolExecutor", new_broken_pool)
+
+    with pytest.raises(BrokenProcessPool):
+        run(exporter.export_document(f"doc-{uuid.uuid4().hex}", "Caso", "Texto", "docx"))
+
+    assert len(created) == 1 and created[0].shut_down
+    # La siguiente petición parte de un pool nuevo.
+    assert clients._process_pool is None
@@ -0,0 +1,122 @@
+# tests/test_followups.py
+
+"""Seguimiento de precalificaciones: compactación del historial bajo admisión, persistencia del resumen y recarga."""
+
+import pytest
+
+from benchmarks.fakes import FakeBackendConfig, FakeFirestore
+from src.config import settings
+from src.models.chat_models import ChatMessage
+from src.modules import followups, gemini_client, firestore_client
+from src.modules.admission import admission_controller
+
+USER_ID = "user0"
+PREQUALIFICATION_ID = "preq1"
+PATH = f"users/{USER_ID}/prequalifications/{PREQUALIFICATION_ID}"
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeFirestore(FakeBackendConfig(firestore_latency_seconds=0.001, jitter=0.0))
+    monkeypatch.setattr(firestore_client, "get_db", lambda: db)
+    monkeypatch.setattr(firestore_client.write_queue, "_get_db", lambda: db)
+    monkeypatch.setattr(settings, "FOLLOWUP_HISTORY_TOKEN_BUDGET", 100)
+    db.documents[PATH] = {"title": "Caso", "facts": "Relato.", "analysis": "Informe."}
+    for turn in range(8):
+        db.documents[f"{PATH}/messages/t{turn:05d}"] = {
+            "role": "user" if turn % 2 == 0 else "model", "content": f"Mensaje {turn}. " + "x" * 200, "turn": turn,
+        }
+    return db
+
+
+@pytest.fixture
+def summaries(monkeypatch):
+    calls = []
+
+    async def fake_generate_text(system_prompt: str, prompt: str) -> str:
+        calls.append(admission_controller.in_flight)
+        return f"Resumen {len(calls)}."
+
+    monkeypatch.setattr(gemini_client, "generate_text", fake_generate_text)
+    return calls
+
+
+async def _flush_writes():
+    while len(firestore_client.write_queue):
+        await firestore_client.write_queue._flush_batch()
+
+
+def test_history_over_budget_is_compacted_under_admission(run, db, summaries):
+    async def scenario():
+        session = await followups._load_session(USER_ID, PREQUALIFICATION_ID)
+        assert len(session.messages) == 8
+        session.schedule_compaction()
+        assert session.compaction_task is not None
+        await session.compaction_task
+        return session
+
+    session = run(scenario())
+
+    # Cada resumen se pidió con un turno de admisión tomado y lo liberó al terminar.
+    assert summaries and all(in_flight == 1 for in_flight in summaries)
+    assert admission_controller.in_flight == 0
+    assert session.history_tokens() <= settings.FOLLOWUP_HISTORY_TOKEN_BUDGET or len(session.messages) < 4
+    assert session.summary == f"Resumen {len(summaries)}."
+    assert session.summarized_turns + len(session.messages) == 8
+
+
+def test_history_within_budget_is_not_compacted(run, db, summaries, monkeypatch):
+    monkeypatch.setattr(settings, "FOLLOWUP_HISTORY_TOKEN_BUDGET", 10_000)
+
+    async def scenario():
+        session = await followups._load_session(USER_ID, PREQUALIFICATION_ID)
+        session.schedule_compaction()
+        return session
+
+    session = run(scenario())
+
+    assert session.compaction_task is None
+    assert summaries == []
+
+
+def test_summary_is_persisted_and_history_reloads_from_followup_state(run, db, summaries):
+    async def scenario():
+        session = await followups._load_session(USER_ID, PREQUALIFICATION_ID)
+        session.schedule_compaction()
+        await session.compaction_task
+        await _flush_writes()
+        reloaded = await followups._load_session(USER_ID, PREQUALIFICATION_ID)
+        return session, reloaded
+
+    session, reloaded = run(scenario())
+
+    state = db.documents[f"{PATH}/followup_state/summary"]
+    assert state["summary"] == session.summary
+    assert state["summarized_turns"] == session.summarized_turns
+    # La recarga parte del resumen y solo lee los turnos posteriores a los resumidos.
+    assert reloaded.summary == session.summary
+    assert reloaded.summarized_turns == session.summarized_turns
+    assert [m.content for m in reloaded.messages] == [m.content for m in session.messages]
+    assert reloaded.next_turn == 8
+
+
+def test_compaction_is_abandoned_when_admission_queue_is_full(run, db, summaries, monkeypatch):
+    from src.modules.admission import QueueFullError
+
+    def queue_full(user_id):
+        raise QueueFullError(retry_after=1)
+
+    monkeypatch.setattr(admission_controller, "enqueue", queue_full)
+
+    async def scenario():
+        session = await followups._load_session(USER_ID, PREQUALIFICATION_ID)
+        session.schedule_compaction()
+        await session.compaction_task
+        return session
+
+    session = run(scenario())
+
+    assert summaries == []
+    assert session.summary == ""
+    assert len(session.messages) == 8
+    assert session.messages[0] == ChatMessage(role="user", content="Mensaje 0. " + "x" * 200)
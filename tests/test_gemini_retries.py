@@ -0,0 +1,85 @@
+# tests/test_gemini_retries.py
+
+"""Reintentos de Gemini: solo antes del primer token, y mensajes centinela de error cuando no hay respuesta."""
+
+import random
+
+import pytest
+
+from benchmarks.fakes import FakeBackendConfig, FakeGenerativeModel
+from src.config import settings
+from src.modules import gemini_client
+
+SYSTEM_PROMPT = "Prompt de sistema de los tests de reintentos."
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    """Modelo falso propio (sin latencia), con reintentos inmediatos."""
+    def install(**overrides) -> FakeGenerativeModel:
+        config = FakeBackendConfig(ttft_seconds=0.0, tokens_per_second=1e6, output_tokens=30, chunk_tokens=10,
+                                   jitter=0.0, **overrides)
+        fake = FakeGenerativeModel(config)
+        monkeypatch.setattr(gemini_client, "model", fake)
+        monkeypatch.setattr(gemini_client, "model_factory", lambda **kwargs: fake)
+        monkeypatch.setattr(gemini_client, "_model_init_attempted", True)
+        monkeypatch.setattr(gemini_client, "_system_models", {})
+        return fake
+
+    monkeypatch.setattr(settings, "GEMINI_MAX_RETRIES", 2)
+    monkeypatch.setattr(settings, "GEMINI_RETRY_BASE_SECONDS", 0.0)
+    return install
+
+
+def _collect(run, prompt: str = "Pregunta.") -> list:
+    async def scenario():
+        return [text async for text in gemini_client.generate_streaming_response(SYSTEM_PROMPT, prompt, history=[])]
+    return run(scenario())
+
+
+def test_error_before_first_token_is_retried(run, fake_model, monkeypatch):
+    fake = fake_model(error_rate=0.5)
+    # Las dos primeras peticiones fallan (random() < error_rate); el resto, no.
+    draws = iter([0.0, 0.0])
+    monkeypatch.setattr(random, "random", lambda: next(draws, 1.0))
+    retries = gemini_client._stats["retries"]
+
+    parts = _collect(run)
+
+    assert fake.requests == 3
+    assert gemini_client._stats["retries"] == retries + 2
+    assert "".join(parts) == "x" * 120
+    assert not set(parts) & gemini_client.ERROR_MESSAGES
+
+
+def test_error_after_first_token_is_not_retried(run, fake_model):
+    fake = fake_model(mid_stream_error_rate=1.0)
+    retries = gemini_client._stats["retries"]
+
+    parts = _collect(run)
+
+    # Un solo intento: el texto ya emitido no se puede repetir, la generación termina con el centinela.
+    assert fake.requests == 1
+    assert gemini_client._stats["retries"] == retries
+    assert parts == ["x" * 40, gemini_client.GENERATION_ERROR_MESSAGE]
+
+
+def test_exhausted_retries_end_with_the_generation_error_sentinel(run, fake_model):
+    fake = fake_model(error_rate=1.0)
+
+    parts = _collect(run)
+
+    assert fake.requests == settings.GEMINI_MAX_RETRIES + 1
+    assert parts == [gemini_client.GENERATION_ERROR_MESSAGE]
+    with pytest.raises(RuntimeError, match=gemini_client.GENERATION_ERROR_MESSAGE):
+        run(gemini_client.generate_text(SYSTEM_PROMPT, "Pregunta."))
+
+
+def test_missing_model_yields_the_unavailable_sentinel(run, monkeypatch):
+    monkeypatch.setattr(gemini_client, "model", None)
+    monkeypatch.setattr(gemini_client, "_model_init_attempted", True)
+
+    assert _collect(run) == [gemini_client.MODEL_UNAVAILABLE_MESSAGE]
+    with pytest.raises(RuntimeError, match=gemini_client.MODEL_UNAVAILABLE_MESSAGE):
+        run(gemini_client.generate_text(SYSTEM_PROMPT, "Pregunta."))
+    assert gemini_client.ERROR_MESSAGES == {gemini_client.MODEL_UNAVAILABLE_MESSAGE, gemini_client.GENERATION_ERROR_MESSAGE}
@@ -0,0 +1,93 @@
+# tests/test_long_input.py
+
+"""Relatos extensos: las extracciones por segmento cuentan contra GEMINI_MAX_IN_FLIGHT."""
+
+import asyncio
+import uuid
+
+import pytest
+
+from src.config import settings
+from src.modules import gemini_client, long_input
+from src.modules.admission import admission_controller
+
+
+@pytest.fixture
+def observed_in_flight(monkeypatch):
+    """Sustituye generate_text por un doble que anota los turnos concedidos en cada llamada."""
+    observed = []
+
+    async def fake_generate_text(system_prompt: str, prompt: str) -> str:
+        observed.append(admission_controller.in_flight)
+        await asyncio.sleep(0.01)
+        return "Hechos extraídos."
+
+    monkeypatch.setattr(gemini_client, "generate_text", fake_generate_text)
+    monkeypatch.setattr(long_input.segment_digest_cache, "use_firestore", False)
+    return observed
+
+
+def test_segment_calls_take_their_own_admission_ticket(run, monkeypatch, observed_in_flight):
+    monkeypatch.setattr(admission_controller, "max_in_flight", 2)
+    tag = uuid.uuid4().hex
+    segments = [long_input.Segment(index=i, overlap="", body=f"Hecho {i} ({tag})") for i in range(6)]
+
+    async def collect():
+        return [item async for item in long_input.iter_segment_digests(segments, "user0", max_concurrency=6)]
+
+    results = run(collect())
+
+    assert sorted(segment.index for segment, _, _ in results) == list(range(6))
+    assert len(observed_in_flight) == 6
+    # Cada llamada tenía un turno concedido y nunca hubo más de GEMINI_MAX_IN_FLIGHT a la vez.
+    assert 1 <= min(observed_in_flight) and max(observed_in_flight) <= 2
+    assert admission_controller.in_flight == 0
+
+
+def test_batch_item_with_long_facts_completes_with_a_single_slot(run, monkeypatch, observed_in_flight):
+    from src.main import run_batch_item
+    from src.models.schemas import AnalysisRequest
+
+    # Con un solo hueco, retener el turno de la generación final durante la extracción bloquearía el lote.
+    monkeypatch.setattr(admission_controller, "max_in_flight", 1)
+    monkeypatch.setattr(settings, "LONG_INPUT_ENABLED", True)
+    monkeypatch.setattr(settings, "LONG_INPUT_THRESHOLD_TOKENS", 50)
+    monkeypatch.setattr(settings, "LONG_INPUT_SEGMENT_TOKENS", 40)
+    tag = uuid.uuid4().hex
+    facts = "\n\n".join(f"Párrafo {i} del relato ({tag}): " + "hechos " * 20 for i in range(8))
+    item = AnalysisRequest(title="Caso extenso", facts=facts, country_code="CO")
+
+    result = run(asyncio.wait_for(run_batch_item(item, {"uid": "user0"}), timeout=10))
+
+    assert result["status"] == "ok"
+    # Al menos dos extracciones y la generación final, cada una con el único turno disponible.
+    assert len(observed_in_flight) >= 3
+    assert set(observed_in_flight) == {1}
+    assert admission_controller.in_flight == 0
+
+
+def test_speculative_long_input_waits_for_authorization(run, client_factory, monkeypatch, observed_in_flight):
+    from tests.conftest import auth_headers
+    from tests.test_stream_resume import read_events
+
+    # 'unsubscribed' no tiene suscripción en el Firestore falso: la verificación termina en 403.
+    monkeypatch.setattr(settings, "SPECULATIVE_STREAMING_ENABLED", True)
+    monkeypatch.setattr(settings, "LONG_INPUT_ENABLED", True)
+    monkeypatch.setattr(settings, "LONG_INPUT_THRESHOLD_TOKENS", 50)
+    monkeypatch.setattr(settings, "LONG_INPUT_SEGMENT_TOKENS", 40)
+    fake_model = gemini_client.model
+    requests_before = fake_model.requests
+    facts = "\n\n".join(f"Párrafo {i} del relato ({uuid.uuid4().hex}): " + "hechos " * 20 for i in range(8))
+
+    async def scenario():
+        async with client_factory() as client:
+            payload = {"title": "Caso extenso", "facts": facts, "country_code": "CO"}
+            async with client.stream("POST", "/analyze", json=payload, headers=auth_headers("unsubscribed")) as response:
+                return [data for _, data in await read_events(response)]
+
+    events = run(scenario())
+
+    assert events[-1].get("status_code") == 403
+    assert not any(event.get("event") == "segment" for event in events)
+    assert observed_in_flight == []
+    assert fake_model.requests == requests_before
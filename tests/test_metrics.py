@@ -0,0 +1,42 @@
+# tests/test_metrics.py
+
+"""/metrics solo responde con el token de servicio METRICS_TOKEN; sin configurar no existe."""
+
+import pytest
+
+from src.config import settings
+
+
+def _get_metrics(run, client_factory, headers=None):
+    async def scenario():
+        async with client_factory() as client:
+            return await client.get("/metrics", headers=headers or {})
+    return run(scenario())
+
+
+def test_metrics_are_disabled_without_token(run, client_factory, monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "")
+
+    response = _get_metrics(run, client_factory, {"Authorization": "Bearer cualquiera"})
+
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("headers", [None, {"Authorization": "Bearer otro-token"}, {"Authorization": "token-de-scrape"}])
+def test_metrics_reject_missing_or_wrong_token(run, client_factory, monkeypatch, headers):
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "token-de-scrape")
+
+    response = _get_metrics(run, client_factory, headers)
+
+    assert response.status_code == 401
+    assert "firestore_operation_seconds" not in response.text
+
+
+def test_metrics_with_token(run, client_factory, monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "token-de-scrape")
+
+    response = _get_metrics(run, client_factory, {"Authorization": "Bearer token-de-scrape"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "firestore_operation_seconds" in response.text
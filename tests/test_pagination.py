@@ -0,0 +1,89 @@
+# tests/test_pagination.py
+
+"""Listado de conversaciones por páginas con el cursor opaco (v2): ida y vuelta, última página y tokens inválidos."""
+
+import json
+import base64
+import datetime
+
+import pytest
+
+from benchmarks.fakes import FakeBackendConfig, FakeFirestore
+from src.modules import firestore_client
+from src.modules.firestore_client import InvalidPageTokenError, encode_page_token
+
+USER_ID = "user0"
+START = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeFirestore(FakeBackendConfig(firestore_latency_seconds=0.0, jitter=0.0))
+    monkeypatch.setattr(firestore_client, "get_db", lambda: db)
+    for i in range(7):
+        # c2 y c3 comparten fecha: el ID desempata.
+        created_at = START + datetime.timedelta(minutes=2 if i == 3 else i)
+        db.documents[f"users/{USER_ID}/conversations/c{i}"] = {"title": f"Conversación {i}", "created_at": created_at}
+    return db
+
+
+def _list_all(run, page_size: int):
+    pages, token = [], None
+    while True:
+        page = run(firestore_client.list_conversations_page(USER_ID, page_size=page_size, page_token=token))
+        pages.append([item["id"] for item in page["items"]])
+        token = page["next_page_token"]
+        if token is None:
+            return pages
+
+
+def test_pages_follow_the_cursor_newest_first(run, db):
+    pages = _list_all(run, page_size=3)
+
+    assert pages == [["c6", "c5", "c4"], ["c3", "c2", "c1"], ["c0"]]
+
+
+def test_last_full_page_ends_with_an_empty_page(run, db):
+    del db.documents[f"users/{USER_ID}/conversations/c0"]
+
+    pages = _list_all(run, page_size=3)
+
+    # Una página completa no sabe si es la última: la siguiente llega vacía y sin token.
+    assert pages == [["c6", "c5", "c4"], ["c3", "c2", "c1"], []]
+
+
+def test_short_page_has_no_next_token(run, db):
+    page = run(firestore_client.list_conversations_page(USER_ID, page_size=10))
+
+    assert len(page["items"]) == 7
+    assert page["next_page_token"] is None
+
+
+def test_page_token_round_trip():
+    created_at = START + datetime.timedelta(microseconds=123)
+    token = encode_page_token(created_at, "c3")
+
+    assert "=" not in token
+    assert firestore_client.decode_page_token(token) == {"created_at": created_at, "__name__": "c3"}
+
+
+def _token(payload) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("token", [
+    "no-es-base64!",
+    base64.urlsafe_b64encode(b"no es json").decode(),
+    encode_page_token(START, "c3")[:-4],
+    encode_page_token(START, "c3")[::-1],
+    _token(["c3"]),
+    _token({"v": 1, "t": START.isoformat(), "id": "c3"}),
+    _token({"v": 2, "t": "ayer", "id": "c3"}),
+    _token({"v": 2, "t": START.isoformat(), "id": 3}),
+    _token({"v": 2, "t": START.isoformat(), "id": ""}),
+    _token({"v": 2, "t": START.isoformat(), "id": "../otro-usuario/conversations/c3"}),
+], ids=["not_base64", "not_json", "truncated", "reversed", "not_object", "old_version", "bad_date",
+        "id_not_str", "empty_id", "nested_id"])
+def test_malformed_or_tampered_token_is_rejected(run, db, token):
+    with pytest.raises(InvalidPageTokenError):
+        run(firestore_client.list_conversations_page(USER_ID, page_size=3, page_token=token))
@@ -0,0 +1,83 @@
+# tests/test_retrieval_cache.py
+
+"""Recuperación RAG: contrato de la respuesta, espera fuera del turno de admisión y caché de análisis degradados."""
+
+import uuid
+import asyncio
+
+import pytest
+
+from src.config import settings
+from src.modules import gemini_client, retrieval
+from src.modules.analysis_cache import analysis_cache, build_cache_key
+
+
+@pytest.fixture
+def batch_item(monkeypatch):
+    from src.models.schemas import AnalysisRequest
+
+    async def fake_generate_text(system_prompt: str, prompt: str) -> str:
+        return "Análisis."
+
+    monkeypatch.setattr(gemini_client, "generate_text", fake_generate_text)
+    monkeypatch.setattr(settings, "ANALYSIS_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "RETRIEVAL_ENABLED", True)
+    monkeypatch.setattr(analysis_cache, "use_firestore", False)
+    return AnalysisRequest(title="Caso", facts=f"Relato de hechos {uuid.uuid4().hex}.", country_code="MX")
+
+
+@pytest.mark.parametrize("retrieved, cached", [(None, False), ([], True)])
+def test_batch_item_caches_only_when_retrieval_answered(run, monkeypatch, batch_item, retrieved, cached):
+    from src.main import run_batch_item
+
+    async def fake_retrieve(facts, country_code):
+        return retrieved
+
+    monkeypatch.setattr(retrieval, "retrieve", fake_retrieve)
+
+    result = run(run_batch_item(batch_item, {"uid": "user0"}))
+
+    assert result["status"] == "ok"
+    key = build_cache_key(batch_item.facts, batch_item.country_code)
+    assert (run(analysis_cache.get(key)) is not None) == cached
+
+
+def test_batch_item_waits_for_retrieval_outside_the_admission_ticket(run, monkeypatch, batch_item):
+    from src.main import run_batch_item
+    from src.modules.admission import admission_controller
+
+    in_flight_during_retrieval = []
+
+    async def slow_retrieve(facts, country_code):
+        await asyncio.sleep(0.05)
+        in_flight_during_retrieval.append(admission_controller.in_flight)
+        return [retrieval.Passage(text="Artículo 1.", source="Constitución", score=1.0)]
+
+    monkeypatch.setattr(retrieval, "retrieve", slow_retrieve)
+
+    result = run(run_batch_item(batch_item, {"uid": "user0"}))
+
+    assert result["status"] == "ok"
+    assert in_flight_during_retrieval == [0]
+
+
+def test_rag_response_follows_the_documented_contract():
+    passages = retrieval._parse_passages({"results": [
+        {"text": " Artículo 7. ", "source": "Constitución", "score": 0.9},
+        {"text": "Artículo 8."},
+    ]})
+    assert passages == [
+        retrieval.Passage(text="Artículo 7.", source="Constitución", score=0.9),
+        retrieval.Passage(text="Artículo 8.", source="", score=0.0),
+    ]
+
+
+@pytest.mark.parametrize("payload", [
+    [{"text": "Artículo 7."}],
+    {"passages": [{"text": "Artículo 7."}]},
+    {"results": [{"content": "Artículo 7."}]},
+    {"results": [{"text": "Artículo 7.", "score": "alta"}]},
+])
+def test_rag_response_with_another_shape_is_rejected(payload):
+    with pytest.raises(retrieval.InvalidRAGResponseError):
+        retrieval._parse_passages(payload)
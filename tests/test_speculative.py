@@ -0,0 +1,49 @@
+# tests/test_speculative.py
+
+"""Streaming especulativo: la verificación de la suscripción corta o libera la generación en cuanto termina."""
+
+import time
+import uuid
+
+from src.config import settings
+from src.modules import gemini_client
+from tests.conftest import auth_headers
+from tests.test_stream_resume import analysis_text, read_events
+
+
+def _analyze(run, client_factory, user_id: str):
+    async def scenario():
+        async with client_factory() as client:
+            payload = {"title": "Caso", "facts": f"Relato de hechos {uuid.uuid4().hex}.", "country_code": "SV"}
+            started = time.perf_counter()
+            async with client.stream("POST", "/analyze", json=payload, headers=auth_headers(user_id)) as response:
+                events = await read_events(response)
+            return events, time.perf_counter() - started
+    return run(scenario())
+
+
+def test_denied_authorization_cancels_a_slow_generation_immediately(run, client_factory, monkeypatch, fake_config):
+    monkeypatch.setattr(settings, "SPECULATIVE_STREAMING_ENABLED", True)
+    # Gemini tarda en dar el primer token y el heartbeat no llega durante el test.
+    monkeypatch.setattr(fake_config, "ttft_seconds", 5.0)
+    monkeypatch.setattr(settings, "SSE_HEARTBEAT_INTERVAL_SECONDS", 30.0)
+    requests_before = gemini_client.model.requests
+
+    # 'unsubscribed' no tiene suscripción en el Firestore falso.
+    events, elapsed = _analyze(run, client_factory, "unsubscribed")
+
+    assert events[-1][1].get("status_code") == 403
+    assert analysis_text(events) == ""
+    # El 403 no espera al primer fragmento (5 s) ni al heartbeat (30 s).
+    assert elapsed < 2.0
+    assert gemini_client.model.requests <= requests_before + 1
+
+
+def test_granted_authorization_releases_the_generation(run, client_factory, monkeypatch, fake_config):
+    monkeypatch.setattr(settings, "SPECULATIVE_STREAMING_ENABLED", True)
+
+    events, _ = _analyze(run, client_factory, "user0")
+
+    text = analysis_text(events)
+    assert len(text) == fake_config.output_tokens * fake_config.chars_per_token
+    assert not any("status_code" in data for _, data in events)
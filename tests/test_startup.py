@@ -0,0 +1,27 @@
+# tests/test_startup.py
+
+"""Arranque en frío con el lifespan activo: initialize_clients() con los dobles hasta que /status responde."""
+
+from benchmarks.startup_bench import measure_once
+
+# Holgado frente a los ~3 s locales (la mayor parte son imports): detecta regresiones
+# groseras, como volver a abrir clientes reales o bloquear el arranque, sin ser inestable en CI.
+STARTUP_BUDGET_SECONDS = 20.0
+
+
+def test_process_start_to_status_with_fake_clients():
+    result = measure_once(warmup=True)
+
+    assert result["status"]["status"] == "ok"
+    assert result["process_to_status_seconds"] < STARTUP_BUDGET_SECONDS, result
+
+    profile = result["startup_seconds"]
+    # El lifespan ejecutó initialize_clients() completo, calentamiento incluido.
+    for step in ("imports", "firestore", "vertex_ai", "firebase_admin", "warmup_firestore",
+                 "warmup_firebase_certs", "warmup_vertex_model", "initialize_total", "process_to_ready"):
+        assert step in profile, profile
+    assert profile["process_to_ready"] <= result["process_to_status_seconds"]
+
+    # El apagado del lifespan (vaciado de la cola, cierre de clientes) terminó sin errores.
+    assert result["shutdown_complete"], result["stderr"]
+    assert "Traceback" not in result["stderr"], result["stderr"]
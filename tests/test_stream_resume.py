@@ -0,0 +1,117 @@
+# tests/test_stream_resume.py
+
+"""Streams de /analyze reanudables con Last-Event-ID (src/modules/stream_registry.py)."""
+
+import json
+import asyncio
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from src.modules import gemini_client
+from src.modules.stream_registry import stream_registry
+from tests.conftest import auth_headers
+
+FACTS = "Relato de prueba: detención sin orden judicial e incomunicación durante tres días."
+
+
+async def read_events(response, stop_after_text: bool = False) -> List[Tuple[int, Dict[str, Any]]]:
+    """Lee eventos SSE (id, data); con stop_after_text se detiene en el primer evento 'text'."""
+    events, event_id = [], None
+    async for line in response.aiter_lines():
+        if line.startswith("id:"):
+            event_id = int(line[3:])
+        elif line.startswith("data:"):
+            data = json.loads(line[5:])
+            events.append((event_id, data))
+            if stop_after_text and "text" in data:
+                break
+    return events
+
+
+def analysis_text(events: List[Tuple[int, Dict[str, Any]]]) -> str:
+    return "".join(data["text"] for _, data in events if "text" in data)
+
+
+async def start_analysis(client, user_id: str = "user0", stop_after_text: bool = False):
+    payload = {"title": "Caso de prueba", "facts": FACTS, "country_code": "SV"}
+    async with client.stream("POST", "/analyze", json=payload, headers=auth_headers(user_id)) as response:
+        assert response.status_code == 200
+        events = await read_events(response, stop_after_text=stop_after_text)
+        return response.headers["X-Stream-Id"], events
+
+
+@pytest.fixture
+def fake_model():
+    return gemini_client.model
+
+
+def test_resume_after_disconnect_replays_without_new_generation(run, client_factory, fake_model, fake_config):
+    async def scenario():
+        async with client_factory() as client:
+            requests_before = fake_model.requests
+            # El cliente se va tras el primer fragmento de texto (se cierra la conexión).
+            stream_id, first = await start_analysis(client, stop_after_text=True)
+            last_id = first[-1][0]
+            await asyncio.sleep(0.1)
+
+            headers = {**auth_headers("user0"), "Last-Event-ID": str(last_id)}
+            async with client.stream("GET", f"/analyze/{stream_id}", headers=headers) as response:
+                assert response.status_code == 200
+                rest = await read_events(response)
+            return requests_before, first, rest
+
+    requests_before, first, rest = run(scenario())
+
+    ids = [event_id for event_id, _ in first + rest]
+    assert ids == list(range(1, len(ids) + 1))
+    assert rest[-1][1] == {"event": "done"}
+    expected_chars = fake_config.output_tokens * fake_config.chars_per_token
+    assert analysis_text(first + rest) == "x" * expected_chars
+    assert fake_model.requests - requests_before == 1
+
+
+def test_resume_after_buffer_trimmed_returns_410(run, client_factory, monkeypatch):
+    # Un buffer tan pequeño solo conserva los últimos eventos del stream.
+    monkeypatch.setattr(stream_registry, "max_bytes_per_stream", 300)
+
+    async def scenario():
+        async with client_factory() as client:
+            stream_id, events = await start_analysis(client)
+            response = await client.get(
+                f"/analyze/{stream_id}", headers={**auth_headers("user0"), "Last-Event-ID": "1"}
+            )
+            return events, response
+
+    events, response = run(scenario())
+    assert events[-1][1] == {"event": "done"}
+    assert response.status_code == 410
+
+
+def test_resume_other_users_stream_returns_404(run, client_factory):
+    async def scenario():
+        async with client_factory() as client:
+            stream_id, _ = await start_analysis(client, user_id="user0")
+            other = await client.get(f"/analyze/{stream_id}", headers=auth_headers("user1"))
+            unknown = await client.get("/analyze/" + "0" * 32, headers=auth_headers("user0"))
+            return other, unknown
+
+    other, unknown = run(scenario())
+    assert other.status_code == 404
+    assert unknown.status_code == 404
+
+
+def test_abandoned_stream_is_cancelled_after_grace(run, client_factory, monkeypatch):
+    monkeypatch.setattr(stream_registry, "grace_seconds", 0.05)
+
+    async def scenario():
+        async with client_factory() as client:
+            abandoned_before = stream_registry.abandoned
+            stream_id, _ = await start_analysis(client, stop_after_text=True)
+            await asyncio.sleep(0.2)
+            return stream_registry.get(stream_id), stream_registry.abandoned - abandoned_before
+
+    stream, abandoned = run(scenario())
+    assert abandoned == 1
+    assert stream.finished
+    assert b'"done"' not in b"".join(frame for _, frame in stream.events)
@@ -0,0 +1,80 @@
+# tests/test_subscription_cache.py
+
+"""Caché de suscripciones: las escuchas on_snapshot siguen el LRU y no se acumulan."""
+
+import asyncio
+from typing import Dict, List
+
+from src.modules.subscription_cache import SubscriptionCache
+
+
+class _FakeWatch:
+    def __init__(self):
+        self.unsubscribed = False
+
+    def unsubscribe(self):
+        self.unsubscribed = True
+
+
+class _FakeSyncFirestore:
+    """Cliente síncrono mínimo: registra las escuchas por usuario."""
+
+    def __init__(self):
+        self.watches: Dict[str, List[_FakeWatch]] = {}
+        self._user_id = None
+
+    def collection(self, name: str):
+        return self
+
+    def document(self, user_id: str):
+        self._user_id = user_id
+        return self
+
+    def on_snapshot(self, callback):
+        watch = _FakeWatch()
+        self.watches.setdefault(self._user_id, []).append(watch)
+        return watch
+
+
+def _watched_cache(max_size: int, positive_ttl: float = 300) -> SubscriptionCache:
+    cache = SubscriptionCache(max_size=max_size, positive_ttl=positive_ttl, negative_ttl=30, watch_enabled=True)
+    cache._sync_db = _FakeSyncFirestore()
+    return cache
+
+
+def test_invalidated_user_is_unsubscribed_when_evicted(run):
+    cache = _watched_cache(max_size=2)
+
+    async def scenario():
+        cache.put("a", True)
+        cache.put("b", True)
+        # Cambio en la suscripción de 'a': se descarta la entrada, la escucha sigue.
+        cache.invalidate("a")
+        assert cache.get("a") is None
+        assert cache.get_stats()["watches"] == 2
+        cache.put("c", True)
+        cache.put("d", True)
+
+    run(scenario())
+
+    db = cache._sync_db
+    assert db.watches["a"][0].unsubscribed
+    assert db.watches["b"][0].unsubscribed
+    assert not db.watches["c"][0].unsubscribed and not db.watches["d"][0].unsubscribed
+    assert cache.get_stats()["watches"] == 2
+    assert len(cache) == 2
+
+
+def test_expired_entry_is_refreshed_without_resubscribing(run):
+    cache = _watched_cache(max_size=10, positive_ttl=0.01)
+
+    async def scenario():
+        cache.put("a", True)
+        await asyncio.sleep(0.02)
+        assert cache.get("a") is None
+        cache.put("a", True)
+        return cache.get("a")
+
+    assert run(scenario()) is True
+    watches = cache._sync_db.watches["a"]
+    assert len(watches) == 1 and not watches[0].unsubscribed
@@ -0,0 +1,137 @@
+# tests/test_token_verifier.py
+
+"""Verificación RS256 propia de los Firebase ID tokens, con una clave RSA generada en el test."""
+
+import time
+import datetime
+
+import httpx
+import jwt
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from firebase_admin import auth
+
+from src.core import token_verifier
+
+# Referencia tomada al importar: install_fakes sustituye token_verifier._decode_with_keys
+# en los tests que levantan la app.
+decode_with_keys = token_verifier._decode_with_keys
+
+PROJECT_ID = token_verifier._firebase_project_id()
+KID = "test-key"
+
+
+def _self_signed_pem(private_key) -> str:
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "securetoken.test")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name)
+        .public_key(private_key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(private_key, hashes.SHA256())
+    )
+    return certificate.public_bytes(serialization.Encoding.PEM).decode()
+
+
+@pytest.fixture(scope="module")
+def private_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.fixture(scope="module")
+def keys(private_key):
+    return {KID: private_key.public_key()}
+
+
+def make_token(private_key, kid: str = KID, algorithm: str = "RS256", **overrides) -> str:
+    now = int(time.time())
+    claims = {
+        "aud": PROJECT_ID,
+        "iss": f"https://securetoken.google.com/{PROJECT_ID}",
+        "sub": "user-123",
+        "iat": now - 10,
+        "exp": now + 3600,
+        "auth_time": now - 10,
+    }
+    claims.update(overrides)
+    key = private_key if algorithm == "RS256" else "clave-simetrica-de-prueba-32-bytes!"
+    return jwt.encode(claims, key, algorithm=algorithm, headers={"kid": kid})
+
+
+def test_valid_token_is_decoded(private_key, keys):
+    decoded = decode_with_keys(make_token(private_key), keys)
+    assert decoded["uid"] == "user-123"
+
+
+@pytest.mark.parametrize("token_args", [
+    {"kid": "unknown-kid"},
+    {"algorithm": "HS256"},
+    {"aud": "otro-proyecto"},
+    {"iss": "https://securetoken.google.com/otro-proyecto"},
+    {"iat": int(time.time()) + 3600, "exp": int(time.time()) + 7200},
+    {"sub": ""},
+    {"sub": "x" * 129},
+], ids=["unknown_kid", "alg_not_rs256", "wrong_aud", "wrong_iss", "future_iat", "empty_sub", "long_sub"])
+def test_invalid_tokens_are_rejected(private_key, keys, token_args):
+    with pytest.raises(auth.InvalidIdTokenError):
+        decode_with_keys(make_token(private_key, **token_args), keys)
+
+
+def test_expired_token_is_rejected(private_key, keys):
+    now = int(time.time())
+    with pytest.raises(auth.ExpiredIdTokenError):
+        decode_with_keys(make_token(private_key, iat=now - 7200, exp=now - 3600), keys)
+
+
+def test_cached_token_is_not_served_after_exp():
+    cache = token_verifier._DecodedTokenCache(max_size=10)
+    key = cache.key_for("token")
+    cache.put(key, {"uid": "user-123", "exp": time.time() + 0.05})
+
+    assert cache.get(key) is not None
+    time.sleep(0.06)
+    assert cache.get(key) is None
+    assert len(cache) == 0
+
+
+def test_public_keys_refresh_when_cache_control_expires(run, monkeypatch, private_key):
+    other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    # Primera respuesta ya caducada (max-age=0); la segunda, vigente una hora.
+    responses = [
+        ({KID: _self_signed_pem(private_key)}, "public, max-age=0"),
+        ({"rotated": _self_signed_pem(other_key)}, "public, max-age=3600"),
+    ]
+    fetches = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        certs, cache_control = responses[min(len(fetches), len(responses) - 1)]
+        fetches.append(request.url)
+        return httpx.Response(200, json=certs, headers={"Cache-Control": cache_control})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(token_verifier, "get_http_client", lambda: client)
+    store = token_verifier._PublicKeyStore("https://certs.test/securetoken")
+
+    async def scenario():
+        try:
+            first = await store.get_keys()
+            second = await store.get_keys()
+            third = await store.get_keys()
+            return first, second, third
+        finally:
+            store._refresh_task.cancel()
+            await client.aclose()
+
+    first, second, third = run(scenario())
+
+    assert list(first) == [KID]
+    assert list(second) == ["rotated"]
+    # Con max-age vigente no se vuelve a descargar.
+    assert third is second
+    assert len(fetches) == 2
@@ -0,0 +1,102 @@
+# tests/test_write_queue.py
+
+"""Cola de escrituras diferidas: los fallos al construir el lote se reintentan y el vaciado sobrevive a los errores."""
+
+import random
+import asyncio
+
+import pytest
+
+from benchmarks.fakes import FakeBackendConfig, FakeFirestore
+from src.modules.write_queue import WriteBehindQueue
+
+
+class _FlakyFirestore(FakeFirestore):
+    """Firestore cuyo batch() falla las primeras 'failures' veces (o siempre, con None)."""
+
+    def __init__(self, failures=None):
+        super().__init__(FakeBackendConfig(firestore_latency_seconds=0.001, jitter=0.0))
+        self.failures = failures
+        self.batch_calls = 0
+
+    def batch(self):
+        self.batch_calls += 1
+        if self.failures is None or self.batch_calls <= self.failures:
+            raise RuntimeError("Cliente de Firestore no disponible")
+        return super().batch()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(random, "uniform", lambda a, b: 0.0)
+
+
+def _queue(db, max_retries: int = 3) -> WriteBehindQueue:
+    return WriteBehindQueue(lambda: db, batch_size=10, flush_interval=0.01, max_size=100, max_retries=max_retries)
+
+
+async def _settle(queue: WriteBehindQueue, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while len(queue) and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.01)
+
+
+def test_writes_survive_a_failure_building_the_batch(run):
+    db = _FlakyFirestore(failures=2)
+    queue = _queue(db)
+
+    async def scenario():
+        for i in range(5):
+            queue.enqueue(f"docs/d{i}", {"n": i})
+        await _settle(queue)
+        alive = not queue._task.done()
+        await queue.drain(1.0)
+        return alive
+
+    assert run(scenario())
+    assert sorted(db.documents) == [f"docs/d{i}" for i in range(5)]
+    assert queue.written == 5
+    assert queue.dropped == 0
+
+
+def test_writes_are_given_up_after_max_retries_and_the_worker_keeps_running(run):
+    db = _FlakyFirestore()
+    queue = _queue(db, max_retries=1)
+
+    async def scenario():
+        for i in range(3):
+            queue.enqueue(f"docs/d{i}", {"n": i})
+        await _settle(queue)
+        alive = not queue._task.done()
+        await queue.drain(1.0)
+        return alive
+
+    assert run(scenario())
+    assert len(queue) == 0
+    assert queue.dropped == 3
+    assert db.documents == {}
+
+
+def test_worker_survives_an_unexpected_error(run, monkeypatch):
+    db = _FlakyFirestore(failures=0)
+    queue = _queue(db)
+    flush_batch = queue._flush_batch
+    calls = []
+
+    async def failing_once():
+        calls.append(None)
+        if len(calls) == 1:
+            raise RuntimeError("Fallo inesperado")
+        return await flush_batch()
+
+    monkeypatch.setattr(queue, "_flush_batch", failing_once)
+
+    async def scenario():
+        queue.enqueue("docs/d0", {"n": 0})
+        await _settle(queue)
+        alive = not queue._task.done()
+        await queue.drain(1.0)
+        return alive
+
+    assert run(scenario())
+    assert db.documents == {"docs/d0": {"n": 0}}